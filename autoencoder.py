@@ -6,6 +6,8 @@ import theano.tensor as T
 # from theano.tensor.shared_randomstreams import RandomStreams
 from theano.sandbox.rng_mrg import MRG_RandomStreams as RandomStreams
 
+from data_parallel import GradientWorkerPool
+from optimizers import get_optimizer
 from util import get_console_logger
 
 
@@ -18,11 +20,41 @@ class DenoisingAutoencoderIterableTrainer(object):
         self.network = network
         self.learning_rate = T.scalar("learning_rate")
         self.regularization = T.scalar("regularization")
+        # relative size of a batch, see DenoisingAutoencoder.get_cost_updates
+        self.batch_weight = T.scalar("batch_weight")
+
+    def get_train_function(self, optimizer, corruption_level=0., loss="xent"):
+        """
+        Return a function updating the network on a batch, called as
+        train_fn(batch, learning_rate=..., regularization=..., batch_weight=...)
+        and returning the cost on the batch.
+
+        """
+        # Prepare cost/update functions for training
+        cost, updates = self.network.get_cost_updates(
+            learning_rate=self.learning_rate,
+            regularization=self.regularization,
+            corruption_level=corruption_level,
+            loss=loss,
+            optimizer=optimizer,
+            batch_weight=self.batch_weight)
+        # Prepare training functions
+        return theano.function(
+            inputs=[
+                self.network.x,
+                theano.In(self.learning_rate, value=0.1),
+                theano.In(self.regularization, value=0.0),
+                theano.In(self.batch_weight, value=1.0)
+            ],
+            outputs=cost,
+            updates=updates,
+        )
 
     def train(self, batch_iterator, iterations=10000, log=None,
               training_cost_prop_change_threshold=0.0005, learning_rate=0.1,
               regularization=0., corruption_level=0., loss="xent",
-              log_every_batch=1000):
+              log_every_batch=1000, optimizer='sgd', checkpoint_every=None,
+              checkpoint_callback=None, resume_state=None):
         """
         Train on data stored in Theano tensors. Uses minibatch training.
 
@@ -38,33 +70,29 @@ class DenoisingAutoencoderIterableTrainer(object):
 
         Uses L2 regularization.
 
+        optimizer is the update rule, either an Optimizer instance or the
+        name of one (see optimizers.OPTIMIZERS).
+
+        If checkpoint_callback is given, it is called with a dict of the full
+        training state at the end of every iteration, and every
+        checkpoint_every batches within an iteration. Passing such a dict as
+        resume_state continues training from the point where it was saved.
+
         """
         if log is None:
             log = get_console_logger("Autoencoder train")
 
+        optimizer = get_optimizer(optimizer)
+
         log.info(
             "Training params: learning rate=%s, noise ratio=%.1f%%, "
             "regularization=%s" %
             (learning_rate, corruption_level * 100.0, regularization))
-        log.info("Training with SGD")
+        log.info("Training with %s" % optimizer.name)
 
         ######## Compile functions
-        # Prepare cost/update functions for training
-        cost, updates = self.network.get_cost_updates(
-            learning_rate=self.learning_rate,
-            regularization=self.regularization,
-            corruption_level=corruption_level,
-            loss=loss)
-        # Prepare training functions
-        train_fn = theano.function(
-            inputs=[
-                self.network.x,
-                theano.In(self.learning_rate, value=0.1),
-                theano.In(self.regularization, value=0.0)
-            ],
-            outputs=cost,
-            updates=updates,
-        )
+        train_fn = self.get_train_function(
+            optimizer, corruption_level=corruption_level, loss=loss)
         ###########
 
         # Keep a record of costs, so we can plot them
@@ -74,31 +102,76 @@ class DenoisingAutoencoderIterableTrainer(object):
 
         below_threshold_its = 0
 
-        for i in range(iterations):
+        def _training_state(iteration, batch_num, err, corpus_position):
+            return {
+                'iteration': iteration,
+                'batch_num': batch_num,
+                'err': err,
+                'corpus_position': corpus_position,
+                'training_costs': training_costs,
+                'below_threshold_its': below_threshold_its,
+                'weights': self.network.get_weights(),
+                'optimizer_state': optimizer.get_state(),
+                'rng_state': numpy.random.get_state(),
+                'theano_rng_state': self.network.get_rng_state()
+            }
+
+        start_iter = start_batch = 0
+        start_err = 0.0
+        if resume_state is not None:
+            start_iter = resume_state['iteration']
+            start_batch = resume_state['batch_num']
+            start_err = resume_state['err']
+            training_costs = resume_state['training_costs']
+            below_threshold_its = resume_state['below_threshold_its']
+            self.network.set_weights(resume_state['weights'])
+            optimizer.set_state(resume_state['optimizer_state'])
+            numpy.random.set_state(resume_state['rng_state'])
+            self.network.set_rng_state(resume_state['theano_rng_state'])
+            batch_iterator.seek(resume_state['corpus_position'])
+            log.info('Resuming from iteration {}, batch {}'.format(
+                start_iter, start_batch))
+
+        for i in range(start_iter, iterations):
             err = 0.0
-            batch_num = 0
-            for batch_num, batch in enumerate(batch_iterator):
+            # number of batches processed in this iteration, including the
+            # ones processed before resuming from a checkpoint
+            num_processed = 0
+            if i == start_iter and start_batch > 0:
+                # continue a partially completed iteration
+                err = start_err
+                num_processed = start_batch
+            for batch_num, batch in enumerate(batch_iterator, num_processed):
                 # Shuffle the training data between iterations, as one should
                 # with SGD
                 # Just shuffle within batches
                 shuffle = numpy.random.permutation(batch.shape[0])
                 batch[:] = batch[shuffle]
 
-                # Update the model with this batch's data
+                # Update the model with this batch's data, the last batch
+                # might be smaller than batch_size
                 err += train_fn(batch,
                                 learning_rate=learning_rate,
-                                regularization=regularization)
+                                regularization=regularization,
+                                batch_weight=float(batch.shape[0]) /
+                                batch_iterator.batch_size)
+                num_processed += 1
 
                 if (batch_num + 1) % log_every_batch == 0:
                     log.info(
                         'Iteration {}: Processed {:>8d}/{:>8d} batches'.format(
                             i, batch_num + 1, batch_iterator.num_batch))
 
+                if checkpoint_callback is not None and checkpoint_every \
+                        and (batch_num + 1) % checkpoint_every == 0:
+                    checkpoint_callback(_training_state(
+                        i, batch_num + 1, err, batch_iterator.tell()))
+
             log.info(
                 'Iteration {}: Processed {:>8d}/{:>8d} batches'.format(
                     i, batch_iterator.num_batch, batch_iterator.num_batch))
 
-            training_costs.append(err / batch_num)
+            training_costs.append(err / max(num_processed, 1))
 
             log.info(
                 "COMPLETED ITERATION %d: training cost=%.5g" %
@@ -135,6 +208,84 @@ class DenoisingAutoencoderIterableTrainer(object):
                     # Reset the below threshold counter
                     below_threshold_its = 0
 
+            if checkpoint_callback is not None:
+                # the next iteration starts from the beginning of the corpus
+                checkpoint_callback(_training_state(i + 1, 0, 0.0, None))
+
+
+class DataParallelDenoisingAutoencoderIterableTrainer(
+        DenoisingAutoencoderIterableTrainer):
+    """
+    Synchronous data-parallel training: every batch is split among
+    num_workers forked processes computing the gradients on their slices,
+    and the master applies the gradients averaged over the whole batch, so
+    the updates are the same as in DenoisingAutoencoderIterableTrainer with
+    the same batch size (except for the corruption noise, which every worker
+    draws from its own random stream).
+
+    """
+
+    def __init__(self, network, num_workers=2):
+        super(DataParallelDenoisingAutoencoderIterableTrainer, self).__init__(
+            network)
+        assert num_workers > 0, 'num_workers must be a positive integer'
+        self.num_workers = num_workers
+        self.worker_pool = None
+
+    def get_train_function(self, optimizer, corruption_level=0., loss="xent"):
+        params = self.network.params
+        cost = self.network.get_cost(
+            regularization=self.regularization,
+            corruption_level=corruption_level, loss=loss)
+        grad_fn = theano.function(
+            inputs=[
+                self.network.x,
+                theano.In(self.regularization, value=0.0)
+            ],
+            outputs=[cost] + [T.grad(cost, param) for param in params],
+        )
+
+        # the optimizer is applied to the averaged gradients in the master
+        grads = [param.type() for param in params]
+        update_fn = theano.function(
+            inputs=grads + [theano.In(self.learning_rate, value=0.1)],
+            updates=optimizer.get_updates(params, grads, self.learning_rate),
+        )
+
+        # without a different seed, all workers would draw the same noise
+        seed = numpy.random.RandomState().randint(2 ** 30 - self.num_workers)
+
+        def _init_worker(worker_idx):
+            self.network.theano_rng.seed(seed + worker_idx)
+
+        self.worker_pool = GradientWorkerPool(
+            grad_fn, params, self.num_workers, worker_init_fn=_init_worker)
+        self.worker_pool.start()
+
+        def train_fn(batch, learning_rate=0.1, regularization=0.0,
+                     batch_weight=1.0):
+            # the weights are small, so they are simply copied to the workers
+            # before every batch, which also picks up any set_weights()
+            self.worker_pool.sync_params()
+            cost, grads, _ = self.worker_pool.compute_gradients(
+                [batch], extra_inputs=[regularization])
+            if batch_weight != 1.0:
+                for grad in grads:
+                    grad *= batch_weight
+            update_fn(*grads, learning_rate=learning_rate)
+            return cost
+
+        return train_fn
+
+    def train(self, batch_iterator, **kwargs):
+        try:
+            super(DataParallelDenoisingAutoencoderIterableTrainer, self).train(
+                batch_iterator, **kwargs)
+        finally:
+            if self.worker_pool is not None:
+                self.worker_pool.close()
+                self.worker_pool = None
+
 
 class DenoisingAutoencoder(object):
     """Denoising Auto-Encoder class (dA)
@@ -305,6 +456,22 @@ class DenoisingAutoencoder(object):
         self.b.set_value(weights[1])
         self.b_prime.set_value(weights[2])
 
+    def get_rng_state(self):
+        """
+        Return a copy of the states of the random streams used to corrupt the
+        input, which only exist after get_cost_updates() has been called.
+        """
+        return [update[0].get_value()
+                for update in self.theano_rng.state_updates]
+
+    def set_rng_state(self, rng_state):
+        """
+        Set the states of the random streams from a list, like that returned
+        by get_rng_state().
+        """
+        for update, value in zip(self.theano_rng.state_updates, rng_state):
+            update[0].set_value(value)
+
     def get_corrupted_input(self, input, corruption_level):
         """This function keeps ``1-corruption_level`` entries of the inputs the
         same and zero-out randomly selected subset of size ``coruption_level``
@@ -377,9 +544,13 @@ class DenoisingAutoencoder(object):
         return cost
 
     def get_cost_updates(self, learning_rate, regularization,
-                         corruption_level=0., loss="xent"):
+                         corruption_level=0., loss="xent", optimizer=None,
+                         batch_weight=None):
         """ This function computes the cost and the updates for one training
-        step of the dA
+        step of the dA, using plain SGD if optimizer is not given
+
+        If batch_weight is given, the gradients are scaled by it, e.g., by
+        the size of a partial batch relative to the full batch size
 
         """
         cost = self.get_cost(regularization=regularization,
@@ -387,10 +558,13 @@ class DenoisingAutoencoder(object):
 
         # compute the gradients of the cost of the `dA` with respect
         # to its parameters
-        gparams = [T.grad(cost, param) for param in self.params]
+        weighted_cost = cost
+        if batch_weight is not None:
+            weighted_cost = cost * batch_weight
+        gparams = [T.grad(weighted_cost, param) for param in self.params]
         # generate the list of updates
-        updates = [
-            (param, param - learning_rate * gparam)
-            for param, gparam in zip(self.params, gparams)]
+        if optimizer is None:
+            optimizer = get_optimizer('sgd')
+        updates = optimizer.get_updates(self.params, gparams, learning_rate)
 
         return cost, updates
@@ -0,0 +1,90 @@
+import argparse
+import os
+import timeit
+from os.path import join
+
+import numpy
+from numpy.lib.format import open_memmap
+
+from event_index import EventIndex
+from numpy_event_comp_model import NumpyEventCompositionModel
+from rich_script.indexed_corpus import IndexedCorpusReader
+from util import get_console_logger
+
+parser = argparse.ArgumentParser(
+    description='Project all distinct events of a pretraining corpus with '
+                'the event vector network of a model, and build a nearest '
+                'neighbor index over them (see EventIndex), which can be '
+                'queried with query_event_index.py')
+parser.add_argument('corpus_dir',
+                    help='directory of an indexed pretraining corpus')
+parser.add_argument('model_path',
+                    help='directory of a saved EventCompositionModel, or a '
+                         'model archive')
+parser.add_argument('index_dir', help='directory to save the index to')
+parser.add_argument('--batch_size', type=int, default=10000,
+                    help='number of events projected at a time '
+                         '(default: 10000)')
+parser.add_argument('--num_lists', type=int,
+                    help='number of k-means lists (default: square root of '
+                         'the number of distinct events)')
+parser.add_argument('--num_iterations', type=int, default=10,
+                    help='number of k-means iterations (default: 10)')
+parser.add_argument('--sample_size', type=int, default=100000,
+                    help='number of vectors to train k-means on '
+                         '(default: 100000)')
+parser.add_argument('--seed', type=int, default=0,
+                    help='random seed of k-means (default: 0)')
+
+args = parser.parse_args()
+
+log = get_console_logger('build_event_index')
+
+if args.model_path.endswith('.archive'):
+    model = NumpyEventCompositionModel.load_archive(args.model_path)
+else:
+    model = NumpyEventCompositionModel.load_model(args.model_path)
+event_vector_network = model.event_vector_network
+
+log.info('Reading events from {}'.format(args.corpus_dir))
+start_time = timeit.default_timer()
+reader = IndexedCorpusReader('pretraining', args.corpus_dir)
+all_events = numpy.empty((len(reader), 4), dtype=numpy.int32)
+num_read = 0
+for indexed_event in reader:
+    all_events[num_read] = (
+        indexed_event.pred_input, indexed_event.subj_input,
+        indexed_event.obj_input, indexed_event.pobj_input)
+    num_read += 1
+events, counts = numpy.unique(
+    all_events[:num_read], axis=0, return_counts=True)
+del all_events
+log.info('Found {} distinct events in {} events, in {:.2f} seconds'.format(
+    len(events), num_read, timeit.default_timer() - start_time))
+
+start_time = timeit.default_timer()
+if not os.path.exists(args.index_dir):
+    os.makedirs(args.index_dir)
+# projections are written to a temporary memmap, which the index sorts
+projection_file = join(args.index_dir, 'projections.tmp.npy')
+projections = open_memmap(
+    projection_file, mode='w+', dtype=numpy.float32,
+    shape=(len(events), event_vector_network.projection_size))
+for start in range(0, len(events), args.batch_size):
+    batch = events[start:start + args.batch_size]
+    projections[start:start + len(batch)] = event_vector_network.project(
+        batch[:, 0], batch[:, 1], batch[:, 2], batch[:, 3])
+projections.flush()
+log.info('Projected {} events in {:.2f} seconds'.format(
+    len(events), timeit.default_timer() - start_time))
+
+start_time = timeit.default_timer()
+event_index = EventIndex.build(
+    args.index_dir, events, counts, projections, num_lists=args.num_lists,
+    num_iterations=args.num_iterations, sample_size=args.sample_size,
+    seed=args.seed, log=log)
+del projections
+os.remove(projection_file)
+log.info('Built an index of {} lists in {} in {:.2f} seconds'.format(
+    event_index.num_lists, args.index_dir,
+    timeit.default_timer() - start_time))
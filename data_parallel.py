@@ -0,0 +1,187 @@
+import multiprocessing
+import traceback
+
+import numpy
+
+from util import to_shared_memory
+
+
+class GradientWorkerPool(object):
+    """
+    Pool of forked worker processes for synchronous data-parallel training.
+
+    Every batch is split into num_workers slices, each worker computes the
+    cost and gradients on its slice with grad_fn, and compute_gradients()
+    returns their average weighted by the slice sizes, i.e., the cost and
+    gradients on the whole batch, for the caller to apply.
+
+    grad_fn is called with the inputs of a slice (followed by any extra
+    inputs), and must return the cost, the gradients of the first
+    num_dense_grads params (in order), and any other outputs (e.g., sparse
+    gradients), which are returned per worker. The workers read the params
+    from shared memory, so after updating them the caller needs to call
+    sync_params() or sync_param_rows().
+
+    An exception raised in a worker is re-raised by compute_gradients() in
+    the master as a RuntimeError with the traceback of the worker, and a
+    worker that exits without replying (e.g., killed by the OOM killer) is
+    detected every poll_interval seconds, instead of blocking forever.
+
+    """
+
+    def __init__(self, grad_fn, params, num_workers, num_dense_grads=None,
+                 worker_init_fn=None, poll_interval=1.0):
+        assert num_workers > 0, 'num_workers must be a positive integer'
+        self.grad_fn = grad_fn
+        self.params = params
+        self.num_workers = num_workers
+        if num_dense_grads is None:
+            num_dense_grads = len(params)
+        self.num_dense_grads = num_dense_grads
+        # called in every worker with its index after forking
+        self.worker_init_fn = worker_init_fn
+        self.poll_interval = poll_interval
+
+        self.shared_values = []
+        self.grad_buffers = []
+        self.connections = []
+        self.workers = []
+
+    def start(self):
+        self.shared_values = [to_shared_memory(param.get_value(borrow=True))
+                              for param in self.params]
+        for worker_idx in range(self.num_workers):
+            # gradients are written into shared memory instead of being sent
+            # back through the pipe, which would pickle them
+            grad_buffer = [
+                to_shared_memory(numpy.zeros_like(param.get_value(borrow=True)))
+                for param in self.params[:self.num_dense_grads]]
+            master_connection, worker_connection = multiprocessing.Pipe()
+            worker = multiprocessing.Process(
+                target=self.run_worker,
+                args=(worker_idx, worker_connection, grad_buffer))
+            worker.daemon = True
+            worker.start()
+            # only the worker holds this end, so that the master gets an
+            # EOFError instead of blocking if the worker exits
+            worker_connection.close()
+            self.grad_buffers.append(grad_buffer)
+            self.connections.append(master_connection)
+            self.workers.append(worker)
+
+    def close(self):
+        for connection, worker in zip(self.connections, self.workers):
+            if worker.is_alive():
+                try:
+                    connection.send(None)
+                except (IOError, EOFError):
+                    pass
+        for connection, worker in zip(self.connections, self.workers):
+            worker.join(self.poll_interval)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+            connection.close()
+        self.grad_buffers = []
+        self.connections = []
+        self.workers = []
+
+    def sync_params(self, param_indices=None):
+        """
+        Copy the current values of params (all of them, or the ones at
+        param_indices) to the shared memory read by the workers.
+
+        """
+        if param_indices is None:
+            param_indices = range(len(self.params))
+        for param_idx in param_indices:
+            self.shared_values[param_idx][...] = \
+                self.params[param_idx].get_value(borrow=True)
+
+    def sync_param_rows(self, param_idx, row_indices):
+        self.shared_values[param_idx][row_indices] = \
+            self.params[param_idx].get_value(borrow=True)[row_indices]
+
+    def run_worker(self, worker_idx, connection, grad_buffer):
+        # the params of this process read their values from shared memory,
+        # grad_fn never updates them, so they are never replaced
+        for param, shared_value in zip(self.params, self.shared_values):
+            param.set_value(shared_value, borrow=True)
+        if self.worker_init_fn is not None:
+            self.worker_init_fn(worker_idx)
+
+        while True:
+            inputs = connection.recv()
+            if inputs is None:
+                break
+            try:
+                outputs = self.grad_fn(*inputs)
+                for buf, grad in zip(grad_buffer, outputs[1:]):
+                    buf[...] = grad
+                result = \
+                    (float(outputs[0]), outputs[self.num_dense_grads + 1:])
+            except Exception:
+                # the exception itself might not be picklable
+                connection.send((False, traceback.format_exc()))
+            else:
+                connection.send((True, result))
+        connection.close()
+
+    def worker_exited_error(self, worker_idx):
+        worker = self.workers[worker_idx]
+        # wait for the worker to be reaped, to get its exit code
+        worker.join(self.poll_interval)
+        return RuntimeError('worker {} exited with code {}'.format(
+            worker_idx, worker.exitcode))
+
+    def receive(self, worker_idx):
+        """
+        Return the reply of a worker, raising a RuntimeError if it failed or
+        exited.
+
+        """
+        connection = self.connections[worker_idx]
+        worker = self.workers[worker_idx]
+        while not connection.poll(self.poll_interval):
+            if not worker.is_alive():
+                # recv() raises an EOFError, as no process can send anymore
+                break
+        try:
+            success, result = connection.recv()
+        except (IOError, EOFError):
+            raise self.worker_exited_error(worker_idx)
+        if not success:
+            raise RuntimeError(
+                'worker {} failed:\n{}'.format(worker_idx, result))
+        return result
+
+    def compute_gradients(self, batch_inputs, extra_inputs=()):
+        """
+        Return the cost and the gradients of the dense params on a batch,
+        averaged over all slices, and a list of (weight, other outputs) of
+        every worker, where the weight is the fraction of the batch in the
+        slice of the worker.
+
+        """
+        batch_size = len(batch_inputs[0])
+        slices = [s for s in numpy.array_split(
+            numpy.arange(batch_size), self.num_workers) if len(s) > 0]
+        for worker_idx, batch_slice in enumerate(slices):
+            try:
+                self.connections[worker_idx].send(
+                    [batch_input[batch_slice[0]:batch_slice[-1] + 1]
+                     for batch_input in batch_inputs] + list(extra_inputs))
+            except IOError:
+                raise self.worker_exited_error(worker_idx)
+
+        cost = 0.0
+        grads = [numpy.zeros_like(grad) for grad in self.grad_buffers[0]]
+        other_outputs = []
+        for worker_idx, batch_slice in enumerate(slices):
+            worker_cost, worker_outputs = self.receive(worker_idx)
+            weight = float(len(batch_slice)) / batch_size
+            cost += weight * worker_cost
+            for grad, buf in zip(grads, self.grad_buffers[worker_idx]):
+                grad += weight * buf
+            other_outputs.append((weight, worker_outputs))
+        return cost, grads, other_outputs
@@ -1,4 +1,5 @@
-from eval_stats import EvalStats
+from eval_input_cache import EvalInputCache
+from eval_stats import EvalLog, EvalStats
 from most_freq_entity_evaluator import MostFreqEntityEvaluator
 from word2vec_evaluator import Word2VecEvaluator
 from arg_comp_evaluator import ArgumentCompositionEvaluator
@@ -4,6 +4,7 @@ from base_evaluator import BaseEvaluator
 from event_comp_model import EventCompositionModel
 from rich_script import IndexedEvent
 from util import get_class_name, cos_sim
+from word2vec_evaluator import normalize_rows
 
 
 def get_coherence_scores(target_vector, context_vector_list):
@@ -28,6 +29,8 @@ def get_most_coherent(eval_vector_list, context_vector_list,
 
 
 class ArgumentCompositionEvaluator(BaseEvaluator):
+    supports_eval_input_cache = True
+
     def __init__(self, logger=None, use_lemma=True, include_type=True,
                  ignore_first_mention=False, filter_stop_events=True,
                  use_max_score=True):
@@ -102,8 +105,32 @@ class ArgumentCompositionEvaluator(BaseEvaluator):
                     )
                     correct = (most_coherent_idx == rich_arg.get_target_idx())
                     num_choices = len(eval_input_list)
+
+                    kwargs = BaseEvaluator.get_arg_group_info(rich_arg)
+
                     self.eval_stats.add_eval_result(
-                        rich_arg.arg_type, correct, num_choices)
+                        correct,
+                        num_choices,
+                        **kwargs
+                    )
                     self.logger.debug(
                         'Processing {}, correct = {}, num_choices = {}'.format(
                             rich_arg.arg_type, correct, num_choices))
+
+    def evaluate_cached_script(self, eval_input_cache, script_idx,
+                               instance_ids):
+        projection_fn = self.model.event_vector_network.project
+        event_start, event_end = eval_input_cache.get_script_events(script_idx)
+        event_inputs = eval_input_cache.event_inputs[event_start:event_end, :4]
+        pos_matrix = normalize_rows(projection_fn(*event_inputs.T))
+
+        candidate_rows, _ = eval_input_cache.get_candidate_rows(instance_ids)
+        # identical candidates are projected once, so that they tie exactly
+        eval_inputs, eval_inverse = np.unique(
+            eval_input_cache.candidate_inputs[candidate_rows, :4], axis=0,
+            return_inverse=True)
+        eval_matrix = normalize_rows(projection_fn(*eval_inputs.T))
+        coherence_scores = eval_matrix.dot(pos_matrix.T)[eval_inverse]
+        return self.select_cached_candidates(
+            eval_input_cache, script_idx, instance_ids, coherence_scores,
+            use_max_score=self.use_max_score)
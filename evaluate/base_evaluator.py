@@ -1,8 +1,13 @@
 import abc
 import logging
+from collections import OrderedDict
+from os import makedirs
+from os.path import exists, join
 
+import numpy as np
 from tqdm import tqdm
 
+from eval_input_cache import EvalInputCache
 from eval_stats import AccuracyStatsGroup, EvalStats
 from rich_script import RichScript, Script
 from rich_script.rich_argument import RichArgumentWithEntity
@@ -14,6 +19,10 @@ logging.basicConfig(format='%(levelname) s : : %(message)s', level=logging.INFO)
 class BaseEvaluator(object):
     __metaclass__ = abc.ABCMeta
 
+    # whether evaluate_cached_script is implemented, i.e., whether the
+    # evaluator can be run on an EvalInputCache (see evaluate_cache)
+    supports_eval_input_cache = False
+
     def __init__(self, logger, use_lemma=True, include_type=True,
                  include_all_pobj=False, ignore_first_mention=False,
                  filter_stop_events=True):
@@ -41,25 +50,30 @@ class BaseEvaluator(object):
         self.eval_stats.add_accuracy_group(name, accuracy_group)
 
     def add_default_accuracy_groups(self):
-        arg_type_accuracy_group = AccuracyStatsGroup(
+        for name, accuracy_group in \
+                BaseEvaluator.get_default_accuracy_groups().items():
+            self.add_accuracy_group(name, accuracy_group)
+
+    @staticmethod
+    def get_default_accuracy_groups():
+        accuracy_groups = OrderedDict()
+
+        accuracy_groups['arg_type'] = AccuracyStatsGroup(
             'Arg Type', ['SUBJ', 'OBJ', 'POBJ'])
-        self.add_accuracy_group('arg_type', arg_type_accuracy_group)
 
-        pos_accuracy_group = AccuracyStatsGroup(
+        accuracy_groups['pos'] = AccuracyStatsGroup(
             'POS', ['Noun', 'Pronoun', 'Other'])
-        self.add_accuracy_group('pos', pos_accuracy_group)
 
-        ner_accuracy_group = AccuracyStatsGroup(
+        accuracy_groups['ner'] = AccuracyStatsGroup(
             'NER', consts.VALID_NER_TAGS + ['NONE'])
-        self.add_accuracy_group('ner', ner_accuracy_group)
 
-        entity_len_accuracy_group = AccuracyStatsGroup(
+        accuracy_groups['entity_len'] = AccuracyStatsGroup(
             'Entity Length', map(str, range(1, 10)) + ['10+'])
-        self.add_accuracy_group('entity_len', entity_len_accuracy_group)
 
-        mention_idx_accuracy_group = AccuracyStatsGroup(
+        accuracy_groups['mention_idx'] = AccuracyStatsGroup(
             'Mention Index', map(str, range(1, 10)) + ['10+'])
-        self.add_accuracy_group('mention_idx', mention_idx_accuracy_group)
+
+        return accuracy_groups
 
     def set_embedding_model(self, embedding_model):
         assert isinstance(embedding_model, Word2VecModel), \
@@ -99,10 +113,15 @@ class BaseEvaluator(object):
     def evaluate_event_list(self, rich_event_list):
         return
 
-    def evaluate(self, all_scripts, **kwargs):
-        self.set_config(**kwargs)
-        self.log_evaluator_info()
-        self.eval_stats.reset()
+    def iter_rich_event_lists(self, all_scripts):
+        """
+        Build and index the rich script of every script in all_scripts, and
+        yield the doc_name and the list of indexed rich events of every
+        script to be evaluated.
+
+        """
+        # load prep_vocab_list
+        prep_vocab_list = read_vocab_list(consts.PREP_VOCAB_LIST_FILE)
         for script in tqdm(all_scripts, desc='Processed', ncols=100):
             assert isinstance(script, Script), \
                 'every script in all_scripts must be a {} instance'.format(
@@ -119,9 +138,6 @@ class BaseEvaluator(object):
 
             self.logger.debug('Processing script {}'.format(script.doc_name))
 
-            # load prep_vocab_list
-            prep_vocab_list = read_vocab_list(consts.PREP_VOCAB_LIST_FILE)
-
             # build the rich_script from script
             rich_script = RichScript.build(
                 script,
@@ -143,9 +159,185 @@ class BaseEvaluator(object):
             if len(rich_event_list) < 2:
                 continue
 
+            yield script.doc_name, rich_event_list
+
+    def evaluate(self, all_scripts, eval_log_file=None, **kwargs):
+        """
+        Evaluate on all_scripts, with the configs in kwargs (see
+        set_config), and print the accuracy tables. If eval_log_file is
+        given, the log of all decisions is saved to it (see EvalLog), from
+        which the tables can be recomputed and re-sliced later.
+
+        """
+        self.set_config(**kwargs)
+        self.log_evaluator_info()
+        self.eval_stats.reset()
+        for doc_name, rich_event_list in \
+                self.iter_rich_event_lists(all_scripts):
+            self.eval_stats.set_doc_name(doc_name)
             self.evaluate_event_list(rich_event_list)
 
         self.print_stats()
+        if eval_log_file is not None:
+            self.save_eval_log(eval_log_file)
+
+    def save_eval_log(self, eval_log_file):
+        self.eval_stats.eval_log.save(eval_log_file)
+        self.logger.info('saved evaluation log to {}'.format(eval_log_file))
+
+    def get_eval_input_config(self):
+        return dict((key, self.__dict__[key])
+                    for key in EvalInputCache.CONFIG_KEYS)
+
+    def check_eval_input_cache_support(self):
+        if not self.supports_eval_input_cache:
+            raise NotImplementedError(
+                '{} does not support evaluating from an evaluation input '
+                'cache, use evaluate instead'.format(
+                    get_class_name(self.__class__)))
+
+    def build_eval_input_cache(self, all_scripts, corpus_name='',
+                               corpus_fingerprint=None):
+        """
+        Build an EvalInputCache of all_scripts, indexed with the embedding
+        model under the current configs.
+        """
+        self.check_eval_input_cache_support()
+        return EvalInputCache.build(
+            self.iter_rich_event_lists(all_scripts), self.embedding_model,
+            self.get_eval_input_config(), corpus_name=corpus_name,
+            corpus_fingerprint=corpus_fingerprint)
+
+    def load_eval_input_cache(self, cache_dir, corpus_name, all_scripts=None,
+                              corpus_fingerprint=None, **kwargs):
+        """
+        Load the EvalInputCache of the corpus named corpus_name (e.g., the
+        path it is loaded from) for the embedding model and the configs
+        (updated with kwargs) from cache_dir, or build it from all_scripts
+        and save it there if it does not exist yet. corpus_fingerprint
+        identifies the version of the corpus (e.g., get_file_fingerprint of
+        the file it is loaded from), so that a stale cache is not loaded
+        after the corpus is regenerated.
+
+        """
+        self.check_eval_input_cache_support()
+        self.set_config(**kwargs)
+        cache_path = join(cache_dir, EvalInputCache.get_cache_key(
+            corpus_name, self.embedding_model, self.get_eval_input_config(),
+            corpus_fingerprint=corpus_fingerprint))
+        if exists(cache_path):
+            self.logger.info(
+                'loading evaluation input cache from {}'.format(cache_path))
+            eval_input_cache = EvalInputCache.load(cache_path)
+            eval_input_cache.check(
+                self.embedding_model, self.get_eval_input_config(),
+                corpus_fingerprint=corpus_fingerprint)
+            return eval_input_cache
+
+        if all_scripts is None:
+            raise RuntimeError(
+                'evaluation input cache {} does not exist, all_scripts '
+                'are needed to build it'.format(cache_path))
+        self.logger.info('building evaluation input cache of {}'.format(
+            corpus_name))
+        eval_input_cache = self.build_eval_input_cache(
+            all_scripts, corpus_name=corpus_name,
+            corpus_fingerprint=corpus_fingerprint)
+        if not exists(cache_dir):
+            makedirs(cache_dir)
+        self.logger.info(
+            'saving evaluation input cache to {}'.format(cache_path))
+        eval_input_cache.save(cache_path)
+        return eval_input_cache
+
+    def evaluate_cache(self, eval_input_cache, eval_log_file=None,
+                       verbose=True, **kwargs):
+        """
+        Same as evaluate, on the instances in eval_input_cache, which must be
+        built with the vocabulary of the embedding model and the same
+        configs (only ignore_first_mention and evaluator specific configs
+        can be changed). The scripts are not rebuilt or re-indexed, so this
+        is much faster when evaluating many models on the same corpus. The
+        progress bar and the accuracy tables are only shown if verbose is
+        True.
+
+        """
+        assert isinstance(eval_input_cache, EvalInputCache), \
+            'eval_input_cache must be a {} instance'.format(
+                get_class_name(EvalInputCache))
+        self.check_eval_input_cache_support()
+        self.set_config(**kwargs)
+        eval_input_cache.check(
+            self.embedding_model, self.get_eval_input_config())
+        self.log_evaluator_info()
+        self.eval_stats.reset()
+        for script_idx in tqdm(range(eval_input_cache.num_scripts),
+                               desc='Processed', ncols=100,
+                               disable=not verbose):
+            instance_ids = eval_input_cache.get_script_instances(script_idx)
+            if self.ignore_first_mention:
+                instance_ids = instance_ids[
+                    ~eval_input_cache.first_mention[instance_ids]]
+            if len(instance_ids) == 0:
+                continue
+            self.eval_stats.set_doc_name(
+                eval_input_cache.doc_names[script_idx])
+            predictions = self.evaluate_cached_script(
+                eval_input_cache, script_idx, instance_ids)
+            _, candidate_offsets = \
+                eval_input_cache.get_candidate_rows(instance_ids)
+            for instance_id, most_coherent_idx, num_choices in zip(
+                    instance_ids, predictions, np.diff(candidate_offsets)):
+                correct = (most_coherent_idx ==
+                           eval_input_cache.target_idx[instance_id])
+                self.eval_stats.add_eval_result(
+                    correct,
+                    num_choices,
+                    **eval_input_cache.get_arg_group_info(instance_id)
+                )
+
+        if verbose:
+            self.print_stats()
+        if eval_log_file is not None:
+            self.save_eval_log(eval_log_file)
+
+    def evaluate_cached_script(self, eval_input_cache, script_idx,
+                               instance_ids):
+        """
+        Return the index of the most coherent candidate of every instance
+        in instance_ids of a script in eval_input_cache.
+        """
+        raise NotImplementedError(
+            '{} does not support evaluating from an evaluation input '
+            'cache'.format(get_class_name(self.__class__)))
+
+    @staticmethod
+    def select_cached_candidates(eval_input_cache, script_idx, instance_ids,
+                                 candidate_scores, use_max_score=True):
+        """
+        Return the index of the most coherent candidate of every instance,
+        from candidate_scores, the scores of all candidates of instance_ids
+        (in the order of get_candidate_rows) against all events of the
+        script, where the event of the instance itself is left out.
+
+        """
+        event_start, _ = eval_input_cache.get_script_events(script_idx)
+        _, candidate_offsets = \
+            eval_input_cache.get_candidate_rows(instance_ids)
+        predictions = []
+        for instance_idx, instance_id in enumerate(instance_ids):
+            instance_scores = np.delete(
+                candidate_scores[candidate_offsets[instance_idx]:
+                                 candidate_offsets[instance_idx + 1]],
+                eval_input_cache.instance_events[instance_id] - event_start,
+                axis=1)
+            if use_max_score:
+                instance_scores = instance_scores.max(axis=1)
+            else:
+                instance_scores = instance_scores.sum(axis=1)
+            # the first candidate with the highest score
+            predictions.append(int(np.argmax(instance_scores)))
+        return predictions
 
     def print_stats(self):
         self.eval_stats.print_table()
@@ -0,0 +1,289 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from util import consts
+from util.model_archive import read_model_archive, write_model_archive
+
+# increased on every incompatible change of the cached arrays
+EVAL_INPUT_CACHE_VERSION = 1
+
+
+def get_vocab_fingerprint(word2vec):
+    """
+    Return a hash of the vocabulary (words and their indices) of word2vec,
+    which is all the cached inputs depend on (not the vectors).
+    """
+    return hashlib.md5(
+        '\n'.join(word2vec.get_id2word()).encode('utf-8')).hexdigest()
+
+
+def get_file_fingerprint(path):
+    """
+    Return the size and modification time of the file at path, so that the
+    cache of a corpus loaded from it is rebuilt after it is regenerated.
+    """
+    stat = os.stat(path)
+    return '{}:{}'.format(stat.st_size, stat.st_mtime)
+
+
+def _to_index_row(event_input):
+    # (pred, subj, obj, pobj) of IndexedEvent, or
+    # (pred, subj, obj, pobj_1, pobj_2, ...) of IndexedEventMultiPobj
+    return [event_input.get_predicate()] + event_input.get_all_argument()
+
+
+def _to_padded_array(rows):
+    # rows of different lengths (with include_all_pobj) are padded with -1,
+    # which is skipped in the same way as a missing argument
+    num_columns = max([len(row) for row in rows] + [4])
+    array = np.full((len(rows), num_columns), -1, dtype=np.int32)
+    for row_idx, row in enumerate(rows):
+        array[row_idx, :len(row)] = row
+    return array
+
+
+class EvalInputCache(object):
+    """
+    Indexed evaluation instances of a corpus, as built by
+    BaseEvaluator.evaluate, so that any number of models (or checkpoints)
+    can be evaluated without rebuilding and re-indexing the scripts. The
+    inputs only depend on the corpus (and the version of it identified by
+    corpus_fingerprint, see get_file_fingerprint), the word2vec vocabulary
+    and the configs in EvalInputCache.CONFIG_KEYS, which are stored with
+    them.
+
+    For every script (in doc_names), the cache stores the positive input
+    of every indexed event (the contexts), and for every argument with
+    negative candidates (an instance): the row of its event, the inputs and
+    salience features of all candidates, the index of the target, whether
+    it is the first mention, and the argument group info (see
+    BaseEvaluator.get_arg_group_info). Inputs are rows of word indices,
+    (pred, subj, obj, pobj, ...), padded with -1.
+
+    """
+    CONFIG_KEYS = \
+        ['use_lemma', 'include_type', 'include_all_pobj', 'filter_stop_events']
+    GROUP_COLUMNS = ['arg_type', 'pos', 'ner', 'entity_len', 'mention_idx']
+
+    def __init__(self, header, arrays):
+        self.header = header
+        self.config = header['config']
+        self.doc_names = header['doc_names']
+        self.categories = header['categories']
+
+        # rows of the events of script i are
+        # script_event_offsets[i]:script_event_offsets[i+1]
+        self.event_inputs = arrays['event_inputs']
+        self.script_event_offsets = arrays['script_event_offsets']
+        # same for the instances of script i
+        self.script_instance_offsets = arrays['script_instance_offsets']
+        self.instance_events = arrays['instance_events']
+        # rows of the candidates of instance j are
+        # instance_candidate_offsets[j]:instance_candidate_offsets[j+1]
+        self.instance_candidate_offsets = arrays['instance_candidate_offsets']
+        self.target_idx = arrays['target_idx']
+        self.first_mention = arrays['first_mention']
+        self.group_codes = OrderedDict(
+            (column, arrays['group_' + column])
+            for column in self.GROUP_COLUMNS)
+        self.candidate_inputs = arrays['candidate_inputs']
+        # in the order of consts.SALIENCE_FEATURES
+        self.candidate_salience = arrays['candidate_salience']
+
+    @property
+    def num_scripts(self):
+        return len(self.doc_names)
+
+    @property
+    def num_instances(self):
+        return len(self.instance_events)
+
+    @staticmethod
+    def get_cache_key(corpus_name, word2vec, config, corpus_fingerprint=None):
+        """
+        Return the key of the cache of a corpus (identified by corpus_name and
+        corpus_fingerprint) indexed with word2vec under config, used as its
+        file name.
+        """
+        key = json.dumps({
+            'version': EVAL_INPUT_CACHE_VERSION,
+            'corpus_name': corpus_name,
+            'corpus_fingerprint': corpus_fingerprint,
+            'vocab': get_vocab_fingerprint(word2vec),
+            'config': dict((k, config[k]) for k in EvalInputCache.CONFIG_KEYS)
+        }, sort_keys=True)
+        return 'eval_inputs_{}.cache'.format(
+            hashlib.md5(key.encode('utf-8')).hexdigest())
+
+    @classmethod
+    def build(cls, doc_rich_event_lists, word2vec, config, corpus_name='',
+              corpus_fingerprint=None):
+        """
+        Build the cache from pairs of (doc_name, rich_event_list) of all
+        evaluated scripts, as yielded by BaseEvaluator.iter_rich_event_lists.
+        """
+        include_all_pobj = config['include_all_pobj']
+        doc_names = []
+        event_rows = []
+        script_event_offsets = [0]
+        script_instance_offsets = [0]
+        instance_events = []
+        instance_candidate_offsets = [0]
+        target_idx = []
+        first_mention = []
+        group_values = OrderedDict(
+            (column, []) for column in cls.GROUP_COLUMNS)
+        candidate_rows = []
+        candidate_salience = []
+
+        # imported here to avoid a circular import
+        from base_evaluator import BaseEvaluator
+
+        for doc_name, rich_event_list in doc_rich_event_lists:
+            doc_names.append(doc_name)
+            event_offset = len(event_rows)
+            for event_idx, rich_event in enumerate(rich_event_list):
+                event_rows.append(_to_index_row(rich_event.get_pos_input(
+                    include_all_pobj=include_all_pobj)))
+                for rich_arg, eval_input_list in \
+                        rich_event.get_eval_input_list_all(
+                            include_all_pobj=include_all_pobj,
+                            include_salience=True):
+                    instance_events.append(event_offset + event_idx)
+                    for eval_input, arg_salience in eval_input_list:
+                        candidate_rows.append(_to_index_row(eval_input))
+                        candidate_salience.append(
+                            arg_salience.get_feature_list(
+                                consts.SALIENCE_FEATURES))
+                    instance_candidate_offsets.append(len(candidate_rows))
+                    target_idx.append(rich_arg.get_target_idx())
+                    first_mention.append(rich_arg.is_first_mention())
+                    group_info = BaseEvaluator.get_arg_group_info(rich_arg)
+                    for column in cls.GROUP_COLUMNS:
+                        group_values[column].append(group_info[column])
+            script_event_offsets.append(len(event_rows))
+            script_instance_offsets.append(len(instance_events))
+
+        arrays = OrderedDict()
+        arrays['event_inputs'] = _to_padded_array(event_rows)
+        arrays['script_event_offsets'] = \
+            np.asarray(script_event_offsets, dtype=np.int64)
+        arrays['script_instance_offsets'] = \
+            np.asarray(script_instance_offsets, dtype=np.int64)
+        arrays['instance_events'] = np.asarray(instance_events, dtype=np.int64)
+        arrays['instance_candidate_offsets'] = \
+            np.asarray(instance_candidate_offsets, dtype=np.int64)
+        arrays['target_idx'] = np.asarray(target_idx, dtype=np.int32)
+        arrays['first_mention'] = np.asarray(first_mention, dtype=np.bool_)
+        categories = OrderedDict()
+        for column, values in group_values.items():
+            categories[column] = sorted(set(values))
+            codes = dict((value, code) for code, value
+                         in enumerate(categories[column]))
+            arrays['group_' + column] = np.asarray(
+                [codes[value] for value in values], dtype=np.int32)
+        arrays['candidate_inputs'] = _to_padded_array(candidate_rows)
+        arrays['candidate_salience'] = np.asarray(
+            candidate_salience, dtype=np.float32).reshape(
+            -1, len(consts.SALIENCE_FEATURES))
+
+        header = {
+            'eval_input_cache_version': EVAL_INPUT_CACHE_VERSION,
+            'corpus_name': corpus_name,
+            'corpus_fingerprint': corpus_fingerprint,
+            'vocab': get_vocab_fingerprint(word2vec),
+            'config': dict((k, config[k]) for k in cls.CONFIG_KEYS),
+            'doc_names': doc_names,
+            'categories': categories
+        }
+        return cls(header, arrays)
+
+    def save(self, path):
+        arrays = OrderedDict()
+        arrays['event_inputs'] = self.event_inputs
+        arrays['script_event_offsets'] = self.script_event_offsets
+        arrays['script_instance_offsets'] = self.script_instance_offsets
+        arrays['instance_events'] = self.instance_events
+        arrays['instance_candidate_offsets'] = self.instance_candidate_offsets
+        arrays['target_idx'] = self.target_idx
+        arrays['first_mention'] = self.first_mention
+        for column, codes in self.group_codes.items():
+            arrays['group_' + column] = codes
+        arrays['candidate_inputs'] = self.candidate_inputs
+        arrays['candidate_salience'] = self.candidate_salience
+        write_model_archive(path, self.header, arrays)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        header, arrays = read_model_archive(path, mmap_mode=mmap_mode)
+        if header.get('eval_input_cache_version') != \
+                EVAL_INPUT_CACHE_VERSION:
+            raise IOError('{} is not an evaluation input cache of '
+                          'version {}'.format(path, EVAL_INPUT_CACHE_VERSION))
+        return cls(header, arrays)
+
+    def check(self, word2vec, config, corpus_fingerprint=None):
+        """
+        Raise a ValueError if the cache was not built with the vocabulary
+        of word2vec and the configs in config, or (if given) from the version
+        of the corpus identified by corpus_fingerprint.
+        """
+        if corpus_fingerprint is not None and \
+                self.header.get('corpus_fingerprint') != corpus_fingerprint:
+            raise ValueError(
+                'evaluation input cache is built from a different version '
+                'of {}'.format(self.header['corpus_name']))
+        if self.header['vocab'] != get_vocab_fingerprint(word2vec):
+            raise ValueError(
+                'evaluation input cache is built with a different '
+                'word2vec vocabulary')
+        for key in self.CONFIG_KEYS:
+            if self.config[key] != config[key]:
+                raise ValueError(
+                    'evaluation input cache is built with {} = {}, '
+                    'found {}'.format(key, self.config[key], config[key]))
+
+    def get_script_events(self, script_idx):
+        """
+        Return the range of the rows of the events of a script.
+        """
+        return self.script_event_offsets[script_idx], \
+            self.script_event_offsets[script_idx + 1]
+
+    def get_script_instances(self, script_idx):
+        return np.arange(self.script_instance_offsets[script_idx],
+                         self.script_instance_offsets[script_idx + 1])
+
+    def get_candidate_rows(self, instance_ids):
+        """
+        Return the rows of the candidates of all instance_ids (in order),
+        and the offsets of the candidates of each instance in them.
+        """
+        starts = self.instance_candidate_offsets[instance_ids]
+        ends = self.instance_candidate_offsets[np.asarray(instance_ids) + 1]
+        candidate_offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+        candidate_offsets[1:] = np.cumsum(ends - starts)
+        candidate_rows = np.concatenate(
+            [np.arange(start, end) for start, end in zip(starts, ends)] +
+            [np.zeros(0, dtype=np.int64)])
+        return candidate_rows, candidate_offsets
+
+    def get_arg_idx(self, instance_ids):
+        """
+        Return the arg_idx input of the pair composition network (1 for
+        SUBJ, 2 for OBJ, 3 for POBJ) of instance_ids.
+        """
+        arg_types = self.categories['arg_type']
+        code_to_arg_idx = np.asarray(
+            [{'SUBJ': 1, 'OBJ': 2}.get(arg_type, 3) for arg_type in arg_types],
+            dtype=np.int32)
+        return code_to_arg_idx[self.group_codes['arg_type'][instance_ids]]
+
+    def get_arg_group_info(self, instance_id):
+        return dict(
+            (column, self.categories[column][codes[instance_id]])
+            for column, codes in self.group_codes.items())
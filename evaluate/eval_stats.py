@@ -1,10 +1,14 @@
 import abc
+import json
 from collections import OrderedDict
 
+import numpy as np
 from texttable import Texttable
 
+from util import get_class_name
 
-def get_table(header, content):
+
+def get_table(header, content, cols_dtype=None):
 
     table = Texttable()
     table.set_deco(Texttable.BORDER | Texttable.HEADER)
@@ -12,6 +16,8 @@ def get_table(header, content):
     table.set_cols_valign(['m', 'm', 'm', 'm', 'm'])
     table.set_cols_width([15, 10, 10, 15, 15])
     table.set_precision(2)
+    if cols_dtype is not None:
+        table.set_cols_dtype(cols_dtype)
 
     table.header(header)
     for row in content:
@@ -20,26 +26,255 @@ def get_table(header, content):
     return table
 
 
+def get_comparison_table(eval_stats_dict, group_name=None):
+    """
+    Return a table comparing the accuracy of every EvalStats in the
+    OrderedDict eval_stats_dict (e.g., of the checkpoints of a model), one
+    row per name, with the accuracy of all decisions, and of every key of
+    the accuracy group group_name if given.
+
+    """
+    keys = []
+    accuracy_groups = OrderedDict()
+    if group_name is not None:
+        for name, eval_stats in eval_stats_dict.items():
+            accuracy_groups[name] = \
+                eval_stats.get_accuracy_group(group_name).accuracy_dict
+            keys.extend(key for key in accuracy_groups[name]
+                        if key not in keys)
+
+    header = ['', '# Cases', 'All (%)'] + \
+        ['{} (%)'.format(key) for key in keys]
+    num_columns = len(header)
+
+    table = Texttable()
+    table.set_deco(Texttable.BORDER | Texttable.HEADER)
+    table.set_cols_align(['c'] * num_columns)
+    table.set_cols_valign(['m'] * num_columns)
+    table.set_cols_width([15] + [10] * (num_columns - 1))
+    table.set_precision(2)
+
+    table.header(header)
+    for name, eval_stats in eval_stats_dict.items():
+        accuracy_all = eval_stats.get_accuracy_all()
+        row = [name, accuracy_all.num_cases, accuracy_all.get_accuracy()]
+        for key in keys:
+            accuracy = accuracy_groups[name].get(key)
+            row.append(accuracy.get_accuracy() if accuracy is not None else 0)
+        table.add_row(row)
+
+    return table
+
+
+def get_bootstrap_sums(keys, values, num_samples=1000, seed=0,
+                       max_chunk_size=10000000):
+    """
+    Return the sums of values (an array of shape (num_cases, K)) over
+    num_samples bootstrap resamples of the cases, as an array of shape
+    (num_samples, K), where cases with the same row of keys (an integer
+    array of shape (num_cases, M)) must have the same values.
+
+    Resampling the cases with replacement is the same as drawing the counts
+    of the distinct rows of keys from a multinomial distribution, so the
+    resamples are drawn as count matrices of shape (samples, distinct rows)
+    in chunks of at most max_chunk_size elements, and summed up with one
+    matrix product per chunk.
+
+    """
+    values = np.asarray(values, dtype=np.float64)
+    num_cases = len(values)
+    if num_cases == 0:
+        return np.zeros((num_samples, values.shape[1]))
+    _, first_cases, cell_counts = np.unique(
+        keys, axis=0, return_index=True, return_counts=True)
+    cell_values = values[first_cases]
+    cell_probs = cell_counts / float(num_cases)
+
+    random_state = np.random.RandomState(seed)
+    chunk_size = max(max_chunk_size // len(cell_counts), 1)
+    sums = np.empty((num_samples, values.shape[1]))
+    for start in range(0, num_samples, chunk_size):
+        size = min(chunk_size, num_samples - start)
+        sums[start:start + size] = random_state.multinomial(
+            num_cases, cell_probs, size=size).dot(cell_values)
+    return sums
+
+
+def _get_percentiles(samples, confidence):
+    # (low, high) of the confidence interval, ignoring the resamples where
+    # the value is undefined (a group without any case)
+    samples = samples[~np.isnan(samples)]
+    if len(samples) == 0:
+        return 0.0, 0.0
+    alpha = (1. - confidence) / 2. * 100.
+    low, high = np.percentile(samples, [alpha, 100. - alpha])
+    return float(low), float(high)
+
+
+class EvalLog(object):
+    """
+    Columnar log of every evaluation decision: whether it is correct, the
+    number of choices, and categorical columns (the groups of the argument,
+    see BaseEvaluator.get_arg_group_info, and the document name), stored in
+    a numpy structured array as codes into a list of categories per column,
+    with -1 for missing values.
+
+    All accuracy tables are computed from the log by vectorized group-bys,
+    and it can be saved and loaded again to re-slice the results without
+    rerunning the evaluation.
+
+    """
+    CATEGORY_COLUMNS = \
+        ['arg_type', 'pos', 'ner', 'entity_len', 'mention_idx', 'doc_name']
+
+    def __init__(self, capacity=1024):
+        self.dtype = np.dtype(
+            [('correct', np.bool_), ('num_choices', np.int32)] +
+            [(column, np.int32) for column in self.CATEGORY_COLUMNS])
+        self.capacity = capacity
+        self.records = None
+        self.size = 0
+        self.categories = None
+        self.category_codes = None
+        self.reset()
+
+    def __len__(self):
+        return self.size
+
+    def reset(self):
+        self.records = np.zeros(self.capacity, dtype=self.dtype)
+        self.size = 0
+        self.categories = OrderedDict(
+            (column, []) for column in self.CATEGORY_COLUMNS)
+        self.category_codes = dict(
+            (column, {}) for column in self.CATEGORY_COLUMNS)
+
+    def get_code(self, column, value):
+        codes = self.category_codes[column]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.categories[column])
+            self.categories[column].append(value)
+        return code
+
+    def add(self, correct, num_choices, **kwargs):
+        """
+        Record a decision, with the values of the categorical columns as
+        kwargs (others are ignored).
+        """
+        if self.size == len(self.records):
+            self.records = np.resize(self.records, 2 * len(self.records))
+        record = self.records[self.size:self.size + 1]
+        record['correct'] = correct
+        record['num_choices'] = num_choices
+        for column in self.CATEGORY_COLUMNS:
+            value = kwargs.get(column)
+            record[column] = \
+                -1 if value is None else self.get_code(column, value)
+        self.size += 1
+
+    def get_records(self):
+        return self.records[:self.size]
+
+    def get_mask(self, **conditions):
+        """
+        Return a boolean mask of the decisions where each column given as a
+        keyword has the given value (or one of the values, if it is a list).
+        """
+        records = self.get_records()
+        mask = np.ones(self.size, dtype=np.bool_)
+        for column, values in conditions.items():
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            codes = [self.category_codes[column][value] for value in values
+                     if value in self.category_codes[column]]
+            mask &= np.in1d(records[column], codes)
+        return mask
+
+    def get_totals(self, mask=None):
+        """
+        Return the number of cases, the number of correct ones, and the
+        total number of choices (of the decisions in mask, if given).
+        """
+        records = self.get_records()
+        if mask is not None:
+            records = records[mask]
+        return len(records), int(records['correct'].sum()), \
+            int(records['num_choices'].sum())
+
+    def group_by(self, column, mask=None):
+        """
+        Return an OrderedDict of every category of column (in the order
+        they are first seen) to the totals of get_totals() of its decisions
+        (in mask, if given).
+        """
+        records = self.get_records()
+        if mask is not None:
+            records = records[mask]
+        records = records[records[column] != -1]
+        num_categories = len(self.categories[column])
+        codes = records[column]
+        num_cases = np.bincount(codes, minlength=num_categories)
+        num_positives = np.bincount(
+            codes, weights=records['correct'], minlength=num_categories)
+        total_choices = np.bincount(
+            codes, weights=records['num_choices'], minlength=num_categories)
+        return OrderedDict(
+            (category, (int(num_cases[code]), int(num_positives[code]),
+                        int(total_choices[code])))
+            for code, category in enumerate(self.categories[column]))
+
+    def get_values(self, column):
+        """
+        Return the values of column of all decisions, as an object array
+        with None for missing values.
+        """
+        categories = np.empty(len(self.categories[column]) + 1, dtype=object)
+        categories[:-1] = self.categories[column]
+        return categories[self.get_records()[column]]
+
+    def save(self, fname):
+        """
+        Save the log to fname (in the npz format), which is written through
+        a file object, as np.savez would append .npz to a file name without
+        that extension, and load would not find it.
+        """
+        with open(fname, 'wb') as f:
+            np.savez(f, records=self.get_records(),
+                     categories=np.array(json.dumps(self.categories)))
+
+    @classmethod
+    def load(cls, fname):
+        data = np.load(fname)
+        eval_log = cls(capacity=max(len(data['records']), 1))
+        records = data['records']
+        eval_log.records[:len(records)] = records
+        eval_log.size = len(records)
+        categories = json.loads(str(data['categories']))
+        for column in cls.CATEGORY_COLUMNS:
+            for value in categories.get(column, []):
+                eval_log.get_code(column, value)
+        return eval_log
+
+
 class AccuracyStats(object):
-    def __init__(self):
-        self.num_cases = 0
-        self.num_positives = 0
-        self.num_choices = []
+    def __init__(self, num_cases=0, num_positives=0, total_choices=0):
+        self.num_cases = num_cases
+        self.num_positives = num_positives
+        self.total_choices = total_choices
 
     def reset(self):
         self.num_cases = 0
         self.num_positives = 0
-        self.num_choices = []
+        self.total_choices = 0
 
     def add_eval_result(self, correct, num_choices):
         self.num_cases += 1
         self.num_positives += correct
-        self.num_choices.append(num_choices)
+        self.total_choices += num_choices
         # self.check_consistency()
 
     def check_consistency(self):
-        assert len(self.num_choices) == self.num_cases, \
-            'Length of num_choices not equal to number of cases.'
         assert 0 <= self.num_positives <= self.num_cases, \
             'Number of positive cases must be positive and ' \
             'smaller than number of cases'
@@ -47,7 +282,7 @@ class AccuracyStats(object):
     def add_accuracy_stats(self, accuracy_stats):
         self.num_cases += accuracy_stats.num_cases
         self.num_positives += accuracy_stats.num_positives
-        self.num_choices.extend(accuracy_stats.num_choices)
+        self.total_choices += accuracy_stats.total_choices
         # self.check_consistency()
 
     def get_accuracy(self):
@@ -58,7 +293,7 @@ class AccuracyStats(object):
 
     def get_avg_choices(self):
         if self.num_cases != 0:
-            return float(sum(self.num_choices)) / self.num_cases
+            return float(self.total_choices) / self.num_cases
         else:
             return 0.0
 
@@ -123,53 +358,252 @@ class AccuracyStatsGroup(object):
 
 
 class EvalStats(object):
+    """
+    Evaluation results, recorded in an EvalLog, and reported as the
+    accuracy of all decisions and of the accuracy groups added (by the
+    column of the log with the same name as the group).
+
+    The tables can be restricted to the decisions in a mask of the log,
+    e.g., eval_log.get_mask(arg_type='SUBJ').
+
+    """
+
     def __init__(self):
-        self.accuracy_all = AccuracyStats()
+        self.eval_log = EvalLog()
         self.accuracy_group_dict = OrderedDict()
+        # name of the document recorded with the results added
+        self.doc_name = None
 
     def add_accuracy_group(self, name, accuracy_group):
         assert name not in self.accuracy_group_dict
+        assert name in EvalLog.CATEGORY_COLUMNS, \
+            'accuracy group name must be one of {}'.format(
+                EvalLog.CATEGORY_COLUMNS)
         self.accuracy_group_dict[name] = accuracy_group
 
+    def set_doc_name(self, doc_name):
+        self.doc_name = doc_name
+
     def add_eval_result(self, correct, num_choices, **kwargs):
-        self.accuracy_all.add_eval_result(correct, num_choices)
-        if kwargs is not None:
-            for name, key in kwargs.iteritems():
-                if name in self.accuracy_group_dict:
-                    self.accuracy_group_dict[name].add_eval_result(
-                        key, correct, num_choices)
+        kwargs.setdefault('doc_name', self.doc_name)
+        self.eval_log.add(correct, num_choices, **kwargs)
 
     def reset(self):
-        self.accuracy_all.reset()
-        for accuracy_group in self.accuracy_group_dict.values():
-            accuracy_group.reset()
+        # a new log, so that the log of the last evaluation can be kept
+        self.eval_log = EvalLog()
+        self.doc_name = None
+
+    @classmethod
+    def from_eval_log(cls, eval_log, accuracy_group_dict):
+        eval_stats = cls()
+        eval_stats.eval_log = eval_log
+        for name, accuracy_group in accuracy_group_dict.items():
+            eval_stats.add_accuracy_group(name, accuracy_group)
+        return eval_stats
+
+    def get_accuracy_all(self, mask=None):
+        return AccuracyStats(*self.eval_log.get_totals(mask=mask))
+
+    def get_accuracy_group(self, name, mask=None):
+        """
+        Return a new AccuracyStatsGroup of the accuracy group name, with the
+        keys of the group first and then any other ones in the log.
+        """
+        accuracy_group = self.accuracy_group_dict[name]
+        result = AccuracyStatsGroup(
+            accuracy_group.desc, accuracy_group.accuracy_dict.keys())
+        for key, totals in self.eval_log.group_by(name, mask=mask).items():
+            result.accuracy_dict[key] = AccuracyStats(*totals)
+        return result
+
+    @property
+    def accuracy_all(self):
+        return self.get_accuracy_all()
 
     def __str__(self):
-        result = 'All: {}\n'.format(self.accuracy_all)
-        for accuracy_group in self.accuracy_group_dict.values():
-            result += str(accuracy_group)
+        result = 'All: {}\n'.format(self.get_accuracy_all())
+        for name in self.accuracy_group_dict:
+            result += str(self.get_accuracy_group(name))
         return result
 
     def pretty_print(self):
-        result = 'All: {}\n'.format(self.accuracy_all.pretty_print())
-        for accuracy_group in self.accuracy_group_dict.values():
-            result += accuracy_group.pretty_print()
+        result = 'All: {}\n'.format(self.get_accuracy_all().pretty_print())
+        for name in self.accuracy_group_dict:
+            result += self.get_accuracy_group(name).pretty_print()
         return result
 
-    def print_table(self):
+    def print_table(self, mask=None):
         header = ['', '# Cases', '# Correct', 'Accuracy (%)', 'Avg # Choices']
 
+        accuracy_all = self.get_accuracy_all(mask=mask)
         content = [[
             'All',
-            self.accuracy_all.num_cases,
-            self.accuracy_all.num_positives,
-            self.accuracy_all.get_accuracy(),
-            self.accuracy_all.get_avg_choices()
+            accuracy_all.num_cases,
+            accuracy_all.num_positives,
+            accuracy_all.get_accuracy(),
+            accuracy_all.get_avg_choices()
         ]]
 
         table = get_table(header, content)
         print
         print table.draw()
 
-        for accuracy_group in self.accuracy_group_dict.values():
-            accuracy_group.print_table()
+        for name in self.accuracy_group_dict:
+            self.get_accuracy_group(name, mask=mask).print_table()
+
+    def _get_bootstrap_cases(self, group_names, mask):
+        # the decisions in mask, and the (name, key) and the indicator
+        # column (over the decisions) of all decisions and of every key of
+        # the accuracy groups in group_names
+        records = self.eval_log.get_records()
+        if mask is not None:
+            records = records[mask]
+        rows = [(None, 'All')]
+        indicators = [np.ones(len(records), dtype=np.bool_)]
+        for name in group_names:
+            codes = self.eval_log.category_codes[name]
+            for key in self.get_accuracy_group(name).accuracy_dict:
+                rows.append((name, key))
+                indicators.append(records[name] == codes.get(key, -2))
+        return records, rows, np.column_stack(indicators)
+
+    def get_bootstrap_intervals(self, group_names=None, mask=None,
+                                num_samples=1000, confidence=0.95, seed=0):
+        """
+        Return an OrderedDict of (None, 'All') and (name, key) of every key
+        of the accuracy groups in group_names (all by default) to the number
+        of cases, the accuracy, and the low and high ends of its bootstrap
+        percentile confidence interval, of the decisions in mask.
+
+        All intervals are computed from the same num_samples resamples of
+        the log (see get_bootstrap_sums), without rerunning the evaluation.
+
+        """
+        if group_names is None:
+            group_names = self.accuracy_group_dict.keys()
+        records, rows, indicators = \
+            self._get_bootstrap_cases(group_names, mask)
+        correct = records['correct']
+        keys = np.column_stack(
+            [correct] + [records[name] for name in group_names])
+        values = np.hstack([indicators, indicators & correct[:, np.newaxis]])
+        sums = get_bootstrap_sums(
+            keys, values, num_samples=num_samples, seed=seed)
+        num_rows = len(rows)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            accuracies = 100. * sums[:, num_rows:] / sums[:, :num_rows]
+
+        result = OrderedDict()
+        for row_idx, row in enumerate(rows):
+            accuracy = AccuracyStats(
+                int(values[:, row_idx].sum()),
+                int(values[:, num_rows + row_idx].sum()))
+            result[row] = (accuracy.num_cases, accuracy.get_accuracy()) + \
+                _get_percentiles(accuracies[:, row_idx], confidence)
+        return result
+
+    def get_paired_bootstrap(self, other, group_names=None, mask=None,
+                             num_samples=1000, confidence=0.95, seed=0):
+        """
+        Compare with other, the EvalStats of another model on the same
+        decisions (in the same order), by a paired bootstrap: return an
+        OrderedDict of the same keys as get_bootstrap_intervals to the number
+        of cases, the difference of accuracy (this one minus other), the low
+        and high ends of its confidence interval, and the fraction of the
+        resamples where the difference is not in the observed direction (an
+        approximate one-sided p-value).
+
+        """
+        assert isinstance(other, EvalStats), \
+            'other must be a {} instance'.format(get_class_name(EvalStats))
+        if len(self.eval_log) != len(other.eval_log) or not all(
+                np.array_equal(self.eval_log.get_values(column),
+                               other.eval_log.get_values(column))
+                for column in EvalLog.CATEGORY_COLUMNS):
+            raise ValueError(
+                'cannot compare evaluation logs of different decisions')
+        if group_names is None:
+            group_names = self.accuracy_group_dict.keys()
+        records, rows, indicators = \
+            self._get_bootstrap_cases(group_names, mask)
+        correct = records['correct']
+        other_correct = other.eval_log.get_records()['correct']
+        if mask is not None:
+            other_correct = other_correct[mask]
+        keys = np.column_stack(
+            [correct, other_correct] +
+            [records[name] for name in group_names])
+        values = np.hstack([
+            indicators, indicators & correct[:, np.newaxis],
+            indicators & other_correct[:, np.newaxis]])
+        sums = get_bootstrap_sums(
+            keys, values, num_samples=num_samples, seed=seed)
+        num_rows = len(rows)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            differences = 100. * (
+                sums[:, num_rows:2 * num_rows] - sums[:, 2 * num_rows:]) / \
+                sums[:, :num_rows]
+
+        result = OrderedDict()
+        for row_idx, row in enumerate(rows):
+            accuracy = AccuracyStats(
+                int(values[:, row_idx].sum()),
+                int(values[:, num_rows + row_idx].sum()))
+            other_accuracy = AccuracyStats(
+                int(values[:, row_idx].sum()),
+                int(values[:, 2 * num_rows + row_idx].sum()))
+            difference = \
+                accuracy.get_accuracy() - other_accuracy.get_accuracy()
+            samples = differences[:, row_idx]
+            samples = samples[~np.isnan(samples)]
+            if difference > 0:
+                p_value = np.mean(samples <= 0)
+            elif difference < 0:
+                p_value = np.mean(samples >= 0)
+            else:
+                p_value = 1.0
+            result[row] = (accuracy.num_cases, difference) + \
+                _get_percentiles(samples, confidence) + \
+                (float(p_value) if len(samples) else 1.0,)
+        return result
+
+    def _print_bootstrap_tables(self, result, header, format_row,
+                                cols_dtype=None):
+        # one table for all decisions and one for every accuracy group,
+        # in the same layout as print_table
+        contents = OrderedDict()
+        for (name, key), values in result.items():
+            contents.setdefault(name, []).append(format_row(key, values))
+        for name, content in contents.items():
+            desc = self.accuracy_group_dict[name].desc \
+                if name is not None else ''
+            table = get_table([desc] + header, content, cols_dtype=cols_dtype)
+            if name is None:
+                print
+            print table.draw()
+
+    def print_bootstrap_table(self, group_names=None, mask=None,
+                              num_samples=1000, confidence=0.95, seed=0):
+        result = self.get_bootstrap_intervals(
+            group_names=group_names, mask=mask, num_samples=num_samples,
+            confidence=confidence, seed=seed)
+        self._print_bootstrap_tables(
+            result,
+            ['# Cases', 'Accuracy (%)', 'CI Low (%)', 'CI High (%)'],
+            lambda key, values: [key] + list(values))
+
+    def print_paired_bootstrap_table(self, other, group_names=None,
+                                     mask=None, num_samples=1000,
+                                     confidence=0.95, seed=0):
+        result = self.get_paired_bootstrap(
+            other, group_names=group_names, mask=mask,
+            num_samples=num_samples, confidence=confidence, seed=seed)
+        self._print_bootstrap_tables(
+            result,
+            ['# Cases', 'Diff (%)', '{:g}% CI (%)'.format(confidence * 100),
+             'p-value'],
+            lambda key, values: [
+                key, values[0], values[1],
+                '[{:.2f}, {:.2f}]'.format(values[2], values[3]),
+                '{:.4f}'.format(values[4])],
+            cols_dtype=['a', 'a', 'a', 't', 't'])
@@ -3,10 +3,12 @@ import numpy as np
 from base_evaluator import BaseEvaluator
 from event_comp_model import EventCompositionModel
 from rich_script import IndexedEvent
-from util import get_class_name
+from util import consts, get_class_name
 
 
 class EventCompositionEvaluator(BaseEvaluator):
+    supports_eval_input_cache = True
+
     def __init__(self, logger=None, use_lemma=True, include_type=True,
                  ignore_first_mention=False, filter_stop_events=True,
                  use_max_score=True):
@@ -130,3 +132,46 @@ class EventCompositionEvaluator(BaseEvaluator):
                     self.logger.debug(
                         'Processing {}, correct = {}, num_choices = {}'.format(
                             rich_arg.arg_type, correct, num_choices))
+
+    def evaluate_cached_script(self, eval_input_cache, script_idx,
+                               instance_ids):
+        pair_composition_network = self.model.pair_composition_network
+        event_start, event_end = eval_input_cache.get_script_events(script_idx)
+        event_inputs = eval_input_cache.event_inputs[event_start:event_end, :4]
+        num_events = len(event_inputs)
+
+        candidate_rows, candidate_offsets = \
+            eval_input_cache.get_candidate_rows(instance_ids)
+        # every candidate is scored with the arg_idx and salience of its
+        # argument, identical ones are scored once, so that they tie exactly
+        candidate_keys = [
+            eval_input_cache.candidate_inputs[candidate_rows, :4],
+            np.repeat(eval_input_cache.get_arg_idx(instance_ids),
+                      np.diff(candidate_offsets))[:, np.newaxis]]
+        if pair_composition_network.use_salience:
+            candidate_keys.append(eval_input_cache.candidate_salience[
+                candidate_rows][:, [
+                    consts.SALIENCE_FEATURES.index(feature) for feature
+                    in pair_composition_network.salience_features]])
+        candidate_keys, candidate_inverse = np.unique(
+            np.hstack(candidate_keys).astype(np.float32), axis=0,
+            return_inverse=True)
+        num_candidates = len(candidate_keys)
+
+        # score all (context event, candidate) pairs with one call
+        inputs_a = np.tile(event_inputs, (num_candidates, 1))
+        inputs_b = np.repeat(
+            candidate_keys[:, :4].astype(np.int32), num_events, axis=0)
+        pair_inputs = [inputs_a[:, i] for i in range(4)] + \
+            [inputs_b[:, i] for i in range(4)] + \
+            [np.repeat(candidate_keys[:, 4], num_events)]
+        if pair_composition_network.use_salience:
+            pair_inputs.append(
+                np.repeat(candidate_keys[:, 5:], num_events, axis=0))
+        coherence_scores = pair_composition_network.coherence_fn(
+            *pair_inputs).reshape(num_candidates, num_events)
+
+        return self.select_cached_candidates(
+            eval_input_cache, script_idx, instance_ids,
+            coherence_scores[candidate_inverse],
+            use_max_score=self.use_max_score)
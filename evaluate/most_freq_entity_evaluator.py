@@ -1,11 +1,34 @@
+import numpy as np
+
 from base_evaluator import BaseEvaluator
 
 
-def is_most_freq_entity(entity_idx, entity_freqs):
-    entity_freqs[entity_idx] -= 1
-    most_freq_entity_idx = entity_freqs.index(max(entity_freqs))
-    entity_freqs[entity_idx] += 1
-    return entity_idx == most_freq_entity_idx
+def get_most_freq_entity_correct(entity_freqs, entity_idx_list):
+    """
+    Return whether every entity in entity_idx_list is the most frequent
+    entity (the first one in case of ties) in entity_freqs, with one mention
+    of itself (the argument to predict) not counted.
+
+    Only the entity with the highest frequency can be the most frequent one
+    after its frequency is decreased by one, and it is if it still has a
+    higher frequency than the second one (or the same frequency and a
+    smaller index), so the decisions only depend on the top two entities.
+
+    """
+    entity_freqs = np.asarray(entity_freqs)
+    entity_idx_list = np.asarray(entity_idx_list)
+    # stable sort, so that ties are broken by the entity index
+    order = np.argsort(-entity_freqs, kind='mergesort')
+    top_idx = order[0]
+    if len(order) > 1:
+        second_idx = order[1]
+        top_freq = entity_freqs[top_idx] - 1
+        second_freq = entity_freqs[second_idx]
+        top_correct = top_freq > second_freq or \
+            (top_freq == second_freq and top_idx < second_idx)
+    else:
+        top_correct = True
+    return (entity_idx_list == top_idx) & top_correct
 
 
 class MostFreqEntityEvaluator(BaseEvaluator):
@@ -26,6 +49,7 @@ class MostFreqEntityEvaluator(BaseEvaluator):
         self.set_embedding_model(model)
 
     def evaluate_event_list(self, rich_event_list):
+        rich_arg_list = []
         for event_idx, rich_event in enumerate(rich_event_list):
             self.logger.debug('Processing event #{}'.format(event_idx))
             for arg_idx in rich_event.get_arg_idx_list(
@@ -33,17 +57,24 @@ class MostFreqEntityEvaluator(BaseEvaluator):
                 if rich_event.has_neg(arg_idx):
                     rich_arg = rich_event.get_argument(arg_idx)
                     if not self.ignore_argument(rich_arg):
-                        entity_freqs = [rich_entity.salience.num_mentions_total
-                                        for rich_entity in
-                                        rich_arg.rich_entity_list]
-                        correct = is_most_freq_entity(
-                            rich_arg.entity_idx, entity_freqs)
-                        num_choices = len(entity_freqs)
-
-                        kwargs = BaseEvaluator.get_arg_group_info(rich_arg)
-
-                        self.eval_stats.add_eval_result(
-                            correct,
-                            num_choices,
-                            **kwargs
-                        )
+                        rich_arg_list.append(rich_arg)
+        if not rich_arg_list:
+            return
+
+        # all arguments in a script share the same list of entities, so the
+        # entity frequencies are only computed once
+        rich_entity_list = rich_arg_list[0].rich_entity_list
+        entity_freqs = [rich_entity.salience.num_mentions_total
+                        for rich_entity in rich_entity_list]
+        num_choices = len(entity_freqs)
+        correct_list = get_most_freq_entity_correct(
+            entity_freqs, [rich_arg.entity_idx for rich_arg in rich_arg_list])
+
+        for rich_arg, correct in zip(rich_arg_list, correct_list):
+            kwargs = BaseEvaluator.get_arg_group_info(rich_arg)
+
+            self.eval_stats.add_eval_result(
+                correct,
+                num_choices,
+                **kwargs
+            )
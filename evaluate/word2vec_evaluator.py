@@ -2,31 +2,20 @@ import numpy as np
 
 from base_evaluator import BaseEvaluator
 from rich_script import IndexedEvent, IndexedEventMultiPobj
-from util import get_class_name, cos_sim
+from util import get_class_name
 
 
-def get_coherence_scores(target_vector, context_vector_list):
-    return [cos_sim(target_vector, context_vector)
-            for context_vector in context_vector_list]
-
-
-def get_most_coherent(eval_vector_list, context_vector_list,
-                      use_max_score=True):
-    coherence_score_list = []
-    for eval_vector in eval_vector_list:
-        if use_max_score:
-            coherence_score_list.append(max(
-                get_coherence_scores(eval_vector, context_vector_list)))
-        else:
-            coherence_score_list.append(sum(
-                get_coherence_scores(eval_vector, context_vector_list)))
-
-    most_coherent_idx = coherence_score_list.index(
-        max(coherence_score_list))
-    return most_coherent_idx
+def normalize_rows(matrix):
+    # rows of all zeros stay zeros, so that their cosine similarity to any
+    # vector is 0 (as in cos_sim)
+    norms = np.sqrt((matrix ** 2).sum(axis=1))
+    norms[norms == 0] = 1.0
+    return matrix / norms[:, np.newaxis]
 
 
 class Word2VecEvaluator(BaseEvaluator):
+    supports_eval_input_cache = True
+
     def __init__(self, logger=None, use_lemma=True, include_type=True,
                  include_all_pobj=True, ignore_first_mention=False,
                  filter_stop_events=True, use_max_score=True):
@@ -50,7 +39,7 @@ class Word2VecEvaluator(BaseEvaluator):
             'evaluator specific configs: use_max_score = {}'.format(
                 self.use_max_score))
 
-    def get_event_vector(self, event_input, include_all_pobj=True):
+    def check_event_input(self, event_input, include_all_pobj=True):
         if include_all_pobj:
             assert isinstance(event_input, IndexedEventMultiPobj), \
                 'event_input must be a {} instance ' \
@@ -61,60 +50,126 @@ class Word2VecEvaluator(BaseEvaluator):
                 'event_input must be a {} instance ' \
                 'when include_all_pobj=False'.format(
                     get_class_name(IndexedEvent))
-        # initialize event vector to be all zero
-        vector = np.zeros(self.embedding_model.vector_size)
-        # add vector for predicate
-        pred_vector = self.embedding_model.get_index_vec(
-            event_input.get_predicate())
-        if pred_vector is not None:
-            vector += pred_vector
-        else:
+
+    def get_event_matrix(self, event_input_list, include_all_pobj=True):
+        """
+        Return the event vectors of a list of indexed events as rows of a
+        matrix, each the sum of the vectors of the predicate and all the
+        arguments, gathered for all events at once. Arguments not in the
+        vocabulary are skipped, and the rows of events whose predicate is
+        not in the vocabulary are all zeros.
+
+        """
+        for event_input in event_input_list:
+            self.check_event_input(event_input, include_all_pobj)
+        # (num_events, 1 + max number of arguments), padded with -1
+        index_lists = [
+            [event_input.get_predicate()] + event_input.get_all_argument()
+            for event_input in event_input_list]
+        num_columns = max(len(index_list) for index_list in index_lists)
+        indices = np.full((len(index_lists), num_columns), -1, dtype=np.int64)
+        for row, index_list in enumerate(index_lists):
+            indices[row, :len(index_list)] = index_list
+        return self.get_index_matrix_vectors(indices)
+
+    def get_index_matrix_vectors(self, indices):
+        """
+        Same as get_event_matrix, from a matrix of the indices of the
+        predicate and all the arguments of every event, padded with -1.
+        """
+        vocab_size = self.embedding_model.vocab_size
+        valid = (indices >= 0) & (indices < vocab_size)
+        vectors = self.embedding_model.get_vector_matrix()
+        # add the vectors of each column in turn, in the same order (and
+        # precision) as adding them one by one
+        event_matrix = np.zeros(
+            (len(indices), self.embedding_model.vector_size))
+        for column in range(indices.shape[1]):
+            column_valid = valid[:, column]
+            event_matrix[column_valid] += \
+                vectors[indices[column_valid, column]]
+        event_matrix[~valid[:, 0]] = 0.0
+        return event_matrix
+
+    def get_event_vector(self, event_input, include_all_pobj=True):
+        self.check_event_input(event_input, include_all_pobj)
+        pred_input = event_input.get_predicate()
+        if pred_input < 0 or pred_input >= self.embedding_model.vocab_size:
             return None
-        # add vectors for all arguments
-        for arg_input in event_input.get_all_argument():
-            arg_vector = self.embedding_model.get_index_vec(arg_input)
-            if arg_vector is not None:
-                vector += arg_vector
-        return vector
+        return self.get_event_matrix(
+            [event_input], include_all_pobj=include_all_pobj)[0]
 
     def evaluate_event_list(self, rich_event_list):
         pos_input_list = \
             [rich_event.get_pos_input(include_all_pobj=self.include_all_pobj)
                 for rich_event in rich_event_list]
-        pos_vector_list = \
-            [self.get_event_vector(
-                pos_input, include_all_pobj=self.include_all_pobj)
-                for pos_input in pos_input_list]
+        pos_matrix = normalize_rows(self.get_event_matrix(
+            pos_input_list, include_all_pobj=self.include_all_pobj))
 
         for event_idx, rich_event in enumerate(rich_event_list):
             self.logger.debug('Processing event #{}'.format(event_idx))
-            context_vector_list = \
-                pos_vector_list[:event_idx] + pos_vector_list[event_idx+1:]
-
-            eval_input_list_all = rich_event.get_eval_input_list_all(
-                include_all_pobj=self.include_all_pobj, include_salience=False)
 
+            eval_input_list_all = [
+                (rich_arg, eval_input_list) for rich_arg, eval_input_list
+                in rich_event.get_eval_input_list_all(
+                    include_all_pobj=self.include_all_pobj,
+                    include_salience=False)
+                if not self.ignore_argument(rich_arg)]
+            if not eval_input_list_all:
+                continue
+
+            # score the candidates of all arguments of the event against all
+            # context events (every other event) with one matrix product
+            eval_matrix = self.get_event_matrix(
+                [eval_input for _, eval_input_list in eval_input_list_all
+                 for eval_input in eval_input_list],
+                include_all_pobj=self.include_all_pobj)
+            # identical candidates (e.g., entities with the same head word)
+            # are scored once, so that they tie exactly, which the rounding
+            # of the matrix product does not guarantee
+            eval_matrix, eval_inverse = np.unique(
+                eval_matrix, axis=0, return_inverse=True)
+            coherence_scores = np.delete(
+                normalize_rows(eval_matrix).dot(pos_matrix.T),
+                event_idx, axis=1)
+            if self.use_max_score:
+                coherence_scores = coherence_scores.max(axis=1)
+            else:
+                coherence_scores = coherence_scores.sum(axis=1)
+            coherence_scores = coherence_scores[eval_inverse]
+
+            start = 0
             for rich_arg, eval_input_list in eval_input_list_all:
-                if not self.ignore_argument(rich_arg):
-                    eval_vector_list = \
-                        [self.get_event_vector(
-                            eval_input, include_all_pobj=self.include_all_pobj)
-                            for eval_input in eval_input_list]
-                    most_coherent_idx = get_most_coherent(
-                        eval_vector_list,
-                        context_vector_list,
-                        self.use_max_score
-                    )
-                    correct = (most_coherent_idx == rich_arg.get_target_idx())
-                    num_choices = len(eval_input_list)
-
-                    kwargs = BaseEvaluator.get_arg_group_info(rich_arg)
-
-                    self.eval_stats.add_eval_result(
-                        correct,
-                        num_choices,
-                        **kwargs
-                    )
-                    self.logger.debug(
-                        'Processing {}, correct = {}, num_choices = {}'.format(
-                            rich_arg.arg_type, correct, num_choices))
+                num_choices = len(eval_input_list)
+                # the first candidate with the highest score
+                most_coherent_idx = int(np.argmax(
+                    coherence_scores[start:start + num_choices]))
+                start += num_choices
+                correct = (most_coherent_idx == rich_arg.get_target_idx())
+
+                kwargs = BaseEvaluator.get_arg_group_info(rich_arg)
+
+                self.eval_stats.add_eval_result(
+                    correct,
+                    num_choices,
+                    **kwargs
+                )
+                self.logger.debug(
+                    'Processing {}, correct = {}, num_choices = {}'.format(
+                        rich_arg.arg_type, correct, num_choices))
+
+    def evaluate_cached_script(self, eval_input_cache, script_idx,
+                               instance_ids):
+        event_start, event_end = eval_input_cache.get_script_events(script_idx)
+        pos_matrix = normalize_rows(self.get_index_matrix_vectors(
+            eval_input_cache.event_inputs[event_start:event_end]))
+        candidate_rows, _ = eval_input_cache.get_candidate_rows(instance_ids)
+        eval_matrix, eval_inverse = np.unique(
+            self.get_index_matrix_vectors(
+                eval_input_cache.candidate_inputs[candidate_rows]),
+            axis=0, return_inverse=True)
+        coherence_scores = \
+            normalize_rows(eval_matrix).dot(pos_matrix.T)[eval_inverse]
+        return self.select_cached_candidates(
+            eval_input_cache, script_idx, instance_ids, coherence_scores,
+            use_max_score=self.use_max_score)
@@ -0,0 +1,118 @@
+import argparse
+import pickle as pkl
+import re
+import timeit
+from collections import OrderedDict
+from os.path import abspath, basename, dirname, join, normpath
+
+from evaluate import ArgumentCompositionEvaluator, EventCompositionEvaluator
+from evaluate import EvalLog, EvalStats
+from evaluate.base_evaluator import BaseEvaluator
+from evaluate.eval_input_cache import get_file_fingerprint
+from evaluate.eval_stats import get_comparison_table
+from event_comp_model import EventCompositionModel
+from util import get_console_logger
+
+parser = argparse.ArgumentParser(
+    description='Evaluate all checkpoints of a model (e.g., the iter_* '
+                'directories of fine tuning) in one process: the scripts are '
+                'indexed and the networks are compiled once, and the weights '
+                'of every checkpoint are swapped into the same model')
+parser.add_argument('scripts_file',
+                    help='pickle file of the list of Scripts to evaluate on')
+parser.add_argument('model_path',
+                    help='directory of the saved EventCompositionModel the '
+                         'checkpoints are trained from, which provides the '
+                         'word vectors and weights not saved in them')
+parser.add_argument('checkpoint_dirs', nargs='+',
+                    help='directories of the checkpoints, evaluated in the '
+                         'order of their iteration numbers')
+parser.add_argument('--evaluator', default='event_comp',
+                    choices=['event_comp', 'arg_comp'],
+                    help='evaluator to use (default: event_comp)')
+parser.add_argument('--ignore_first_mention', action='store_true',
+                    help='ignore the first mention of every entity')
+parser.add_argument('--group', default='arg_type',
+                    choices=EvalLog.CATEGORY_COLUMNS[:-1],
+                    help='accuracy group to compare the checkpoints by '
+                         '(default: arg_type)')
+parser.add_argument('--cache_dir',
+                    help='directory to load the evaluation input cache of '
+                         'the scripts from (or save it to)')
+parser.add_argument('--function_cache_dir',
+                    help='directory of the FunctionCache to load the '
+                         'compiled networks from')
+parser.add_argument('--save_eval_logs', action='store_true',
+                    help='save the evaluation log of every checkpoint to '
+                         'eval_log.npz in its directory')
+
+args = parser.parse_args()
+
+log = get_console_logger('evaluate_checkpoints')
+
+
+def get_iter_num(checkpoint_dir):
+    match = re.search(r'(\d+)$', checkpoint_dir)
+    return int(match.group(1)) if match else -1
+
+
+checkpoint_dirs = sorted(
+    [normpath(checkpoint_dir) for checkpoint_dir in args.checkpoint_dirs],
+    key=lambda checkpoint_dir: (
+        dirname(checkpoint_dir), get_iter_num(checkpoint_dir)))
+checkpoint_names = [basename(checkpoint_dir)
+                    for checkpoint_dir in checkpoint_dirs]
+if len(set(checkpoint_names)) < len(checkpoint_names):
+    checkpoint_names = checkpoint_dirs
+
+start_time = timeit.default_timer()
+model = EventCompositionModel.load_model(
+    args.model_path, function_cache_dir=args.function_cache_dir)
+log.info('Loaded event composition model from {} in {:.3f} seconds'.format(
+    args.model_path, timeit.default_timer() - start_time))
+
+if args.evaluator == 'event_comp':
+    evaluator = EventCompositionEvaluator(
+        ignore_first_mention=args.ignore_first_mention)
+else:
+    evaluator = ArgumentCompositionEvaluator(
+        ignore_first_mention=args.ignore_first_mention)
+evaluator.set_model(model)
+
+start_time = timeit.default_timer()
+with open(args.scripts_file, 'r') as f:
+    all_scripts = pkl.load(f)
+if args.cache_dir:
+    eval_input_cache = evaluator.load_eval_input_cache(
+        args.cache_dir, abspath(args.scripts_file), all_scripts=all_scripts,
+        corpus_fingerprint=get_file_fingerprint(args.scripts_file))
+else:
+    eval_input_cache = evaluator.build_eval_input_cache(
+        all_scripts, corpus_name=abspath(args.scripts_file))
+log.info('Prepared {} evaluation instances from {} in {:.3f} seconds'.format(
+    eval_input_cache.num_instances, args.scripts_file,
+    timeit.default_timer() - start_time))
+
+eval_stats_dict = OrderedDict()
+for checkpoint_dir, checkpoint_name in zip(checkpoint_dirs, checkpoint_names):
+    start_time = timeit.default_timer()
+    model.load_checkpoint(checkpoint_dir)
+    eval_log_file = None
+    if args.save_eval_logs:
+        eval_log_file = join(checkpoint_dir, 'eval_log.npz')
+    evaluator.evaluate_cache(
+        eval_input_cache, eval_log_file=eval_log_file, verbose=False)
+    eval_stats = EvalStats.from_eval_log(
+        evaluator.eval_stats.eval_log,
+        BaseEvaluator.get_default_accuracy_groups())
+    eval_stats_dict[checkpoint_name] = eval_stats
+    log.info('Evaluated {}: accuracy = {:.2f}% in {:.3f} seconds'.format(
+        checkpoint_dir, eval_stats.get_accuracy_all().get_accuracy(),
+        timeit.default_timer() - start_time))
+
+print get_comparison_table(eval_stats_dict, group_name=args.group).draw()
+
+best_name = max(
+    eval_stats_dict,
+    key=lambda name: eval_stats_dict[name].get_accuracy_all().get_accuracy())
+log.info('Best checkpoint: {}'.format(best_name))
@@ -1,9 +1,12 @@
+import os
 import platform
 import timeit
-from os.path import join
+from os.path import exists, join
 
 from event_composition_model import EventCompositionModel
 from event_composition_trainer import EventCompositionTrainer
+from function_cache import FUNCTION_CACHE_DIR_ENV
+from util.model_archive import MODEL_ARCHIVE_NAME, get_model_archive
 
 system_name = platform.system()
 dist_name = platform.linux_distribution()[0]
@@ -54,16 +57,41 @@ event_comp_dir_dict = {
 default_model_key = '40M_training_w_salience'
 
 
-def load_event_comp_model(model_key=default_model_key):
+def get_event_comp_dir(model_key=default_model_key):
     if model_key not in event_comp_dir_dict:
         model_key = default_model_key
+    return join(root_dir, event_comp_dir_dict[model_key])
 
-    event_comp_dir = join(root_dir, event_comp_dir_dict[model_key])
 
-    print '\nLoading event composition model from {}'.format(event_comp_dir)
+def load_event_comp_model(model_key=default_model_key,
+                          function_cache_dir=None, vector_dtype=None):
+    event_comp_dir = get_event_comp_dir(model_key)
+
+    # use the compiled function cache if it is set in the environment
+    if function_cache_dir is None:
+        function_cache_dir = os.environ.get(FUNCTION_CACHE_DIR_ENV)
+
     start_time = timeit.default_timer()
 
-    event_comp_model = EventCompositionModel.load_model(event_comp_dir)
+    # the archive is only loaded if it is not older than the other files of
+    # the model, e.g., after the model is retrained
+    model_archive = get_model_archive(event_comp_dir)
+    if model_archive is None \
+            and exists(join(event_comp_dir, MODEL_ARCHIVE_NAME)):
+        print '\nIgnoring model archive in {}, which is older than the ' \
+              'model files'.format(event_comp_dir)
+    if model_archive is not None:
+        print '\nLoading event composition model from archive {}'.format(
+            model_archive)
+        event_comp_model = EventCompositionModel.load_archive(
+            model_archive, function_cache_dir=function_cache_dir,
+            vector_dtype=vector_dtype)
+    else:
+        print '\nLoading event composition model from model files in ' \
+              '{}'.format(event_comp_dir)
+        event_comp_model = EventCompositionModel.load_model(
+            event_comp_dir, function_cache_dir=function_cache_dir,
+            vector_dtype=vector_dtype)
 
     elapsed = timeit.default_timer() - start_time
     print '\tDone in {:.3f} seconds'.format(elapsed)
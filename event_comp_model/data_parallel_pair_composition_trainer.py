@@ -0,0 +1,131 @@
+import numpy
+import theano
+import theano.tensor as T
+
+from data_parallel import GradientWorkerPool
+from pair_composition_trainer import PairCompositionTrainer
+
+
+class DataParallelPairCompositionTrainer(PairCompositionTrainer):
+    """
+    Train with synchronous data-parallel SGD: every batch is split among
+    num_workers forked processes computing the gradients on their slices,
+    and the master applies the gradients averaged over the whole batch with
+    the optimizer, so the updates are the same as in PairCompositionTrainer
+    with the same batch size (up to floating point rounding).
+
+    Unlike HogwildPairCompositionTrainer, all optimizers and checkpoints
+    within iterations are supported, except that input vectors can only be
+    updated with optimizers supporting sparse updates (sgd, adagrad): with
+    dense updates, the whole input vector matrix (and its optimizer state)
+    changes on every batch, and copying it to the workers costs more than
+    data parallelism saves.
+
+    """
+
+    def __init__(self, model, num_workers=2, **kwargs):
+        super(DataParallelPairCompositionTrainer, self).__init__(
+            model, **kwargs)
+        assert num_workers > 0, 'num_workers must be a positive integer'
+        assert not self.update_input_vectors or self.sparse_input_updates, \
+            'synchronous data-parallel training can only update input ' \
+            'vectors with sparse_input_updates and an optimizer supporting ' \
+            'them (sgd, adagrad), found {}'.format(self.optimizer.name)
+        self.num_workers = num_workers
+        self.worker_pool = None
+
+    def get_train_function(self):
+        """
+        Compile a function computing the cost and gradients on a slice of a
+        batch, run by the workers, and a function applying the averaged
+        gradients, run by the master, and return a function updating the
+        model on a batch with them, called the same as the compiled training
+        function of PairCompositionTrainer.
+
+        """
+        sparse_input_updates = \
+            self.update_input_vectors and self.sparse_input_updates
+
+        cost = self.get_triple_cost_updates(compute_update=False)
+        outputs = [cost] + [T.grad(cost, param) for param in self.params]
+        if sparse_input_updates:
+            lookup_indices, lookup_grad_rows = \
+                self.get_input_vector_lookup_grads(cost)
+            outputs.extend([lookup_indices, lookup_grad_rows])
+        grad_fn = theano.function(
+            inputs=self.model.triple_inputs,
+            outputs=outputs,
+        )
+
+        grads = [param.type() for param in self.params]
+        updates = self.optimizer.get_updates(
+            self.params, grads, self.learning_rate_var)
+        update_inputs = list(grads)
+        if sparse_input_updates:
+            indices = lookup_indices.type('indices')
+            grad_rows = lookup_grad_rows.type('grad_rows')
+            updates.extend(self.optimizer.get_sparse_updates(
+                self.model.event_vector_network.vectors, indices, grad_rows,
+                self.learning_rate_var))
+            update_inputs.extend([indices, grad_rows])
+        update_fn = theano.function(
+            inputs=update_inputs + [
+                theano.In(self.learning_rate_var, value=self.learning_rate)
+            ],
+            updates=updates,
+        )
+
+        num_params = len(self.params)
+        self.worker_pool = GradientWorkerPool(
+            grad_fn, self.get_tuned_params(), self.num_workers,
+            num_dense_grads=num_params)
+        self.worker_pool.start()
+
+        def train_fn(*batch_inputs, **kwargs):
+            batch_weight = kwargs.pop('batch_weight', 1.0)
+            cost, batch_grads, worker_outputs = \
+                self.worker_pool.compute_gradients(batch_inputs)
+            if batch_weight != 1.0:
+                for grad in batch_grads:
+                    grad *= batch_weight
+            if sparse_input_updates:
+                # the gradients of the looked up rows are scaled the same as
+                # the dense ones, rows looked up by more than one worker
+                # accumulate all their gradients
+                batch_indices = numpy.concatenate(
+                    [outputs[0] for _, outputs in worker_outputs])
+                batch_grad_rows = numpy.concatenate(
+                    [numpy.asarray(batch_weight * weight * outputs[1],
+                                   dtype=grad_rows.dtype)
+                     for weight, outputs in worker_outputs])
+                update_fn(*(batch_grads + [batch_indices, batch_grad_rows]),
+                          **kwargs)
+            else:
+                update_fn(*batch_grads, **kwargs)
+
+            self.worker_pool.sync_params(range(num_params))
+            if sparse_input_updates:
+                self.worker_pool.sync_param_rows(num_params, batch_indices)
+            return cost
+
+        return train_fn
+
+    def train_iteration(self, iteration, train_fn, batch_iterator,
+                        learning_rate, log, log_every_batch=1000,
+                        first_batch=0, err=0.0, batch_callback=None):
+        # the parameters might have been set in between (e.g., by
+        # set_param_values when resuming from a checkpoint)
+        self.worker_pool.sync_params()
+        return super(DataParallelPairCompositionTrainer, self).train_iteration(
+            iteration, train_fn, batch_iterator, learning_rate, log,
+            log_every_batch=log_every_batch, first_batch=first_batch,
+            err=err, batch_callback=batch_callback)
+
+    def train(self, batch_iterator, **kwargs):
+        try:
+            super(DataParallelPairCompositionTrainer, self).train(
+                batch_iterator, **kwargs)
+        finally:
+            if self.worker_pool is not None:
+                self.worker_pool.close()
+                self.worker_pool = None
@@ -1,25 +1,35 @@
 import pickle as pkl
+from collections import OrderedDict
 from os import makedirs
-from os.path import exists, join
+from os.path import dirname, exists, join
+
+import numpy
 
 from event_vector_network import EventVectorNetwork
+from function_cache import FunctionCache
 from pair_composition_network import PairCompositionNetwork
 from util import Word2VecModel, consts, get_class_name
+from util.model_archive import flatten_weights, unflatten_weights
+from util.model_archive import read_model_archive, write_model_archive
 
 
 class EventCompositionModel(object):
     def __init__(self, word2vec, event_vector_layer_sizes=None,
                  pair_composition_layer_sizes=None, use_salience=True,
-                 salience_features=None):
+                 salience_features=None, vector_dtype=None):
         assert isinstance(word2vec, Word2VecModel), \
             'word2vec must be a {} instance'.format(
                 get_class_name(Word2VecModel))
         self.word2vec = word2vec
+        # dtype of the input word vectors in the event vector network,
+        # floatX if None (see EventVectorNetwork)
+        self.vector_dtype = vector_dtype
         if event_vector_layer_sizes:
             self.event_vector_network = EventVectorNetwork(
                 word_vectors=self.word2vec.get_vector_matrix(),
                 vector_size=self.word2vec.vector_size,
-                layer_sizes=event_vector_layer_sizes
+                layer_sizes=event_vector_layer_sizes,
+                vector_dtype=vector_dtype
             )
         else:
             self.event_vector_network = None
@@ -33,13 +43,15 @@ class EventCompositionModel(object):
         else:
             self.pair_composition_network = None
 
-    def add_event_vector_network(self, layer_sizes):
+    def add_event_vector_network(self, layer_sizes, borrow_vectors=False):
         assert self.event_vector_network is None, \
             'cannot add EventVectorNetwork when one already exists'
         self.event_vector_network = EventVectorNetwork(
             word_vectors=self.word2vec.get_vector_matrix(),
             vector_size=self.word2vec.vector_size,
-            layer_sizes=layer_sizes
+            layer_sizes=layer_sizes,
+            vector_dtype=self.vector_dtype,
+            borrow_vectors=borrow_vectors
         )
 
     def add_pair_projection_network(self, layer_sizes, use_salience=True,
@@ -57,14 +69,21 @@ class EventCompositionModel(object):
         )
 
     def save_model(self, directory, save_word2vec=True,
-                   save_event_vector=True, save_pair_composition=False):
+                   save_event_vector=True, save_pair_composition=False,
+                   optimizer=None, word2vec_dtype=None):
+        """
+        word2vec_dtype can be one of util.word2vec.REDUCED_PRECISION_DTYPES
+        (e.g., float16) to save word2vec.bin with reduced precision.
+
+        """
         if not exists(directory):
             makedirs(directory)
 
         if save_word2vec:
             self.word2vec.set_vector_matrix(
                 self.event_vector_network.get_word_vectors())
-            self.word2vec.save_model(directory, 'word2vec')
+            self.word2vec.save_model(
+                directory, 'word2vec', dtype=word2vec_dtype)
 
         if save_event_vector and self.event_vector_network:
             with open(join(directory, 'ev_weights'), 'w') as f:
@@ -81,8 +100,39 @@ class EventCompositionModel(object):
                 with open(join(directory, 'salience_features'), 'w') as f:
                     pkl.dump(self.pair_composition_network.salience_features, f)
 
+        # save the state of the optimizer used in training (if any), so that
+        # training can be continued from this checkpoint
+        if optimizer is not None:
+            with open(join(directory, 'optimizer_state'), 'w') as f:
+                pkl.dump({'name': optimizer.name,
+                          'state': optimizer.get_state()}, f)
+
+    @staticmethod
+    def load_optimizer_state(directory, optimizer_name):
+        optimizer_state_file = join(directory, 'optimizer_state')
+        if not exists(optimizer_state_file):
+            return None
+        with open(optimizer_state_file, 'r') as f:
+            optimizer_state = pkl.load(f)
+        if optimizer_state['name'] != optimizer_name:
+            raise RuntimeError(
+                '{} contains the state of {} optimizer, {} expected'.format(
+                    optimizer_state_file, optimizer_state['name'],
+                    optimizer_name))
+        return optimizer_state['state']
+
     @classmethod
-    def load_model(cls, directory):
+    def load_model(cls, directory, function_cache_dir=None, vector_dtype=None):
+        """
+        Load a model saved by save_model(). If function_cache_dir is given,
+        networks with compiled functions are loaded from (or, the first time
+        an architecture is seen, saved to) a FunctionCache in that directory.
+
+        If vector_dtype is given (e.g., float16), the word vectors are held
+        in memory as vector_dtype, both in word2vec and in the event vector
+        network.
+
+        """
         if not exists(directory):
             raise RuntimeError('{} does not exist, abort'.format(directory))
 
@@ -95,7 +145,8 @@ class EventCompositionModel(object):
                 '{} and {} expected'.format(
                     directory, word2vec_vector_file, word2vec_vocab_file))
         word2vec = Word2VecModel.load_model(
-            word2vec_vector_file, fvocab=word2vec_vocab_file)
+            word2vec_vector_file, fvocab=word2vec_vocab_file,
+            dtype=vector_dtype)
 
         # load event vector network layer sizes, if exists
         event_vector_layer_sizes_file = join(directory, 'ev_layer_sizes')
@@ -126,12 +177,11 @@ class EventCompositionModel(object):
             use_salience = False
             salience_features = None
 
-        # initialize the event composition model
-        model = cls(
-            word2vec=word2vec,
-            event_vector_layer_sizes=event_vector_layer_sizes,
+        model = cls.init_with_networks(
+            word2vec, event_vector_layer_sizes=event_vector_layer_sizes,
             pair_composition_layer_sizes=pair_composition_layer_sizes,
-            use_salience=use_salience, salience_features=salience_features)
+            use_salience=use_salience, salience_features=salience_features,
+            function_cache_dir=function_cache_dir, vector_dtype=vector_dtype)
 
         # load event vector network weights, if exists
         event_vector_weights_file = join(directory, 'ev_weights')
@@ -154,3 +204,231 @@ class EventCompositionModel(object):
             model.pair_composition_network.set_weights(pair_composition_weights)
 
         return model
+
+    def load_checkpoint(self, directory):
+        """
+        Set the weights of the networks to those saved by save_model() in
+        directory (e.g., an iter_* checkpoint of fine tuning), without
+        rebuilding or recompiling them, so that many checkpoints of the
+        same architecture can be evaluated with one model. Weights not saved
+        in the checkpoint (e.g., word2vec.bin or ev_weights when they are
+        not updated in fine tuning) are left as they are. The pair
+        composition network is added if the model does not have one yet.
+
+        """
+        if not exists(directory):
+            raise RuntimeError('{} does not exist, abort'.format(directory))
+
+        # load word vectors, if exists
+        word2vec_vector_file = join(directory, 'word2vec.bin')
+        if exists(word2vec_vector_file):
+            word2vec = Word2VecModel.load_model(
+                word2vec_vector_file,
+                fvocab=join(directory, 'word2vec.vocab'),
+                dtype=self.vector_dtype)
+            if word2vec.get_id2word() != self.word2vec.get_id2word():
+                raise RuntimeError(
+                    'word2vec vocabulary in {} does not match the '
+                    'model'.format(directory))
+            self.word2vec.set_vector_matrix(word2vec.get_vector_matrix())
+            if self.event_vector_network is not None:
+                self.event_vector_network.set_word_vectors(
+                    self.word2vec.get_vector_matrix())
+
+        # load event vector network weights, if exists
+        event_vector_weights_file = join(directory, 'ev_weights')
+        if exists(event_vector_weights_file):
+            assert self.event_vector_network is not None, \
+                'cannot load event vector network weights ' \
+                'when the network is not initialized'
+            self._check_layer_sizes(
+                join(directory, 'ev_layer_sizes'),
+                self.event_vector_network.layer_sizes)
+            with open(event_vector_weights_file, 'r') as f:
+                self.event_vector_network.set_weights(pkl.load(f))
+
+        # load pair composition network weights, if exists
+        pair_composition_weights_file = join(directory, 'pc_weights')
+        if exists(pair_composition_weights_file):
+            use_salience = exists(join(directory, 'use_salience'))
+            salience_features = None
+            if use_salience:
+                salience_features_file = join(directory, 'salience_features')
+                if exists(salience_features_file):
+                    with open(salience_features_file, 'r') as f:
+                        salience_features = pkl.load(f)
+                else:
+                    salience_features = consts.SALIENCE_FEATURES
+
+            if self.pair_composition_network is None:
+                with open(join(directory, 'pc_layer_sizes'), 'r') as f:
+                    pair_composition_layer_sizes = pkl.load(f)
+                self.add_pair_projection_network(
+                    pair_composition_layer_sizes, use_salience=use_salience,
+                    salience_features=salience_features)
+            pair_composition_network = self.pair_composition_network
+            self._check_layer_sizes(
+                join(directory, 'pc_layer_sizes'),
+                pair_composition_network.layer_sizes)
+            if use_salience != pair_composition_network.use_salience or \
+                    (use_salience and len(salience_features) !=
+                     pair_composition_network.num_salience_features):
+                raise RuntimeError(
+                    'salience features in {} do not match the '
+                    'model'.format(directory))
+            if use_salience:
+                pair_composition_network.salience_features = salience_features
+            with open(pair_composition_weights_file, 'r') as f:
+                pair_composition_network.set_weights(pkl.load(f))
+
+    @staticmethod
+    def _check_layer_sizes(layer_sizes_file, layer_sizes):
+        if exists(layer_sizes_file):
+            with open(layer_sizes_file, 'r') as f:
+                saved_layer_sizes = pkl.load(f)
+            if list(saved_layer_sizes) != list(layer_sizes):
+                raise RuntimeError(
+                    'layer sizes {} in {} do not match the model {}'.format(
+                        saved_layer_sizes, layer_sizes_file, layer_sizes))
+
+    @classmethod
+    def init_with_networks(cls, word2vec, event_vector_layer_sizes=None,
+                           pair_composition_layer_sizes=None,
+                           use_salience=True, salience_features=None,
+                           function_cache_dir=None, vector_dtype=None,
+                           borrow_vectors=False):
+        """
+        Initialize a model with the networks of the given architecture, built
+        from scratch, or loaded from a FunctionCache in function_cache_dir if
+        it is given (see load_model). The input vectors of the event vector
+        network are taken from word2vec, without copying if borrow_vectors is
+        True and they are already of the right dtype.
+
+        """
+        function_cache = cache_key = cached_networks = None
+        if function_cache_dir is not None and event_vector_layer_sizes:
+            function_cache = FunctionCache(function_cache_dir)
+            cache_key = FunctionCache.get_key(
+                vector_size=word2vec.vector_size,
+                event_vector_layer_sizes=event_vector_layer_sizes,
+                pair_composition_layer_sizes=pair_composition_layer_sizes,
+                use_salience=use_salience,
+                num_salience_features=
+                len(salience_features) if use_salience else 0,
+                vector_dtype=vector_dtype)
+            cached_networks = function_cache.load(cache_key)
+
+        model = cls(word2vec=word2vec, vector_dtype=vector_dtype)
+        if cached_networks is not None:
+            # initialize the event composition model with cached networks
+            model.event_vector_network, model.pair_composition_network = \
+                cached_networks
+            model.event_vector_network.set_word_vectors(
+                word2vec.get_vector_matrix(), borrow=borrow_vectors)
+            if use_salience and model.pair_composition_network is not None:
+                model.pair_composition_network.salience_features = \
+                    salience_features
+            return model
+
+        # initialize the event composition model
+        if event_vector_layer_sizes:
+            model.add_event_vector_network(
+                event_vector_layer_sizes, borrow_vectors=borrow_vectors)
+        if pair_composition_layer_sizes:
+            model.add_pair_projection_network(
+                pair_composition_layer_sizes, use_salience=use_salience,
+                salience_features=salience_features)
+        if function_cache is not None:
+            function_cache.save(
+                cache_key, model.event_vector_network,
+                model.pair_composition_network)
+        return model
+
+    def save_archive(self, path, word2vec_dtype='float32'):
+        """
+        Save the model for evaluation or serving as a single model archive
+        file (see model_archive), with the word vectors (as word2vec_dtype)
+        normalized the same as load_model() would do, so that they can be
+        memory-mapped by load_archive() and used as they are.
+
+        """
+        if dirname(path) and not exists(dirname(path)):
+            makedirs(dirname(path))
+
+        if self.event_vector_network is not None:
+            word_vectors = self.event_vector_network.get_word_vectors()
+        else:
+            word_vectors = self.word2vec.get_vector_matrix()
+        # normalize in float32 (as word2vec.bin is read) before any downcast
+        word_vectors = numpy.asarray(word_vectors, dtype=numpy.float32)
+        word_vectors /= numpy.sqrt(
+            (word_vectors ** 2).sum(-1))[..., numpy.newaxis]
+
+        arrays = OrderedDict()
+        arrays['word_vectors'] = word_vectors.astype(word2vec_dtype)
+        words = self.word2vec.get_id2word()
+        vocab = self.word2vec.get_vocab()
+        header = {
+            'word2vec_name': self.word2vec.name,
+            'words': words,
+            'counts': [vocab[word].count for word in words]
+        }
+        if self.event_vector_network is not None:
+            header['ev_layer_sizes'] = self.event_vector_network.layer_sizes
+            header['ev_weights'] = flatten_weights(
+                self.event_vector_network.get_weights(), 'ev_weights', arrays)
+        if self.pair_composition_network is not None:
+            pair_composition_network = self.pair_composition_network
+            header['pc_layer_sizes'] = pair_composition_network.layer_sizes
+            header['pc_weights'] = flatten_weights(
+                pair_composition_network.get_weights(), 'pc_weights', arrays)
+            header['use_salience'] = pair_composition_network.use_salience
+            if pair_composition_network.use_salience:
+                header['salience_features'] = \
+                    pair_composition_network.salience_features
+
+        write_model_archive(path, header, arrays)
+
+    @classmethod
+    def load_archive(cls, path, mmap_mode='r', function_cache_dir=None,
+                     vector_dtype=None):
+        """
+        Load a model saved by save_archive(). With mmap_mode (as in
+        numpy.memmap), the word vectors are memory-mapped from the archive,
+        and shared with the event vector network if they are of the dtype
+        used in the network (vector_dtype, or floatX if it is None), in
+        which case the model can only be used for inference if mmap_mode is
+        'r'. Otherwise, the word vectors are read into memory.
+
+        function_cache_dir is the same as in load_model().
+
+        """
+        if not exists(path):
+            raise RuntimeError('{} does not exist, abort'.format(path))
+
+        header, arrays = read_model_archive(path, mmap_mode=mmap_mode)
+
+        word_vectors = arrays['word_vectors']
+        if vector_dtype is not None and word_vectors.dtype != vector_dtype:
+            word_vectors = numpy.asarray(word_vectors, dtype=vector_dtype)
+        word2vec = Word2VecModel.from_vectors(
+            header['word2vec_name'], header['words'], word_vectors,
+            counts=header['counts'])
+
+        use_salience = header.get('use_salience', False)
+        model = cls.init_with_networks(
+            word2vec,
+            event_vector_layer_sizes=header.get('ev_layer_sizes'),
+            pair_composition_layer_sizes=header.get('pc_layer_sizes'),
+            use_salience=use_salience,
+            salience_features=header.get('salience_features'),
+            function_cache_dir=function_cache_dir, vector_dtype=vector_dtype,
+            borrow_vectors=mmap_mode is not None)
+
+        if 'ev_weights' in header:
+            model.event_vector_network.set_weights(
+                unflatten_weights(header['ev_weights'], arrays))
+        if 'pc_weights' in header:
+            model.pair_composition_network.set_weights(
+                unflatten_weights(header['pc_weights'], arrays))
+        return model
@@ -1,9 +1,17 @@
 import os
+import pickle as pkl
 
+import theano
+
+from autoencoder import DataParallelDenoisingAutoencoderIterableTrainer
 from autoencoder import DenoisingAutoencoderIterableTrainer
+from data_parallel_pair_composition_trainer import \
+    DataParallelPairCompositionTrainer
 from event_composition_model import EventCompositionModel
+from hogwild_pair_composition_trainer import HogwildPairCompositionTrainer
+from optimizers import get_optimizer
 from pair_composition_trainer import PairCompositionTrainer
-from rich_script import PretrainingCorpusIterator
+from rich_script import LayerInputCacheIterator, PretrainingCorpusIterator
 from util import get_class_name, get_console_logger
 
 
@@ -23,46 +31,134 @@ class EventCompositionTrainer(object):
             self.log = log
 
     def save_model(self, saving_dir, save_word2vec=True,
-                   save_event_vector=True, save_pair_composition=False):
+                   save_event_vector=True, save_pair_composition=False,
+                   optimizer=None):
         saving_dir = os.path.join(self.saving_path, saving_dir)
         self.log.info('Saving model to {}'.format(saving_dir))
         self.model.save_model(
             saving_dir,
             save_word2vec=save_word2vec,
             save_event_vector=save_event_vector,
-            save_pair_composition=save_pair_composition
+            save_pair_composition=save_pair_composition,
+            optimizer=optimizer
         )
 
+    def save_training_state(self, saving_dir, training_state):
+        """
+        Save a resumable training checkpoint, replacing the previous one.
+        The state is written to a temporary file first and then renamed, so
+        a crash while saving does not corrupt the last checkpoint.
+
+        """
+        saving_dir = os.path.join(self.saving_path, saving_dir)
+        if not os.path.exists(saving_dir):
+            os.makedirs(saving_dir)
+        state_file = os.path.join(saving_dir, 'training_state')
+        self.log.info('Saving training checkpoint to {}'.format(state_file))
+        with open(state_file + '.tmp', 'wb') as f:
+            pkl.dump(training_state, f, pkl.HIGHEST_PROTOCOL)
+        os.rename(state_file + '.tmp', state_file)
+
+    def load_training_state(self, saving_dir):
+        state_file = os.path.join(self.saving_path, saving_dir, 'training_state')
+        if not os.path.exists(state_file):
+            self.log.info(
+                'No training checkpoint found at {}, '
+                'starting from scratch'.format(state_file))
+            return None
+        self.log.info('Loading training checkpoint from {}'.format(state_file))
+        with open(state_file, 'rb') as f:
+            return pkl.load(f)
+
+    def remove_training_state(self, saving_dir):
+        state_file = os.path.join(self.saving_path, saving_dir, 'training_state')
+        if os.path.exists(state_file):
+            os.remove(state_file)
+
     def autoencoder_pretraining(
             self, indexed_corpus, batch_size=1000, iterations=2,
-            learning_rate=0.1, regularization=0.001, corruption_level=0.3):
+            learning_rate=0.1, regularization=0.001, corruption_level=0.3,
+            cache_layer_inputs=False, cache_dtype='float32', optimizer='sgd',
+            checkpoint_every=None, resume=False, num_workers=1):
         self.log.info('Start autoencoder pre-training')
         self.log.info(
             'Pre-training with l2 reg={}, lr={}, corruption={}, '
-            '{} iterations per layer, {}-instance minibatches'.format(
+            '{} iterations per layer, {}-instance minibatches, '
+            '{} optimizer'.format(
                 regularization, learning_rate, corruption_level, iterations,
-                batch_size))
+                batch_size, optimizer))
 
         if not os.path.isdir(indexed_corpus):
             self.log.error(
                 'Cannot find indexed corpus at {}'.format(indexed_corpus))
             exit(-1)
 
+        assert cache_dtype in ['float32', 'float16'], \
+            'cache_dtype can only be float32 or float16'
+        cache_dir = os.path.join(self.saving_path, 'layer_input_cache')
+        if cache_layer_inputs:
+            self.log.info(
+                'Caching inputs of layer 1 and above as {} in {}'.format(
+                    cache_dtype, cache_dir))
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+
+        # training checkpoints of all layers are saved in the same file,
+        # together with the weights of the whole event vector network
+        training_state = None
+        if resume:
+            training_state = self.load_training_state('pretraining')
+        start_layer = 0
+        if training_state is not None:
+            start_layer = training_state['layer']
+            self.model.event_vector_network.set_weights(
+                training_state['ev_weights'])
+
+        corpus_it = None
         for layer in range(len(self.model.event_vector_network.layer_sizes)):
+            if layer < start_layer:
+                self.log.info(
+                    'Skipping layer {}, restored from checkpoint'.format(layer))
+                continue
             self.log.info('Pre-training layer {}'.format(layer))
 
-            self.log.info(
-                'Loading indexed corpus from: {}, with batch_size={}'.format(
-                    indexed_corpus, batch_size))
-            corpus_it = PretrainingCorpusIterator(
-                indexed_corpus,
-                model=self.model.event_vector_network,
-                layer_input=layer,
-                batch_size=batch_size)
+            prev_corpus_it = corpus_it
+            if cache_layer_inputs and layer > 0:
+                corpus_it = self.cache_layer_input(
+                    indexed_corpus, layer, prev_corpus_it, cache_dir,
+                    batch_size=batch_size, cache_dtype=cache_dtype)
+                # inputs to the previous layer are no longer needed
+                if isinstance(prev_corpus_it, LayerInputCacheIterator):
+                    os.remove(prev_corpus_it.cache_file)
+            else:
+                self.log.info(
+                    'Loading indexed corpus from: {}, '
+                    'with batch_size={}'.format(indexed_corpus, batch_size))
+                corpus_it = PretrainingCorpusIterator(
+                    indexed_corpus,
+                    model=self.model.event_vector_network,
+                    layer_input=layer,
+                    batch_size=batch_size)
             self.log.info('Found {} lines in the corpus'.format(len(corpus_it)))
 
-            trainer = DenoisingAutoencoderIterableTrainer(
-                self.model.event_vector_network.layers[layer])
+            def _checkpoint_callback(layer_training_state, layer=layer):
+                layer_training_state['layer'] = layer
+                layer_training_state['ev_weights'] = \
+                    self.model.event_vector_network.get_weights()
+                self.save_training_state('pretraining', layer_training_state)
+
+            # each layer is trained with a fresh optimizer state
+            layer_optimizer = get_optimizer(optimizer)
+            if num_workers > 1:
+                self.log.info(
+                    'Synchronous data-parallel training with {} '
+                    'workers'.format(num_workers))
+                trainer = DataParallelDenoisingAutoencoderIterableTrainer(
+                    self.model.event_vector_network.layers[layer],
+                    num_workers=num_workers)
+            else:
+                trainer = DenoisingAutoencoderIterableTrainer(
+                    self.model.event_vector_network.layers[layer])
             trainer.train(
                 batch_iterator=corpus_it,
                 iterations=iterations,
@@ -70,7 +166,11 @@ class EventCompositionTrainer(object):
                 learning_rate=learning_rate,
                 regularization=regularization,
                 corruption_level=corruption_level,
-                loss='l2'
+                loss='l2',
+                optimizer=layer_optimizer,
+                checkpoint_every=checkpoint_every,
+                checkpoint_callback=_checkpoint_callback,
+                resume_state=training_state if layer == start_layer else None
             )
 
             self.log.info('Finished training layer {}'.format(layer))
@@ -80,9 +180,15 @@ class EventCompositionTrainer(object):
                     os.path.join('pretraining', 'layer_{}'.format(layer)),
                     save_word2vec=False,
                     save_event_vector=True,
-                    save_pair_composition=False
+                    save_pair_composition=False,
+                    optimizer=layer_optimizer
                 )
 
+        if isinstance(corpus_it, LayerInputCacheIterator):
+            os.remove(corpus_it.cache_file)
+        if cache_layer_inputs and not os.listdir(cache_dir):
+            os.rmdir(cache_dir)
+
         self.log.info('Finished autoencoder pre-training')
         # save final results with all parameters and word2vec vectors
         self.save_model(
@@ -91,18 +197,58 @@ class EventCompositionTrainer(object):
             save_event_vector=True,
             save_pair_composition=False
         )
+        self.remove_training_state('pretraining')
+
+    def cache_layer_input(self, indexed_corpus, layer, prev_corpus_it,
+                          cache_dir, batch_size=1000, cache_dtype='float32'):
+        event_vector_network = self.model.event_vector_network
+        cache_file = os.path.join(cache_dir, 'layer_{}_input'.format(layer))
+
+        if isinstance(prev_corpus_it, LayerInputCacheIterator):
+            # only run the previous (just trained) layer on its cached inputs
+            source_it = prev_corpus_it
+            transform_fn = event_vector_network.layers[layer - 1].projection
+        else:
+            # run word lookup and all layers below for one last time
+            source_it = PretrainingCorpusIterator(
+                indexed_corpus,
+                model=event_vector_network,
+                layer_input=layer,
+                batch_size=batch_size)
+            transform_fn = None
+
+        self.log.info('Caching inputs of layer {} to {}'.format(
+            layer, cache_file))
+        corpus_it = LayerInputCacheIterator.build(
+            cache_file,
+            source_it,
+            num_rows=len(source_it),
+            input_size=event_vector_network.layers[layer].n_visible,
+            batch_size=batch_size,
+            dtype=cache_dtype,
+            output_dtype=theano.config.floatX,
+            transform_fn=transform_fn)
+        return corpus_it
 
     def fine_tuning(
             self, batch_iterator, iterations=3, learning_rate=0.025,
             min_learning_rate=0.001, regularization=0.01,
             update_event_vectors=False, update_input_vectors=False,
-            update_empty_vectors=False, val_batch_iterator=None):
+            update_empty_vectors=False, val_batch_iterator=None,
+            optimizer='sgd', optimizer_state=None, checkpoint_every=None,
+            resume=False, num_workers=1, parallel='hogwild',
+            val_every_batch=None, val_early_exit=False):
+        """
+        With num_workers > 1, parallel selects between Hogwild! asynchronous
+        SGD ('hogwild') and synchronous data-parallel training ('sync').
+
+        """
         self.log.info('Started pair composition fine tuning')
         self.log.info(
-            'Fine tuning with l2 reg={}, lr={}, min_lr={}, {} iterations, '
-            '{}-instance minibatches, {}updating event vectors, '
+            'Fine tuning with l2 reg={}, lr={}, min_lr={}, {} optimizer, '
+            '{} iterations, {}-instance minibatches, {}updating event vectors, '
             '{}updating input vectors, {}updating empty vectors'.format(
-                regularization, learning_rate, min_learning_rate,
+                regularization, learning_rate, min_learning_rate, optimizer,
                 iterations, batch_iterator.batch_size,
                 '' if update_event_vectors else 'not ',
                 '' if update_input_vectors else 'not ',
@@ -129,24 +275,71 @@ class EventCompositionTrainer(object):
                     os.path.join(saving_dir, 'iter_{}'.format(iter_num)),
                     save_word2vec=save_word2vec,
                     save_event_vector=save_event_vector,
-                    save_pair_composition=True
+                    save_pair_composition=True,
+                    optimizer=trainer.optimizer
                 )
 
-        trainer = PairCompositionTrainer(
-            self.model.pair_composition_network,
+        trainer_kwargs = dict(
             learning_rate=learning_rate,
             min_learning_rate=min_learning_rate,
             regularization=regularization,
             update_event_vectors=update_event_vectors,
             update_input_vectors=update_input_vectors,
-            update_empty_vectors=update_empty_vectors
+            update_empty_vectors=update_empty_vectors,
+            optimizer=optimizer
         )
+        if num_workers > 1 and parallel == 'sync':
+            self.log.info(
+                'Synchronous data-parallel training with {} '
+                'workers'.format(num_workers))
+            trainer = DataParallelPairCompositionTrainer(
+                self.model.pair_composition_network,
+                num_workers=num_workers,
+                **trainer_kwargs
+            )
+        elif num_workers > 1:
+            assert parallel == 'hogwild', \
+                'Unrecognized parallel training mode: {}'.format(parallel)
+            self.log.info(
+                'Hogwild! training with {} workers'.format(num_workers))
+            if checkpoint_every:
+                self.log.warning(
+                    'Checkpoints are only saved at the end of iterations '
+                    'in Hogwild! training')
+            if val_every_batch:
+                self.log.warning(
+                    'Validation is only run at the end of iterations '
+                    'in Hogwild! training')
+            trainer = HogwildPairCompositionTrainer(
+                self.model.pair_composition_network,
+                num_workers=num_workers,
+                **trainer_kwargs
+            )
+        else:
+            trainer = PairCompositionTrainer(
+                self.model.pair_composition_network,
+                **trainer_kwargs
+            )
+
+        training_state = None
+        if resume:
+            training_state = self.load_training_state(saving_dir)
+
+        def _checkpoint_callback(state):
+            self.save_training_state(saving_dir, state)
+
         trainer.train(
             batch_iterator,
             iterations=iterations,
             iteration_callback=_iteration_callback,
             log=self.log,
-            val_batch_iterator=val_batch_iterator
+            val_batch_iterator=val_batch_iterator,
+            optimizer_state=optimizer_state,
+            checkpoint_every=checkpoint_every,
+            checkpoint_callback=_checkpoint_callback,
+            resume_state=training_state,
+            val_every_batch=val_every_batch,
+            val_early_exit=val_early_exit
         )
 
         self.log.info('Finished pair composition fine tuning')
@@ -155,5 +348,7 @@ class EventCompositionTrainer(object):
             saving_dir,
             save_word2vec=True,
             save_event_vector=True,
-            save_pair_composition=True
+            save_pair_composition=True,
+            optimizer=trainer.optimizer
         )
+        self.remove_training_state(saving_dir)
@@ -8,7 +8,8 @@ from autoencoder import DenoisingAutoencoder
 class EventVectorNetwork(object):
     def __init__(self, word_vectors, vector_size, layer_sizes, pred_input=None,
                  subj_input=None, obj_input=None, pobj_input=None,
-                 inputs_a=None, inputs_b=None, inputs_c=None):
+                 inputs_a=None, inputs_b=None, inputs_c=None,
+                 vector_dtype=None, borrow_vectors=False):
         self.vector_size = vector_size
         self.layer_sizes = layer_sizes
         self.projection_size = self.layer_sizes[-1]
@@ -31,11 +32,17 @@ class EventVectorNetwork(object):
         else:
             self.pobj_input = T.vector("pobj", dtype="int32")
 
-        # Wrap the input vector matrices in a Theano variable
+        # Wrap the input vector matrices in a Theano variable, they can be
+        # stored with a lower precision than floatX (e.g., float16) to save
+        # memory, the looked up vectors are then upcast to floatX. With
+        # borrow_vectors, word_vectors is used without copying if it is of
+        # the same dtype (e.g., a read-only memory-mapped array for inference)
+        if vector_dtype is None:
+            vector_dtype = theano.config.floatX
         self.vectors = theano.shared(
-            numpy.asarray(word_vectors, dtype=theano.config.floatX),
+            numpy.asarray(word_vectors, dtype=vector_dtype),
             name="vectors",
-            borrow=False
+            borrow=borrow_vectors
         )
 
         # In order to stop the projections being thrown off by empty arguments,
@@ -165,16 +172,20 @@ class EventVectorNetwork(object):
         obj_input_col = obj_input.dimshuffle(shuffled_dims)
         pobj_input_col = pobj_input.dimshuffle(shuffled_dims)
 
+        def _lookup(indices):
+            # no-op if the vectors are stored as floatX
+            return T.cast(vectors[indices], theano.config.floatX)
+
         # Make the input to the first autoencoder by selecting the appropriate
         # vectors from the given matrices
         input_vector = T.concatenate(
             [
-                vectors[pred_input],
-                T.switch(T.neq(subj_input_col, -1), vectors[subj_input],
+                _lookup(pred_input),
+                T.switch(T.neq(subj_input_col, -1), _lookup(subj_input),
                          empty_subj_vector),
-                T.switch(T.neq(obj_input_col, -1), vectors[obj_input],
+                T.switch(T.neq(obj_input_col, -1), _lookup(obj_input),
                          empty_obj_vector),
-                T.switch(T.neq(pobj_input_col, -1), vectors[pobj_input],
+                T.switch(T.neq(pobj_input_col, -1), _lookup(pobj_input),
                          empty_pobj_vector),
             ],
             axis=pred_input.ndim
@@ -292,6 +303,11 @@ class EventVectorNetwork(object):
     def get_word_vectors(self):
         return self.vectors.get_value()
 
+    def set_word_vectors(self, word_vectors, borrow=False):
+        self.vectors.set_value(
+            numpy.asarray(word_vectors, dtype=self.vectors.dtype),
+            borrow=borrow)
+
     def get_weights(self):
         return [ae.get_weights() for ae in self.layers] + \
                [self.empty_subj_vector.get_value(),
@@ -0,0 +1,112 @@
+import pickle as pkl
+import sys
+from os import makedirs, rename
+from os.path import exists, join
+
+import numpy
+import theano
+
+# environment variable to enable the cache in load_event_comp_model
+FUNCTION_CACHE_DIR_ENV = 'EVENT_COMP_FUNCTION_CACHE'
+
+
+class FunctionCache(object):
+    """
+    Cache of EventVectorNetwork and PairCompositionNetwork instances with
+    their Theano functions (project, coherence_fn, and the projection of
+    each layer) already compiled, keyed by the architecture of the networks.
+
+    Building the networks and compiling the functions takes most of the
+    time in loading a model. The networks are pickled with all weights
+    replaced by empty arrays, and unpickled without re-optimizing the
+    functions, so a loaded network only needs its weights to be set.
+
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def get_key(vector_size, event_vector_layer_sizes,
+                pair_composition_layer_sizes=None, use_salience=False,
+                num_salience_features=0, vector_dtype=None):
+        key = 'ev_{}_{}'.format(
+            vector_size, '-'.join(str(s) for s in event_vector_layer_sizes))
+        if vector_dtype is not None \
+                and numpy.dtype(vector_dtype).name != theano.config.floatX:
+            # the looked up vectors are upcast in the compiled functions
+            key += '_{}'.format(numpy.dtype(vector_dtype).name)
+        if pair_composition_layer_sizes:
+            key += '_pc_{}'.format(
+                '-'.join(str(s) for s in pair_composition_layer_sizes))
+            if use_salience:
+                key += '_salience_{}'.format(num_salience_features)
+        # compiled functions also depend on the theano version and config
+        return '{}_{}_{}_theano-{}'.format(
+            key, theano.config.floatX, theano.config.device,
+            theano.__version__)
+
+    def get_path(self, key):
+        return join(self.cache_dir, key)
+
+    def load(self, key):
+        path = self.get_path(key)
+        if not exists(path):
+            return None
+        reoptimize = theano.config.reoptimize_unpickled_function
+        theano.config.reoptimize_unpickled_function = False
+        try:
+            with open(path, 'rb') as f:
+                event_vector_network, pair_composition_network = pkl.load(f)
+        finally:
+            theano.config.reoptimize_unpickled_function = reoptimize
+        return event_vector_network, pair_composition_network
+
+    def save(self, key, event_vector_network, pair_composition_network=None):
+        if not exists(self.cache_dir):
+            makedirs(self.cache_dir)
+
+        # make sure the lazily compiled function is included
+        if pair_composition_network is not None:
+            pair_composition_network.coherence_fn
+
+        shared_vars = FunctionCache.get_shared_variables(
+            event_vector_network, pair_composition_network)
+        values = [var.get_value(borrow=True) for var in shared_vars]
+        for var in shared_vars:
+            # broadcastable dimensions must be kept as size 1
+            var.set_value(numpy.zeros(
+                [1 if b else 0 for b in var.broadcastable],
+                dtype=var.dtype))
+
+        # the expression graphs are deeply nested
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(recursion_limit, 50000))
+        path = self.get_path(key)
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                pkl.dump((event_vector_network, pair_composition_network), f,
+                         pkl.HIGHEST_PROTOCOL)
+            rename(path + '.tmp', path)
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+            for var, value in zip(shared_vars, values):
+                var.set_value(value, borrow=True)
+
+    @staticmethod
+    def get_shared_variables(event_vector_network,
+                             pair_composition_network=None):
+        shared_vars = [
+            event_vector_network.vectors,
+            event_vector_network.empty_subj_vector,
+            event_vector_network.empty_obj_vector,
+            event_vector_network.empty_pobj_vector
+        ]
+        for layer in event_vector_network.layers:
+            shared_vars.extend(layer.params)
+        if pair_composition_network is not None:
+            for layer in pair_composition_network.layers:
+                shared_vars.extend(layer.params)
+            shared_vars.append(pair_composition_network.prediction_weights)
+            shared_vars.append(pair_composition_network.prediction_bias)
+        return shared_vars
@@ -0,0 +1,149 @@
+import multiprocessing
+
+import numpy
+import theano
+import theano.tensor as T
+
+from pair_composition_trainer import PairCompositionTrainer
+from util import to_shared_memory
+
+
+class HogwildPairCompositionTrainer(PairCompositionTrainer):
+    """
+    Train with Hogwild! asynchronous SGD (Recht et al., 2011): in every
+    iteration, num_workers forked processes train on disjoint shards of the
+    corpus, all reading and updating the same parameters in shared memory
+    without any locking. Validation, the learning rate schedule, callbacks
+    and checkpoints are handled by the master process between iterations,
+    the same as in PairCompositionTrainer.
+
+    Only the sgd optimizer is supported, and checkpoints are only saved at
+    the end of iterations.
+
+    """
+
+    def __init__(self, model, num_workers=2, **kwargs):
+        super(HogwildPairCompositionTrainer, self).__init__(model, **kwargs)
+        assert self.optimizer.name == 'sgd', \
+            'Hogwild! training only supports the sgd optimizer'
+        assert num_workers > 0, 'num_workers must be a positive integer'
+        self.num_workers = num_workers
+
+    def get_train_function(self):
+        """
+        Compile a function returning the cost and the gradients of all tuned
+        parameters on a batch, which the workers apply to the shared
+        parameters themselves.
+
+        """
+        cost = self.get_triple_cost_updates(compute_update=False)
+        outputs = [cost] + [T.grad(cost, param) for param in self.params]
+        if self.update_input_vectors and self.sparse_input_updates:
+            outputs.extend(self.get_input_vector_lookup_grads(cost))
+        return theano.function(
+            inputs=self.model.triple_inputs,
+            outputs=outputs,
+        )
+
+    def share_param_memory(self):
+        """
+        Move the values of all tuned parameters into shared memory, and
+        return the arrays now backing the parameters.
+
+        """
+        shared_values = []
+        for param in self.get_tuned_params():
+            shared_value = to_shared_memory(param.get_value(borrow=True))
+            param.set_value(shared_value, borrow=True)
+            # theano might copy the value if it is not a suitable array
+            assert param.get_value(borrow=True) is shared_value, \
+                'value of {} is not backed by shared memory'.format(param)
+            shared_values.append(shared_value)
+        return shared_values
+
+    def train_iteration(self, iteration, train_fn, batch_iterator,
+                        learning_rate, log, log_every_batch=1000,
+                        first_batch=0, err=0.0, batch_callback=None):
+        assert first_batch == 0, \
+            'cannot continue a partially completed iteration ' \
+            'with Hogwild! training'
+
+        # parameters are moved into shared memory again in every iteration,
+        # as their values might have been replaced in between (e.g., by
+        # set_param_values when resuming from a checkpoint)
+        shared_values = self.share_param_memory()
+
+        total_err = multiprocessing.Value('d', err)
+        total_batches = multiprocessing.Value('i', 0)
+        # every worker shuffles its batches with its own random seed
+        seeds = numpy.random.randint(2 ** 31 - 1, size=self.num_workers)
+
+        workers = [
+            multiprocessing.Process(
+                target=self.run_worker,
+                args=(worker_idx, iteration, train_fn, batch_iterator,
+                      learning_rate, shared_values, seeds[worker_idx],
+                      total_err, total_batches, log, log_every_batch))
+            for worker_idx in range(self.num_workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        failed_workers = [worker_idx for worker_idx, worker
+                          in enumerate(workers) if worker.exitcode != 0]
+        if failed_workers:
+            raise RuntimeError('Hogwild! worker(s) {} failed'.format(
+                ', '.join(str(idx) for idx in failed_workers)))
+
+        # the shards end with their own partial batches, so the total can
+        # differ from batch_iterator.num_batch
+        log.info(
+            'Iteration {}: Processed {:>8d} batches with {} workers'.format(
+                iteration, total_batches.value, self.num_workers))
+
+        return total_err.value, total_batches.value
+
+    def run_worker(self, worker_idx, iteration, grad_fn, batch_iterator,
+                   learning_rate, shared_values, seed, total_err,
+                   total_batches, log, log_every_batch=1000):
+        numpy.random.seed(seed)
+        batch_iterator.set_shard(self.num_workers, worker_idx)
+
+        num_params = len(self.params)
+        sparse_input_updates = \
+            self.update_input_vectors and self.sparse_input_updates
+
+        for batch_num, batch_inputs in enumerate(batch_iterator):
+            # Just shuffle within batches
+            shuffle = numpy.random.permutation(batch_inputs[0].shape[0])
+            for batch_data in batch_inputs:
+                batch_data[:] = batch_data[shuffle]
+
+            outputs = grad_fn(*batch_inputs)
+
+            # a partial (last) batch takes a proportionally smaller step
+            step_size = learning_rate * \
+                batch_inputs[0].shape[0] / batch_iterator.batch_size
+
+            # lock-free updates of the shared parameters
+            for value, grad in zip(shared_values, outputs[1:num_params + 1]):
+                value -= step_size * grad
+            if sparse_input_updates:
+                indices, grad_rows = outputs[num_params + 1:]
+                # rows looked up more than once accumulate their gradients
+                numpy.subtract.at(
+                    shared_values[-1], indices, step_size * grad_rows)
+
+            with total_err.get_lock():
+                total_err.value += float(outputs[0])
+            with total_batches.get_lock():
+                total_batches.value += 1
+
+            # without the number of batches of the shard, which would have
+            # to be counted by reading all its files
+            if worker_idx == 0 and (batch_num + 1) % log_every_batch == 0:
+                log.info(
+                    'Iteration {}: Worker 0 processed {:>8d} batches, '
+                    'learning rate = {:g}'.format(
+                        iteration, batch_num + 1, learning_rate))
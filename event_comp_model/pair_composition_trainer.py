@@ -2,6 +2,7 @@ import numpy
 import theano
 import theano.tensor as T
 
+from optimizers import get_optimizer
 from pair_composition_network import PairCompositionNetwork
 from util import get_class_name, get_console_logger
 
@@ -9,7 +10,8 @@ from util import get_class_name, get_console_logger
 class PairCompositionTrainer(object):
     def __init__(self, model, learning_rate=0.025, min_learning_rate=0.0001,
                  regularization=0.01, update_event_vectors=False,
-                 update_input_vectors=False, update_empty_vectors=False):
+                 update_input_vectors=False, update_empty_vectors=False,
+                 sparse_input_updates=True, optimizer='sgd'):
         assert isinstance(model, PairCompositionNetwork), \
             'model must be a {} instance'.format(
                 get_class_name(PairCompositionNetwork))
@@ -20,6 +22,14 @@ class PairCompositionTrainer(object):
         self.learning_rate = learning_rate
         self.learning_rate_var = T.scalar(
             'learning_rate', dtype=theano.config.floatX)
+        # the gradients of a batch are scaled by its size relative to the
+        # batch size, so that a partial (last) batch is not given the same
+        # weight as a full one
+        self.batch_weight_var = T.scalar(
+            'batch_weight', dtype=theano.config.floatX)
+        # update rule applied to all parameters, either an Optimizer instance
+        # or the name of one (see optimizers.OPTIMIZERS)
+        self.optimizer = get_optimizer(optimizer)
 
         # Collect parameters to be tuned from all layers
         self.params = []
@@ -42,7 +52,21 @@ class PairCompositionTrainer(object):
             self.regularized_params.extend(
                 [layer.W for layer in self.model.event_vector_network.layers])
 
+        # When updating input vectors, only the rows referenced in a batch
+        # are updated if sparse_input_updates is True (see
+        # get_sparse_input_vector_updates), otherwise the whole matrix is
+        # treated as a normal (dense) parameter. Optimizers that keep a
+        # per-parameter state for every update (momentum, adam) cannot skip
+        # rows that are not referenced, so they always use dense updates
+        self.sparse_input_updates = \
+            sparse_input_updates and self.optimizer.supports_sparse_updates
         if update_input_vectors:
+            assert self.model.event_vector_network.vectors.dtype == \
+                theano.config.floatX, \
+                'cannot update input vectors stored as {}, load the model ' \
+                'with vector_dtype=None'.format(
+                    self.model.event_vector_network.vectors.dtype)
+        if update_input_vectors and not self.sparse_input_updates:
             self.params.append(self.model.event_vector_network.vectors)
 
         if update_empty_vectors:
@@ -56,6 +80,35 @@ class PairCompositionTrainer(object):
         self.update_input_vectors = update_input_vectors
         self.update_empty_vectors = update_empty_vectors
 
+    def get_tuned_params(self):
+        """
+        Return all parameters being tuned, including the input vectors when
+        they are updated sparsely (and thus not in self.params).
+
+        """
+        params = list(self.params)
+        if self.update_input_vectors and self.sparse_input_updates:
+            params.append(self.model.event_vector_network.vectors)
+        return params
+
+    def get_param_values(self):
+        """
+        Return a copy of the values of all parameters being tuned.
+        """
+        return [param.get_value() for param in self.get_tuned_params()]
+
+    def set_param_values(self, param_values):
+        """
+        Set all parameters being tuned from a list, like that returned by
+        get_param_values().
+        """
+        params = self.get_tuned_params()
+        assert len(param_values) == len(params), \
+            'expecting {} parameter values, found {}'.format(
+                len(params), len(param_values))
+        for param, value in zip(params, param_values):
+            param.set_value(value)
+
     def get_triple_cost_updates(self, regularization=None, compute_update=True):
         if regularization is None:
             regularization = self.regularization
@@ -79,53 +132,191 @@ class PairCompositionTrainer(object):
 
         if compute_update:
             # Now differentiate to get the updates
-            gparams = [T.grad(cost, param) for param in self.params]
-            updates = [(param, param - self.learning_rate_var * gparam)
-                       for param, gparam in zip(self.params, gparams)]
+            weighted_cost = cost * self.batch_weight_var
+            gparams = [T.grad(weighted_cost, param) for param in self.params]
+            updates = self.optimizer.get_updates(
+                self.params, gparams, self.learning_rate_var)
+
+            if self.update_input_vectors and self.sparse_input_updates:
+                updates.extend(
+                    self.get_sparse_input_vector_updates(weighted_cost))
 
             return cost, updates
         else:
             return cost
 
+    def get_sparse_input_vector_updates(self, cost):
+        """
+        Compute the update of the input word vectors by only touching the
+        rows looked up in the current batch, so that the cost of an update
+        does not depend on the vocabulary size.
+
+        Every lookup of the vectors matrix in the cost graph is an
+        AdvancedSubtensor1 node, we take the gradient with respect to the
+        looked up rows and increment them in the shared matrix. Rows looked
+        up more than once accumulate all their gradients, the same as in the
+        dense update. Lookups of -1 (empty arguments) get a zero gradient, as
+        they are switched out for the empty argument vectors.
+
+        """
+        vectors = self.model.event_vector_network.vectors
+        indices, grad_rows = self.get_input_vector_lookup_grads(cost)
+        return self.optimizer.get_sparse_updates(
+            vectors, indices, grad_rows, self.learning_rate_var)
+
+    def get_input_vector_lookup_grads(self, cost):
+        """
+        Return the indices of all rows of the input vectors looked up in the
+        cost, and the gradients of the cost with respect to these rows.
+
+        """
+        vectors = self.model.event_vector_network.vectors
+        lookups = [
+            var for var in theano.gof.graph.ancestors([cost])
+            if var.owner is not None
+            and isinstance(var.owner.op, T.subtensor.AdvancedSubtensor1)
+            and var.owner.inputs[0] is vectors]
+        assert lookups, 'cannot find any lookup of input vectors in the cost'
+
+        grads = T.grad(cost, lookups)
+        indices = T.concatenate([lookup.owner.inputs[1] for lookup in lookups])
+        grad_rows = T.concatenate(grads, axis=0)
+        return indices, grad_rows
+
+    def get_train_function(self):
+        # Prepare cost/update functions for training
+        cost, updates = self.get_triple_cost_updates(compute_update=True)
+        # Prepare training functions
+        return theano.function(
+            inputs=self.model.triple_inputs + [
+                # Allow the learning rate to be set per update
+                theano.In(self.learning_rate_var, value=self.learning_rate),
+                theano.In(self.batch_weight_var, value=1.0)
+            ],
+            outputs=cost,
+            updates=updates,
+        )
+
+    def train_iteration(self, iteration, train_fn, batch_iterator,
+                        learning_rate, log, log_every_batch=1000,
+                        first_batch=0, err=0.0, batch_callback=None):
+        """
+        Run one pass over batch_iterator, starting from batch first_batch
+        (when continuing a partially completed iteration, where err is the
+        cost summed over the batches before). batch_callback is called after
+        every batch with the number of batches processed and the summed cost.
+
+        The last batch might be smaller than batch_iterator.batch_size, its
+        updates are then scaled by its relative size.
+
+        Return the summed cost and the number of batches of the iteration.
+
+        """
+        num_batches = first_batch
+        for batch_num, batch_inputs in enumerate(batch_iterator, first_batch):
+            # Shuffle the training data between iterations, as one should
+            # with SGD
+            # Just shuffle within batches
+            shuffle = numpy.random.permutation(batch_inputs[0].shape[0])
+            for batch_data in batch_inputs:
+                batch_data[:] = batch_data[shuffle]
+
+            # Update the model with this batch's data
+            batch_weight = \
+                float(batch_inputs[0].shape[0]) / batch_iterator.batch_size
+            err += train_fn(*batch_inputs, learning_rate=learning_rate,
+                            batch_weight=batch_weight)
+            num_batches = batch_num + 1
+
+            if num_batches % log_every_batch == 0:
+                log.info(
+                    'Iteration {}: Processed {:>8d}/{:>8d} batches, '
+                    'learning rate = {:g}'.format(
+                        iteration, num_batches, batch_iterator.num_batch,
+                        learning_rate))
+
+            if batch_callback is not None:
+                batch_callback(num_batches, err)
+
+        log.info(
+            'Iteration {}: Processed {:>8d}/{:>8d} batches'.format(
+                iteration, batch_iterator.num_batch, batch_iterator.num_batch))
+
+        return err, num_batches
+
     @staticmethod
-    def compute_val_cost(cost_fn, val_batch_iterator):
+    def compute_val_cost(cost_fn, val_batch_iterator, early_exit_cost=None):
+        """
+        Return the mean cost over all examples in val_batch_iterator.
+
+        If early_exit_cost is given, stop as soon as the cost is known to be
+        higher than it, and return a lower bound of the cost (still higher
+        than early_exit_cost). This relies on the cost of every example being
+        non-negative, and len(val_batch_iterator) being the number of
+        examples.
+
+        """
+        # mean over all examples, as the last batch might be smaller
         cost = 0.0
-        batch_num = 0
-        for batch_num, batch_inputs in enumerate(val_batch_iterator):
-            cost += cost_fn(*batch_inputs)
-        return cost / (batch_num + 1)
+        num_examples = 0
+        for batch_inputs in val_batch_iterator:
+            batch_size = batch_inputs[0].shape[0]
+            cost += cost_fn(*batch_inputs) * batch_size
+            num_examples += batch_size
+            if early_exit_cost is not None \
+                    and cost / len(val_batch_iterator) > early_exit_cost:
+                return cost / len(val_batch_iterator)
+        return cost / max(num_examples, 1)
 
     def train(self, batch_iterator, iterations=10000, iteration_callback=None,
               log=None, training_cost_prop_change_threshold=0.0005,
               val_batch_iterator=None, stopping_iterations=10,
-              log_every_batch=1000):
+              log_every_batch=1000, optimizer_state=None,
+              checkpoint_every=None, checkpoint_callback=None,
+              resume_state=None, val_every_batch=None, val_early_exit=False):
+        """
+        val_batch_iterator is read once per validation, it can be a
+        CachedBatchIterator holding (a subsample of) the validation corpus in
+        memory, with a larger batch size than in training. If val_every_batch
+        is given, the validation cost is also computed every val_every_batch
+        batches within an iteration, and the best weights are kept from any
+        of these points. If val_early_exit is True, validation stops as soon
+        as the cost cannot be lower than the best one, only a lower bound of
+        the cost is then logged.
+
+        If checkpoint_callback is given, it is called with a dict of the full
+        training state (see _training_state below) at the end of every
+        iteration, and every checkpoint_every batches within an iteration.
+        Passing such a dict as resume_state continues training from the exact
+        point where it was saved. batch_iterator (and val_batch_iterator)
+        must be the same as in the run being resumed.
+
+        """
         # TODO: add logic for validation set and stopping_iterations parameter
         if log is None:
             log = get_console_logger('pair_comp_tuning')
 
         log.info(
-            'Tuning params: learning rate={} (->{}), regularization={}'.format(
+            'Tuning params: learning rate={} (->{}), regularization={}, '
+            'optimizer={}'.format(
                 self.learning_rate, self.min_learning_rate,
-                self.regularization))
+                self.regularization, self.optimizer.name))
         if self.update_event_vectors:
             log.info('Updating event vector network')
         if self.update_input_vectors:
-            log.info('Updating word2vec word representations')
+            log.info('Updating word2vec word representations ({})'.format(
+                'sparse row updates' if self.sparse_input_updates
+                else 'dense updates'))
         if self.update_empty_vectors:
             log.info('Training empty argument vectors')
 
         # Compile functions
-        # Prepare cost/update functions for training
-        cost, updates = self.get_triple_cost_updates(compute_update=True)
-        # Prepare training functions
-        train_fn = theano.function(
-            inputs=self.model.triple_inputs + [
-                # Allow the learning rate to be set per update
-                theano.In(self.learning_rate_var, value=self.learning_rate)
-            ],
-            outputs=cost,
-            updates=updates,
-        )
+        train_fn = self.get_train_function()
+        if optimizer_state is not None:
+            # Restore the optimizer state (e.g., from a saved checkpoint),
+            # only possible after the updates have been built
+            log.info('Restoring {} optimizer state'.format(self.optimizer.name))
+            self.optimizer.set_state(optimizer_state)
         # Prepare cost functions without regularization for validation
         cost_without_reg = self.get_triple_cost_updates(
             regularization=0., compute_update=False)
@@ -140,51 +331,131 @@ class PairCompositionTrainer(object):
 
         # Keep a copy of the best weights so far
         best_weights = best_iter = best_val_cost = None
-        if val_batch_iterator is not None:
-            best_weights = self.model.get_weights()
-            best_iter = -1
-            best_val_cost = PairCompositionTrainer.compute_val_cost(
-                cost_fn, val_batch_iterator)
+        # validation costs within iterations, as (iteration, batch, cost)
+        batch_val_costs = []
+        # best validation cost (and weights) within the current iteration,
+        # only compared to the best of previous iterations at its end
+        batch_best = {}
 
         below_threshold_its = 0
 
         learning_rate = self.learning_rate
         last_update_lr_iter = 0
 
-        for i in range(iterations):
-            err = 0.0
-            batch_num = 0
-
-            for batch_num, batch_inputs in enumerate(batch_iterator):
-                # Shuffle the training data between iterations, as one should
-                # with SGD
-                # Just shuffle within batches
-                shuffle = numpy.random.permutation(batch_inputs[0].shape[0])
-                for batch_data in batch_inputs:
-                    batch_data[:] = batch_data[shuffle]
+        def _training_state(iteration, batch_num, err, corpus_position):
+            return {
+                'iteration': iteration,
+                'batch_num': batch_num,
+                'err': err,
+                'corpus_position': corpus_position,
+                'training_costs': training_costs,
+                'val_costs': val_costs,
+                'batch_val_costs': batch_val_costs,
+                'batch_best': batch_best,
+                'best_weights': best_weights,
+                'best_iter': best_iter,
+                'best_val_cost': best_val_cost,
+                'below_threshold_its': below_threshold_its,
+                'learning_rate': learning_rate,
+                'last_update_lr_iter': last_update_lr_iter,
+                'param_values': self.get_param_values(),
+                'optimizer_state': self.optimizer.get_state(),
+                'rng_state': numpy.random.get_state()
+            }
+
+        start_iter = start_batch = 0
+        start_err = 0.0
+        if resume_state is not None:
+            start_iter = resume_state['iteration']
+            start_batch = resume_state['batch_num']
+            start_err = resume_state['err']
+            training_costs = resume_state['training_costs']
+            val_costs = resume_state['val_costs']
+            batch_val_costs = resume_state.get('batch_val_costs', [])
+            if start_batch > 0:
+                batch_best = resume_state.get('batch_best', {})
+            best_weights = resume_state['best_weights']
+            best_iter = resume_state['best_iter']
+            best_val_cost = resume_state['best_val_cost']
+            below_threshold_its = resume_state['below_threshold_its']
+            learning_rate = resume_state['learning_rate']
+            last_update_lr_iter = resume_state['last_update_lr_iter']
+            self.set_param_values(resume_state['param_values'])
+            self.optimizer.set_state(resume_state['optimizer_state'])
+            numpy.random.set_state(resume_state['rng_state'])
+            batch_iterator.seek(resume_state['corpus_position'])
+            log.info(
+                'Resuming from iteration {}, batch {}, '
+                'learning rate = {:g}'.format(
+                    start_iter, start_batch, learning_rate))
+        elif val_batch_iterator is not None:
+            best_weights = self.model.get_weights()
+            best_iter = -1
+            best_val_cost = PairCompositionTrainer.compute_val_cost(
+                cost_fn, val_batch_iterator)
+            log.info('Initial validation cost: {:.4f}'.format(best_val_cost))
 
-                # Update the model with this batch's data
-                err += train_fn(*batch_inputs, learning_rate=learning_rate)
+        def _compute_val_cost(best_cost):
+            return PairCompositionTrainer.compute_val_cost(
+                cost_fn, val_batch_iterator,
+                early_exit_cost=best_cost if val_early_exit else None)
 
-                if (batch_num + 1) % log_every_batch == 0:
+        for i in range(start_iter, iterations):
+            err = 0.0
+            first_batch = 0
+            if i == start_iter and start_batch > 0:
+                # continue a partially completed iteration
+                err = start_err
+                first_batch = start_batch
+            else:
+                batch_best.clear()
+
+            def _batch_callback(num_batches, batch_err, iteration=i):
+                if val_batch_iterator is not None and val_every_batch \
+                        and num_batches % val_every_batch == 0 \
+                        and num_batches < batch_iterator.num_batch:
+                    # the end of the iteration is validated anyway
+                    best_cost = min(
+                        best_val_cost, batch_best.get('val_cost', numpy.inf))
+                    val_cost = _compute_val_cost(best_cost)
+                    batch_val_costs.append((iteration, num_batches, val_cost))
                     log.info(
-                        'Iteration {}: Processed {:>8d}/{:>8d} batches, '
-                        'learning rate = {:g}'.format(
-                            i, batch_num + 1, batch_iterator.num_batch,
-                            learning_rate))
-
-            log.info(
-                'Iteration {}: Processed {:>8d}/{:>8d} batches'.format(
-                    i, batch_iterator.num_batch, batch_iterator.num_batch))
-
-            training_costs.append(err / (batch_num+1))
+                        'Iteration {}: validation cost after {} batches: '
+                        '{:.5g}'.format(iteration, num_batches, val_cost))
+                    if val_cost < best_cost:
+                        batch_best['val_cost'] = val_cost
+                        batch_best['weights'] = self.model.get_weights()
+                        batch_best['batch_num'] = num_batches
+                if checkpoint_callback is not None and checkpoint_every \
+                        and num_batches % checkpoint_every == 0:
+                    checkpoint_callback(_training_state(
+                        iteration, num_batches, batch_err,
+                        batch_iterator.tell()))
+
+            err, num_batches = self.train_iteration(
+                i, train_fn, batch_iterator, learning_rate, log,
+                log_every_batch=log_every_batch, first_batch=first_batch,
+                err=err, batch_callback=_batch_callback)
+
+            training_costs.append(err / max(num_batches, 1))
 
             if val_batch_iterator is not None:
                 # Compute the cost function on the validation set
-                val_cost = PairCompositionTrainer.compute_val_cost(
-                    cost_fn, val_batch_iterator)
+                val_cost = _compute_val_cost(
+                    min(best_val_cost, batch_best.get('val_cost', numpy.inf)))
                 val_costs.append(val_cost)
-                if val_cost <= best_val_cost:
+                if batch_best and batch_best['val_cost'] < val_cost:
+                    # The weights within the iteration were better than at its
+                    # end, and than the best so far
+                    log.info(
+                        'New best validation cost: {:.4f}, after {} batches '
+                        'of iteration {}'.format(
+                            batch_best['val_cost'], batch_best['batch_num'],
+                            i))
+                    best_weights = batch_best['weights']
+                    best_iter = i
+                    best_val_cost = batch_best['val_cost']
+                elif val_cost <= best_val_cost:
                     # We assume that, if the validation error remains the same,
                     # it's better to use the new set of
                     # weights (with, presumably, a better training error)
@@ -262,6 +533,10 @@ class PairCompositionTrainer(object):
                     # Reset the below threshold counter
                     below_threshold_its = 0
 
+            if checkpoint_callback is not None:
+                # the next iteration starts from the beginning of the corpus
+                checkpoint_callback(_training_state(i + 1, 0, 0.0, None))
+
         if best_weights is not None:
             # Use the weights that gave us the best error on the validation set
             self.model.set_weights(best_weights)
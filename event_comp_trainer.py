@@ -2,7 +2,8 @@ import argparse
 import os
 
 from event_comp_model import EventCompositionModel, EventCompositionTrainer
-from rich_script import PairTuningCorpusIterator
+from optimizers import OPTIMIZERS
+from rich_script import CachedBatchIterator, PairTuningCorpusIterator
 from util import Word2VecModel, consts, get_console_logger
 
 parser = argparse.ArgumentParser()
@@ -32,6 +33,15 @@ parser.add_argument('--corruption', type=float, default=0.2,
                     help='Level of drop-out noise to apply during '
                          'autoencoder pre-training, 0.0-1.0 (default: 0.2), '
                          'only used in stage 1')
+parser.add_argument('--cache_layer_inputs', action='store_true',
+                    help='Materialize the inputs to each layer (above the '
+                         'first one) once to a memory-mapped file, instead of '
+                         're-running all lower layers for every batch, '
+                         'only used in stage 1')
+parser.add_argument('--cache_dtype', default='float32',
+                    choices=['float32', 'float16'],
+                    help='Data type of cached layer inputs '
+                         '(default: float32), only used in stage 1')
 parser.add_argument('--use_salience', action='store_true',
                     help='Whether or not we use entity salience features,'
                          'only used in stage 2/3')
@@ -41,9 +51,30 @@ parser.add_argument('--salience_features',
 parser.add_argument('--input_path',
                     help='Path to load a partially trained model, '
                          'only used in stage 2/3')
+parser.add_argument('--init_checkpoint',
+                    help='Directory of a checkpoint saved in fine tuning '
+                         '(e.g., fine_tuning/iter_N) to continue from: the '
+                         'weights saved in it are loaded into the model from '
+                         '--input_path, and the optimizer state saved with it '
+                         'is restored (with the same --optimizer), '
+                         'only used in stage 2/3')
 parser.add_argument('--val_indexed_corpus',
                     help='Path to the indexed corpus for validation, '
                          'only used in stage 2/3')
+parser.add_argument('--val_batch_size', type=int,
+                    help='Number of examples in a minibatch for validation '
+                         '(default: same as --batch_size)')
+parser.add_argument('--val_sample_size', type=int, default=0,
+                    help='Validate on a fixed random subsample of N examples '
+                         'of the validation corpus, held in memory '
+                         '(default: 0, the full corpus read from disk)')
+parser.add_argument('--val_every', type=int, default=0,
+                    help='Also validate every N batches within an iteration, '
+                         'and keep the best weights of any of these points '
+                         '(default: 0, only at the end of every iteration)')
+parser.add_argument('--val_early_exit', action='store_true',
+                    help='Stop a validation pass as soon as the cost cannot '
+                         'beat the best one so far')
 parser.add_argument('--iterations', type=int, default=10,
                     help='Number of training iterations (default: 10)')
 parser.add_argument('--batch_size', type=int, default=100,
@@ -52,10 +83,33 @@ parser.add_argument('--batch_size', type=int, default=100,
 parser.add_argument('--regularization', type=float, default=0.01,
                     help='L2 regularization coefficient (default: 0.01)')
 parser.add_argument('--lr', type=float, default=0.1,
-                    help='SGD learning rate (default: 0.1)')
+                    help='SGD learning rate (default: 0.1), also the base '
+                         'learning rate (step size) of other optimizers')
 parser.add_argument('--min_lr', type=float, default=0.01,
                     help='Minimum SGD learning rate to drop off '
                          '(default: 0.01), only used in stage 2')
+parser.add_argument('--optimizer', default='sgd', choices=sorted(OPTIMIZERS),
+                    help='Update rule used in training (default: sgd), '
+                         'its state is saved with every checkpoint')
+parser.add_argument('--checkpoint_every', type=int, default=0,
+                    help='Save a resumable training checkpoint every N '
+                         'batches, in addition to the end of every iteration '
+                         '(default: 0, only at the end of every iteration)')
+parser.add_argument('--resume', action='store_true',
+                    help='Resume training from the last checkpoint saved in '
+                         'output_path, if any. All other arguments should be '
+                         'the same as in the interrupted run')
+parser.add_argument('--workers', type=int, default=1,
+                    help='Number of worker processes to train with '
+                         '(default: 1, no parallelism), stage 1 always uses '
+                         'synchronous data-parallel training')
+parser.add_argument('--parallel', default='hogwild',
+                    choices=['hogwild', 'sync'],
+                    help='Parallel training mode in stage 2/3 with --workers: '
+                         'Hogwild! asynchronous SGD, only with --optimizer '
+                         'sgd (default), or synchronous data-parallel '
+                         'training, with results equivalent to 1 worker, '
+                         'only with --optimizer sgd or adagrad in stage 3')
 parser.add_argument('--update_empty_vectors', action='store_true',
                     help='Vectors for empty arg slots are initialized to 0. '
                          'Allow these to be learned during full fine tuning. '
@@ -63,6 +117,12 @@ parser.add_argument('--update_empty_vectors', action='store_true',
 
 opts = parser.parse_args()
 
+if opts.stage == 3 and opts.workers > 1 and opts.parallel == 'sync' \
+        and not OPTIMIZERS[opts.optimizer].supports_sparse_updates:
+    parser.error(
+        'synchronous data-parallel training cannot update input vectors with '
+        'the {} optimizer, use sgd or adagrad'.format(opts.optimizer))
+
 log = get_console_logger('event_comp_trainer')
 
 if opts.stage == 1:
@@ -88,7 +148,13 @@ if opts.stage == 1:
         iterations=opts.iterations,
         learning_rate=opts.lr,
         regularization=opts.regularization,
-        corruption_level=opts.corruption
+        corruption_level=opts.corruption,
+        cache_layer_inputs=opts.cache_layer_inputs,
+        cache_dtype=opts.cache_dtype,
+        optimizer=opts.optimizer,
+        checkpoint_every=opts.checkpoint_every,
+        resume=opts.resume,
+        num_workers=opts.workers
     )
 
 elif opts.stage == 2 or opts.stage == 3:
@@ -129,6 +195,17 @@ elif opts.stage == 2 or opts.stage == 3:
         assert event_composition_model.pair_composition_network.salience_features \
             == salience_features
 
+    optimizer_state = None
+    if opts.init_checkpoint:
+        log.info('Loading checkpoint from {}'.format(opts.init_checkpoint))
+        event_composition_model.load_checkpoint(opts.init_checkpoint)
+        optimizer_state = EventCompositionModel.load_optimizer_state(
+            opts.init_checkpoint, opts.optimizer)
+        if optimizer_state is None:
+            log.warning(
+                'No optimizer state saved in {}, starting with a new {} '
+                'optimizer'.format(opts.init_checkpoint, opts.optimizer))
+
     event_composition_trainer = EventCompositionTrainer(
         event_composition_model, saving_path=opts.output_path, log=log)
 
@@ -148,14 +225,21 @@ elif opts.stage == 2 or opts.stage == 3:
 
     val_corpus_it = None
     if opts.val_indexed_corpus and os.path.isdir(opts.val_indexed_corpus):
+        val_batch_size = opts.val_batch_size or opts.batch_size
         log.info(
             'Loading validation indexed corpus from: {}, '
             'with batch_size={}, use_salience={}'.format(
-                opts.val_indexed_corpus, opts.batch_size, opts.use_salience))
+                opts.val_indexed_corpus, val_batch_size, opts.use_salience))
         val_corpus_it = PairTuningCorpusIterator(
-            opts.val_indexed_corpus, batch_size=opts.batch_size,
+            opts.val_indexed_corpus, batch_size=val_batch_size,
             use_salience=opts.use_salience, salience_features=salience_features)
         log.info('Found {} lines in the corpus'.format(len(val_corpus_it)))
+        if opts.val_sample_size > 0:
+            # a fixed seed, so that a resumed run validates on the same sample
+            val_corpus_it = CachedBatchIterator.from_batch_iterator(
+                val_corpus_it, sample_size=opts.val_sample_size, seed=0)
+            log.info('Cached a random subsample of {} lines in memory'.format(
+                len(val_corpus_it)))
 
     if opts.stage == 2:
         event_composition_trainer.fine_tuning(
@@ -167,7 +251,15 @@ elif opts.stage == 2 or opts.stage == 3:
             update_event_vectors=False,
             update_input_vectors=False,
             update_empty_vectors=False,
-            val_batch_iterator=val_corpus_it
+            val_batch_iterator=val_corpus_it,
+            optimizer=opts.optimizer,
+            optimizer_state=optimizer_state,
+            checkpoint_every=opts.checkpoint_every,
+            resume=opts.resume,
+            num_workers=opts.workers,
+            parallel=opts.parallel,
+            val_every_batch=opts.val_every,
+            val_early_exit=opts.val_early_exit
         )
     else:
         event_composition_trainer.fine_tuning(
@@ -179,7 +271,15 @@ elif opts.stage == 2 or opts.stage == 3:
             update_event_vectors=True,
             update_input_vectors=True,
             update_empty_vectors=opts.update_empty_vectors,
-            val_batch_iterator=val_corpus_it
+            val_batch_iterator=val_corpus_it,
+            optimizer=opts.optimizer,
+            optimizer_state=optimizer_state,
+            checkpoint_every=opts.checkpoint_every,
+            resume=opts.resume,
+            num_workers=opts.workers,
+            parallel=opts.parallel,
+            val_every_batch=opts.val_every,
+            val_early_exit=opts.val_early_exit
         )
 
 else:
@@ -0,0 +1,235 @@
+import json
+from os import makedirs
+from os.path import exists, join
+
+import numpy
+from numpy.lib.format import open_memmap
+
+
+def normalize_rows(vectors):
+    norms = numpy.sqrt((vectors ** 2).sum(-1))[..., numpy.newaxis]
+    # projections of all zeros stay zeros
+    return vectors / numpy.maximum(norms, 1e-12)
+
+
+def _merge_top_k(scores, ids, new_scores, new_ids, k):
+    # keep the k highest scores of every row of the concatenation
+    scores = numpy.concatenate([scores, new_scores], axis=1)
+    ids = numpy.concatenate([ids, new_ids], axis=1)
+    if scores.shape[1] > k:
+        top = numpy.argpartition(-scores, k - 1, axis=1)[:, :k]
+        rows = numpy.arange(len(scores))[:, None]
+        scores = scores[rows, top]
+        ids = ids[rows, top]
+    return scores, ids
+
+
+class EventIndex(object):
+    """
+    Approximate nearest neighbor (cosine similarity) index over projected
+    events, an inverted file (IVF) index: the normalized vectors are
+    clustered by spherical k-means into num_lists lists, and only the
+    vectors in the num_probes lists with the closest centroids are scored
+    for each query.
+
+    The index is stored in a directory, with the events (as
+    (pred, subj, obj, pobj) indices), their counts in the corpus and their
+    vectors sorted by list, so that they can be memory-mapped and every
+    probed list is read as one contiguous slice.
+
+    """
+
+    def __init__(self, index_dir, events, counts, vectors, centroids,
+                 list_offsets):
+        self.index_dir = index_dir
+        self.events = events
+        self.counts = counts
+        self.vectors = vectors
+        self.centroids = centroids
+        # vectors of list i are vectors[list_offsets[i]:list_offsets[i+1]]
+        self.list_offsets = list_offsets
+
+    def __len__(self):
+        return len(self.events)
+
+    @property
+    def num_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, index_dir, events, counts, vectors, num_lists=None,
+              num_iterations=10, sample_size=100000, chunk_size=100000,
+              seed=0, log=None):
+        """
+        Build an index in index_dir from events (an array of shape (N, 4)),
+        their counts and their vectors (of shape (N, D), can be a memmap),
+        which are normalized. The k-means centroids are trained for
+        num_iterations on a random sample of sample_size vectors, num_lists
+        is sqrt(N) by default. All vectors are processed in chunks of
+        chunk_size rows.
+
+        """
+        num_events = len(events)
+        assert len(counts) == num_events and len(vectors) == num_events, \
+            'events, counts and vectors must be of the same length'
+        if not exists(index_dir):
+            makedirs(index_dir)
+        if num_lists is None:
+            num_lists = max(int(numpy.sqrt(num_events)), 1)
+        num_lists = min(num_lists, num_events)
+
+        rng = numpy.random.RandomState(seed)
+        sample = normalize_rows(numpy.asarray(
+            vectors[numpy.sort(rng.choice(
+                num_events, min(sample_size, num_events), replace=False))],
+            dtype=numpy.float32))
+        centroids = sample[rng.choice(len(sample), num_lists, replace=False)]
+        for iteration in range(num_iterations):
+            assignments = numpy.dot(sample, centroids.T).argmax(axis=1)
+            new_centroids = numpy.zeros_like(centroids)
+            numpy.add.at(new_centroids, assignments, sample)
+            # keep the old centroids of empty lists
+            empty = numpy.bincount(assignments, minlength=num_lists) == 0
+            new_centroids[empty] = centroids[empty]
+            centroids = normalize_rows(new_centroids)
+            if log is not None:
+                log.info('K-means iteration #{}: mean similarity = {:.4f}, '
+                         '{} empty lists'.format(
+                            iteration + 1,
+                            numpy.dot(sample, centroids.T).max(axis=1).mean(),
+                            empty.sum()))
+
+        assignments = numpy.empty(num_events, dtype=numpy.int64)
+        for start in range(0, num_events, chunk_size):
+            chunk = normalize_rows(numpy.asarray(
+                vectors[start:start + chunk_size], dtype=numpy.float32))
+            assignments[start:start + chunk_size] = \
+                numpy.dot(chunk, centroids.T).argmax(axis=1)
+        order = numpy.argsort(assignments, kind='mergesort')
+        list_offsets = numpy.zeros(num_lists + 1, dtype=numpy.int64)
+        list_offsets[1:] = numpy.cumsum(
+            numpy.bincount(assignments, minlength=num_lists))
+
+        numpy.save(join(index_dir, 'events.npy'),
+                   numpy.asarray(events, dtype=numpy.int32)[order])
+        numpy.save(join(index_dir, 'counts.npy'),
+                   numpy.asarray(counts, dtype=numpy.int64)[order])
+        numpy.save(join(index_dir, 'centroids.npy'), centroids)
+        numpy.save(join(index_dir, 'list_offsets.npy'), list_offsets)
+        sorted_vectors = open_memmap(
+            join(index_dir, 'vectors.npy'), mode='w+', dtype=numpy.float32,
+            shape=(num_events, vectors.shape[1]))
+        for start in range(0, num_events, chunk_size):
+            chunk_order = order[start:start + chunk_size]
+            sorted_vectors[start:start + len(chunk_order)] = normalize_rows(
+                numpy.asarray(vectors[chunk_order], dtype=numpy.float32))
+        sorted_vectors.flush()
+        del sorted_vectors
+        with open(join(index_dir, 'index_info.json'), 'w') as f:
+            json.dump({'num_events': num_events, 'num_lists': num_lists,
+                       'vector_size': vectors.shape[1]}, f)
+
+        return cls.load(index_dir)
+
+    @classmethod
+    def load(cls, index_dir, mmap_mode='r'):
+        if not exists(join(index_dir, 'index_info.json')):
+            raise RuntimeError(
+                '{} does not contain an event index'.format(index_dir))
+        return cls(
+            index_dir,
+            events=numpy.load(join(index_dir, 'events.npy'),
+                              mmap_mode=mmap_mode),
+            counts=numpy.load(join(index_dir, 'counts.npy'),
+                              mmap_mode=mmap_mode),
+            vectors=numpy.load(join(index_dir, 'vectors.npy'),
+                               mmap_mode=mmap_mode),
+            centroids=numpy.load(join(index_dir, 'centroids.npy')),
+            list_offsets=numpy.load(join(index_dir, 'list_offsets.npy')))
+
+    def query(self, query_vectors, k=10, num_probes=8):
+        """
+        Return the scores (cosine similarities) and ids (positions in the
+        index, see get_events) of the approximate top k neighbors of every
+        query vector, as arrays of shape (num_queries, k) sorted by score,
+        padded with -inf scores and -1 ids if fewer than k are found.
+
+        Every probed list is scored against all the queries probing it in
+        one matrix product.
+
+        """
+        query_vectors = normalize_rows(
+            numpy.atleast_2d(numpy.asarray(query_vectors, dtype=numpy.float32)))
+        num_queries = len(query_vectors)
+        num_probes = min(num_probes, self.num_lists)
+
+        centroid_scores = numpy.dot(query_vectors, self.centroids.T)
+        probes = numpy.argpartition(
+            -centroid_scores, num_probes - 1, axis=1)[:, :num_probes]
+
+        best_scores = numpy.full((num_queries, k), -numpy.inf,
+                                 dtype=numpy.float32)
+        best_ids = numpy.full((num_queries, k), -1, dtype=numpy.int64)
+
+        # group the queries by the lists they probe
+        probe_lists = probes.ravel()
+        probe_queries = numpy.repeat(numpy.arange(num_queries), num_probes)
+        order = numpy.argsort(probe_lists, kind='mergesort')
+        probe_lists = probe_lists[order]
+        probe_queries = probe_queries[order]
+        boundaries = numpy.flatnonzero(numpy.diff(probe_lists)) + 1
+        for list_queries, list_idx in zip(
+                numpy.split(probe_queries, boundaries),
+                probe_lists[numpy.r_[0, boundaries]]):
+            start, end = self.list_offsets[list_idx:list_idx + 2]
+            if start == end:
+                continue
+            # (num list queries, list size)
+            list_scores = numpy.dot(
+                query_vectors[list_queries], self.vectors[start:end].T)
+            list_ids = numpy.arange(start, end)
+            if end - start > k:
+                top = numpy.argpartition(-list_scores, k - 1, axis=1)[:, :k]
+                list_scores = list_scores[
+                    numpy.arange(len(list_queries))[:, None], top]
+                list_ids = list_ids[top]
+            else:
+                list_ids = numpy.tile(list_ids, (len(list_queries), 1))
+            best_scores[list_queries], best_ids[list_queries] = _merge_top_k(
+                best_scores[list_queries], best_ids[list_queries],
+                list_scores, list_ids, k)
+
+        return self._sort_results(best_scores, best_ids)
+
+    def exact_query(self, query_vectors, k=10, chunk_size=100000):
+        """
+        Same as query, scoring all vectors in the index (in chunks of
+        chunk_size rows), e.g., to measure the recall of query.
+        """
+        query_vectors = normalize_rows(
+            numpy.atleast_2d(numpy.asarray(query_vectors, dtype=numpy.float32)))
+        num_queries = len(query_vectors)
+        best_scores = numpy.full((num_queries, k), -numpy.inf,
+                                 dtype=numpy.float32)
+        best_ids = numpy.full((num_queries, k), -1, dtype=numpy.int64)
+        for start in range(0, len(self), chunk_size):
+            chunk_scores = numpy.dot(
+                query_vectors, self.vectors[start:start + chunk_size].T)
+            chunk_ids = numpy.tile(
+                numpy.arange(start, start + chunk_scores.shape[1]),
+                (num_queries, 1))
+            best_scores, best_ids = _merge_top_k(
+                best_scores, best_ids, chunk_scores, chunk_ids, k)
+        return self._sort_results(best_scores, best_ids)
+
+    @staticmethod
+    def _sort_results(scores, ids):
+        order = numpy.argsort(-scores, axis=1, kind='mergesort')
+        rows = numpy.arange(len(scores))[:, None]
+        return scores[rows, order], ids[rows, order]
+
+    def get_events(self, ids):
+        """
+        Return the (pred, subj, obj, pobj) indices of the events at ids.
+        """
+        return numpy.asarray(self.events[ids])
@@ -0,0 +1,138 @@
+import argparse
+import httplib
+import json
+import threading
+import timeit
+
+import numpy
+
+from util import get_console_logger
+
+parser = argparse.ArgumentParser(
+    description='Load test a scoring server (see scoring_server.py) with '
+                'random queries from concurrent clients, and report the '
+                'queries per second and latencies')
+parser.add_argument('--host', default='localhost',
+                    help='host of the server (default: localhost)')
+parser.add_argument('--port', type=int, default=8765,
+                    help='port of the server (default: 8765)')
+parser.add_argument('--clients', type=int, default=8,
+                    help='number of concurrent clients (default: 8)')
+parser.add_argument('--duration', type=float, default=10.0,
+                    help='seconds to run the test for (default: 10)')
+parser.add_argument('--num_context', type=int, default=10,
+                    help='number of context events per query (default: 10)')
+parser.add_argument('--num_candidates', type=int, default=5,
+                    help='number of candidate events per query (default: 5)')
+parser.add_argument('--seed', type=int, default=0,
+                    help='random seed of the queries (default: 0)')
+
+args = parser.parse_args()
+
+log = get_console_logger('load_test_scoring_server')
+
+
+def get_json(connection, method, path, query=None):
+    body = json.dumps(query) if query is not None else None
+    connection.request(method, path, body=body,
+                       headers={'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    result = json.loads(response.read())
+    if response.status != 200:
+        raise RuntimeError('{} {} failed with {}: {}'.format(
+            method, path, response.status, result.get('error')))
+    return result
+
+
+connection = httplib.HTTPConnection(args.host, args.port)
+model_info = get_json(connection, 'GET', '/info')
+stats_before = get_json(connection, 'GET', '/stats')
+connection.close()
+log.info('Model info: vocab_size = {}, use_salience = {}'.format(
+    model_info['vocab_size'], model_info['use_salience']))
+
+
+def random_query(rng):
+    vocab_size = model_info['vocab_size']
+
+    def random_events(num_events):
+        events = rng.randint(0, vocab_size, size=(num_events, 4))
+        # empty arguments
+        events[:, 1:][rng.rand(num_events, 3) < 0.5] = -1
+        return events.tolist()
+
+    query = {
+        'context': random_events(args.num_context),
+        'candidates': random_events(args.num_candidates),
+        'arg_idx': rng.randint(1, 4, size=args.num_candidates).tolist()
+    }
+    if model_info['use_salience']:
+        query['salience'] = rng.randint(
+            0, 10, size=(args.num_candidates,
+                         len(model_info['salience_features']))).tolist()
+    return query
+
+
+def run_client(client_idx, end_time, latencies, errors):
+    rng = numpy.random.RandomState(args.seed + client_idx)
+    # keep the connection alive for all queries of the client
+    client_connection = httplib.HTTPConnection(args.host, args.port)
+    while timeit.default_timer() < end_time:
+        query = random_query(rng)
+        start_time = timeit.default_timer()
+        try:
+            get_json(client_connection, 'POST', '/score', query)
+        except Exception as error:
+            errors.append(str(error))
+            client_connection.close()
+            client_connection = httplib.HTTPConnection(args.host, args.port)
+            continue
+        latencies.append(timeit.default_timer() - start_time)
+    client_connection.close()
+
+
+log.info('Running {} clients for {} seconds, with {} x {} pairs per '
+         'query'.format(args.clients, args.duration, args.num_candidates,
+                        args.num_context))
+all_latencies = [[] for _ in range(args.clients)]
+all_errors = [[] for _ in range(args.clients)]
+test_start_time = timeit.default_timer()
+clients = [
+    threading.Thread(
+        target=run_client,
+        args=(client_idx, test_start_time + args.duration,
+              all_latencies[client_idx], all_errors[client_idx]))
+    for client_idx in range(args.clients)]
+for client in clients:
+    client.start()
+for client in clients:
+    client.join()
+elapsed = timeit.default_timer() - test_start_time
+
+latencies = numpy.asarray(sum(all_latencies, []))
+errors = sum(all_errors, [])
+if errors:
+    log.warning('{} queries failed, first error: {}'.format(
+        len(errors), errors[0]))
+if len(latencies) == 0:
+    raise RuntimeError('no query succeeded')
+
+num_pairs = len(latencies) * args.num_context * args.num_candidates
+log.info('{} queries in {:.2f} seconds: {:.1f} queries/sec, '
+         '{:.0f} pairs/sec'.format(len(latencies), elapsed,
+                                   len(latencies) / elapsed,
+                                   num_pairs / elapsed))
+log.info('Latency (ms): mean = {:.2f}, p50 = {:.2f}, p90 = {:.2f}, '
+         'p99 = {:.2f}, max = {:.2f}'.format(
+            *(1000 * numpy.asarray(
+                [latencies.mean()] +
+                list(numpy.percentile(latencies, [50, 90, 99])) +
+                [latencies.max()]))))
+
+connection = httplib.HTTPConnection(args.host, args.port)
+stats_after = get_json(connection, 'GET', '/stats')
+connection.close()
+num_requests = stats_after['num_requests'] - stats_before['num_requests']
+num_batches = stats_after['num_batches'] - stats_before['num_batches']
+log.info('Server scored them in {} batches, {:.1f} queries per batch'.format(
+    num_batches, float(num_requests) / max(num_batches, 1)))
@@ -0,0 +1,258 @@
+import pickle as pkl
+from os.path import exists, join
+
+import numpy
+
+from util import Word2VecModel, consts
+from util.model_archive import get_model_archive, read_model_archive
+from util.model_archive import unflatten_weights
+
+
+def _tanh_layers(layer_input, layer_weights):
+    # hidden layers of the autoencoders, (W, b, b_prime) as in
+    # DenoisingAutoencoder.get_weights()
+    for W, b, _ in layer_weights:
+        layer_input = numpy.tanh(numpy.dot(layer_input, W) + b)
+    return layer_input
+
+
+def _sigmoid(x):
+    # equivalent to 1 / (1 + exp(-x)), without overflowing exp
+    return 0.5 * (1. + numpy.tanh(0.5 * x))
+
+
+class NumpyEventVectorNetwork(object):
+    """
+    Forward pass of EventVectorNetwork in NumPy, from the weights returned
+    by EventVectorNetwork.get_weights(), computed in dtype (the dtype of the
+    weights by default). The word vectors can be stored with a lower
+    precision (e.g., float16, or memory-mapped from a model archive), only
+    the looked up rows are upcast to dtype.
+
+    """
+
+    def __init__(self, word_vectors, weights, dtype=None):
+        self.vectors = word_vectors
+        self.vector_size = word_vectors.shape[1]
+
+        num_layers = len(weights) - 3
+        if dtype is None:
+            dtype = numpy.asarray(weights[0][0]).dtype
+        self.dtype = numpy.dtype(dtype)
+        self.layer_weights = [
+            tuple(numpy.asarray(w, dtype=self.dtype) for w in layer_weights)
+            for layer_weights in weights[:num_layers]]
+        self.layer_sizes = [W.shape[1] for W, _, _ in self.layer_weights]
+        self.projection_size = self.layer_sizes[-1]
+        # empty argument vectors, as rows of shape (1, vector_size)
+        self.empty_vectors = [
+            numpy.asarray(w, dtype=self.dtype).reshape(1, self.vector_size)
+            for w in weights[num_layers:]]
+
+    def get_input_vector(self, pred_input, subj_input, obj_input, pobj_input):
+        """
+        Return the concatenated input vectors of a batch of events, with the
+        empty argument vectors for arguments of index -1.
+        """
+        pred_input = numpy.asarray(pred_input)
+        num_events = len(pred_input)
+        input_vector = numpy.empty(
+            (num_events, 4 * self.vector_size), dtype=self.dtype)
+        input_vector[:, :self.vector_size] = self.vectors[pred_input]
+        for arg_idx, (arg_input, empty_vector) in enumerate(
+                zip([subj_input, obj_input, pobj_input], self.empty_vectors)):
+            arg_input = numpy.asarray(arg_input)
+            start = (arg_idx + 1) * self.vector_size
+            arg_vectors = input_vector[:, start:start + self.vector_size]
+            arg_vectors[...] = self.vectors[arg_input]
+            arg_vectors[arg_input == -1] = empty_vector
+        return input_vector
+
+    def project(self, pred_input, subj_input, obj_input, pobj_input):
+        """
+        Same as EventVectorNetwork.project, return the projections of a
+        batch of events.
+        """
+        return _tanh_layers(
+            self.get_input_vector(
+                pred_input, subj_input, obj_input, pobj_input),
+            self.layer_weights)
+
+
+class NumpyPairCompositionNetwork(object):
+    """
+    Forward pass of PairCompositionNetwork in NumPy, from the weights
+    returned by PairCompositionNetwork.get_weights().
+    """
+
+    def __init__(self, event_vector_network, weights, use_salience=True,
+                 salience_features=None):
+        self.event_vector_network = event_vector_network
+        dtype = self.dtype = event_vector_network.dtype
+
+        num_layers = len(weights) - 2
+        self.layer_weights = [
+            tuple(numpy.asarray(w, dtype=dtype) for w in layer_weights)
+            for layer_weights in weights[:num_layers]]
+        self.layer_sizes = [W.shape[1] for W, _, _ in self.layer_weights]
+        self.prediction_weights = numpy.asarray(weights[-2], dtype=dtype)
+        self.prediction_bias = numpy.asarray(weights[-1], dtype=dtype)
+
+        self.use_salience = use_salience
+        self.salience_features = []
+        self.num_salience_features = 0
+        if self.use_salience:
+            assert salience_features is not None
+            self.salience_features = salience_features
+            self.num_salience_features = len(self.salience_features)
+
+    def coherence_fn(self, pred_input_a, subj_input_a, obj_input_a,
+                     pobj_input_a, pred_input_b, subj_input_b, obj_input_b,
+                     pobj_input_b, arg_idx_input, salience_input=None):
+        """
+        Same as PairCompositionNetwork.coherence_fn, return the coherence
+        scores of a batch of event pairs, as a column vector. Both events
+        of every pair are projected together in one batch.
+
+        """
+        if self.use_salience:
+            assert salience_input is not None, \
+                'salience_input is required when use_salience is True'
+
+        num_pairs = len(pred_input_a)
+        projection = self.event_vector_network.project(
+            *[numpy.concatenate([input_a, input_b]) for input_a, input_b in
+              zip([pred_input_a, subj_input_a, obj_input_a, pobj_input_a],
+                  [pred_input_b, subj_input_b, obj_input_b, pobj_input_b])])
+
+        input_vector = [
+            projection[:num_pairs], projection[num_pairs:],
+            numpy.asarray(arg_idx_input, dtype=self.dtype).reshape(-1, 1)]
+        if self.use_salience:
+            input_vector.append(numpy.asarray(salience_input, dtype=self.dtype))
+        input_vector = numpy.concatenate(input_vector, axis=1)
+
+        return _sigmoid(
+            numpy.dot(_tanh_layers(input_vector, self.layer_weights),
+                      self.prediction_weights) + self.prediction_bias)
+
+
+class NumpyEventCompositionModel(object):
+    """
+    Theano-free inference with a trained EventCompositionModel, which only
+    needs NumPy, so that it is loaded without compiling any graph, e.g., in
+    lightweight worker processes for evaluation or scoring. The networks
+    have the same project / coherence_fn interface as the Theano ones, with
+    the outputs matching them up to floating point rounding.
+
+    """
+
+    def __init__(self, word2vec, event_vector_network=None,
+                 pair_composition_network=None):
+        self.word2vec = word2vec
+        self.event_vector_network = event_vector_network
+        self.pair_composition_network = pair_composition_network
+
+    @classmethod
+    def from_weights(cls, word2vec, event_vector_weights,
+                     pair_composition_weights=None, use_salience=True,
+                     salience_features=None, dtype=None):
+        event_vector_network = NumpyEventVectorNetwork(
+            word2vec.get_vector_matrix(), event_vector_weights, dtype=dtype)
+        pair_composition_network = None
+        if pair_composition_weights is not None:
+            pair_composition_network = NumpyPairCompositionNetwork(
+                event_vector_network, pair_composition_weights,
+                use_salience=use_salience,
+                salience_features=salience_features)
+        return cls(word2vec, event_vector_network=event_vector_network,
+                   pair_composition_network=pair_composition_network)
+
+    @classmethod
+    def load_model(cls, directory, dtype=None, vector_dtype=None):
+        """
+        Load a model saved by EventCompositionModel.save_model(), or from
+        the model archive in the directory if it exists and is not older
+        than the other files of the model (see get_model_archive). The word
+        vectors are held in memory as vector_dtype, as in
+        EventCompositionModel.
+
+        """
+        model_archive = get_model_archive(directory)
+        if model_archive is not None:
+            return cls.load_archive(
+                model_archive, dtype=dtype, vector_dtype=vector_dtype)
+
+        if not exists(directory):
+            raise RuntimeError('{} does not exist, abort'.format(directory))
+
+        event_vector_weights_file = join(directory, 'ev_weights')
+        if not exists(event_vector_weights_file):
+            raise RuntimeError(
+                '{} does not contain event vector network weights, '
+                '{} expected'.format(directory, event_vector_weights_file))
+
+        word2vec = Word2VecModel.load_model(
+            join(directory, 'word2vec.bin'),
+            fvocab=join(directory, 'word2vec.vocab'), dtype=vector_dtype)
+
+        with open(event_vector_weights_file, 'r') as f:
+            event_vector_weights = pkl.load(f)
+
+        pair_composition_weights = None
+        pair_composition_weights_file = join(directory, 'pc_weights')
+        if exists(pair_composition_weights_file):
+            with open(pair_composition_weights_file, 'r') as f:
+                pair_composition_weights = pkl.load(f)
+
+        use_salience = exists(join(directory, 'use_salience'))
+        salience_features = None
+        if use_salience:
+            salience_features_file = join(directory, 'salience_features')
+            if exists(salience_features_file):
+                with open(salience_features_file, 'r') as f:
+                    salience_features = pkl.load(f)
+            else:
+                salience_features = consts.SALIENCE_FEATURES
+
+        return cls.from_weights(
+            word2vec, event_vector_weights,
+            pair_composition_weights=pair_composition_weights,
+            use_salience=use_salience, salience_features=salience_features,
+            dtype=dtype)
+
+    @classmethod
+    def load_archive(cls, path, mmap_mode='r', dtype=None, vector_dtype=None):
+        """
+        Load a model saved by EventCompositionModel.save_archive(). With
+        mmap_mode, the word vectors are memory-mapped from the archive
+        (unless vector_dtype is a different dtype), so only the rows looked
+        up are ever read.
+
+        """
+        if not exists(path):
+            raise RuntimeError('{} does not exist, abort'.format(path))
+
+        header, arrays = read_model_archive(path, mmap_mode=mmap_mode)
+        if 'ev_weights' not in header:
+            raise RuntimeError(
+                '{} does not contain event vector network weights'.format(
+                    path))
+
+        word_vectors = arrays['word_vectors']
+        if vector_dtype is not None and word_vectors.dtype != vector_dtype:
+            word_vectors = numpy.asarray(word_vectors, dtype=vector_dtype)
+        word2vec = Word2VecModel.from_vectors(
+            header['word2vec_name'], header['words'], word_vectors,
+            counts=header['counts'])
+
+        pair_composition_weights = None
+        if 'pc_weights' in header:
+            pair_composition_weights = \
+                unflatten_weights(header['pc_weights'], arrays)
+
+        return cls.from_weights(
+            word2vec, unflatten_weights(header['ev_weights'], arrays),
+            pair_composition_weights=pair_composition_weights,
+            use_salience=header.get('use_salience', False),
+            salience_features=header.get('salience_features'), dtype=dtype)
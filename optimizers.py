@@ -0,0 +1,170 @@
+import abc
+
+import numpy
+import theano
+import theano.tensor as T
+
+
+class Optimizer(object):
+    """
+    Update rule applied to a list of parameters given their gradients.
+
+    The learning rate is passed in as a (symbolic) variable to get_updates(),
+    so that trainers can keep changing it between minibatches. Any state of
+    the update rule (e.g., moving averages of gradients) is kept in shared
+    variables, which can be read with get_state() and restored with
+    set_state() after get_updates() has been called on the same parameters.
+
+    """
+    __metaclass__ = abc.ABCMeta
+
+    name = None
+    # whether get_sparse_updates() is implemented, i.e., whether a parameter
+    # can be updated on the subset of rows referenced in a minibatch
+    supports_sparse_updates = False
+
+    def __init__(self):
+        self.state_vars = []
+
+    def get_updates(self, params, grads, learning_rate):
+        updates = []
+        for param, grad in zip(params, grads):
+            updates.extend(self.get_param_updates(param, grad, learning_rate))
+        return updates
+
+    @abc.abstractmethod
+    def get_param_updates(self, param, grad, learning_rate):
+        return
+
+    def get_sparse_updates(self, param, indices, grad_rows, learning_rate):
+        raise NotImplementedError(
+            '{} optimizer does not support sparse updates'.format(self.name))
+
+    def add_state_var(self, param, suffix):
+        state_var = theano.shared(
+            numpy.zeros_like(param.get_value()),
+            name='{}_{}'.format(param.name, suffix),
+            broadcastable=param.broadcastable
+        )
+        self.state_vars.append(state_var)
+        return state_var
+
+    def get_state(self):
+        return [state_var.get_value() for state_var in self.state_vars]
+
+    def set_state(self, state):
+        assert len(state) == len(self.state_vars), \
+            'expecting {} state arrays for {} optimizer, found {}'.format(
+                len(self.state_vars), self.name, len(state))
+        for state_var, value in zip(self.state_vars, state):
+            state_var.set_value(value)
+
+
+class SGD(Optimizer):
+    name = 'sgd'
+    supports_sparse_updates = True
+
+    def get_param_updates(self, param, grad, learning_rate):
+        return [(param, param - learning_rate * grad)]
+
+    def get_sparse_updates(self, param, indices, grad_rows, learning_rate):
+        # gradients of duplicate indices are accumulated by inc_subtensor
+        return [(param, T.inc_subtensor(
+            param[indices], -learning_rate * grad_rows))]
+
+
+class Momentum(Optimizer):
+    name = 'momentum'
+
+    def __init__(self, momentum=0.9):
+        super(Momentum, self).__init__()
+        self.momentum = momentum
+
+    def get_param_updates(self, param, grad, learning_rate):
+        velocity = self.add_state_var(param, 'velocity')
+        new_velocity = self.momentum * velocity - learning_rate * grad
+        return [(velocity, new_velocity), (param, param + new_velocity)]
+
+
+class Adagrad(Optimizer):
+    name = 'adagrad'
+    supports_sparse_updates = True
+
+    def __init__(self, epsilon=1e-6):
+        super(Adagrad, self).__init__()
+        self.epsilon = epsilon
+
+    def get_param_updates(self, param, grad, learning_rate):
+        accu = self.add_state_var(param, 'accu')
+        new_accu = accu + grad ** 2
+        return [(accu, new_accu),
+                (param, param - learning_rate * grad /
+                 T.sqrt(new_accu + self.epsilon))]
+
+    def get_sparse_updates(self, param, indices, grad_rows, learning_rate):
+        # only the accumulators of referenced rows are updated, a row that
+        # occurs more than once in indices is scaled by its accumulator after
+        # adding the squared gradients of all its occurrences
+        accu = self.add_state_var(param, 'accu')
+        new_accu = T.inc_subtensor(accu[indices], grad_rows ** 2)
+        return [(accu, new_accu),
+                (param, T.inc_subtensor(
+                    param[indices], -learning_rate * grad_rows /
+                    T.sqrt(new_accu[indices] + self.epsilon)))]
+
+
+class Adam(Optimizer):
+    name = 'adam'
+
+    def __init__(self, beta1=0.9, beta2=0.999, epsilon=1e-8):
+        super(Adam, self).__init__()
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+        # one time step shared by all parameters (and all graphs built with
+        # get_updates), saved and restored with the rest of the state
+        self.time_step = theano.shared(
+            numpy.asarray(0., dtype=theano.config.floatX), name='adam_t')
+        self.state_vars.append(self.time_step)
+
+    def get_updates(self, params, grads, learning_rate):
+        new_time_step = self.time_step + 1.
+        # bias-corrected learning rate
+        self.corrected_learning_rate = \
+            learning_rate * T.sqrt(1. - self.beta2 ** new_time_step) / \
+            (1. - self.beta1 ** new_time_step)
+        updates = [(self.time_step, new_time_step)]
+        updates.extend(super(Adam, self).get_updates(
+            params, grads, learning_rate))
+        return updates
+
+    def get_param_updates(self, param, grad, learning_rate):
+        first_moment = self.add_state_var(param, 'm')
+        second_moment = self.add_state_var(param, 'v')
+        new_first_moment = \
+            self.beta1 * first_moment + (1. - self.beta1) * grad
+        new_second_moment = \
+            self.beta2 * second_moment + (1. - self.beta2) * grad ** 2
+        step = self.corrected_learning_rate * new_first_moment / \
+            (T.sqrt(new_second_moment) + self.epsilon)
+        return [(first_moment, new_first_moment),
+                (second_moment, new_second_moment),
+                (param, param - step)]
+
+
+OPTIMIZERS = {
+    SGD.name: SGD,
+    Momentum.name: Momentum,
+    Adagrad.name: Adagrad,
+    Adam.name: Adam,
+}
+
+
+def get_optimizer(optimizer, **kwargs):
+    if isinstance(optimizer, Optimizer):
+        return optimizer
+    if optimizer not in OPTIMIZERS:
+        raise ValueError(
+            'unknown optimizer "{}". Expected one of: {}'.format(
+                optimizer, ', '.join(sorted(OPTIMIZERS))))
+    return OPTIMIZERS[optimizer](**kwargs)
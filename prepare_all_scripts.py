@@ -1,27 +1,51 @@
-import sys
+import argparse
 from bz2 import BZ2File
 from os import listdir
 from os.path import isfile, join
 
 from corenlp import read_doc_from_corenlp
 from rich_script import Script, ScriptCorpus
+from util import StageProfiler
 
-input_path = sys.argv[1]
-output_path = sys.argv[2]
+parser = argparse.ArgumentParser()
+parser.add_argument('input_path', help='directory for CoreNLP parsed files')
+parser.add_argument('output_path', help='path to write ScriptCorpus file')
+parser.add_argument('--profile',
+                    help='path to write a JSON report of the time spent in '
+                         'each stage of the pipeline')
+parser.add_argument('--profile_dir',
+                    help='directory to write cProfile stats of each stage, '
+                         'only used with --profile')
+
+args = parser.parse_args()
+
+input_path = args.input_path
+output_path = args.output_path
 
 fout = BZ2File(output_path, 'w')
 
 input_files = sorted([join(input_path, f) for f in listdir(input_path)
                       if isfile(join(input_path, f)) and f.endswith('xml.bz2')])
 
+profiler = StageProfiler(
+    enabled=args.profile is not None, profile_dir=args.profile_dir)
+
 script_corpus = ScriptCorpus()
 
 for input_f in input_files:
     with BZ2File(input_f, 'r') as fin:
-        doc = read_doc_from_corenlp(fin)
-        script = Script.from_doc(doc)
+        profiler.count('docs')
+        with profiler.stage('read_doc_from_corenlp'):
+            doc = read_doc_from_corenlp(fin)
+        with profiler.stage('script_from_doc'):
+            script = Script.from_doc(doc)
         if script.has_events():
             script_corpus.add_script(script)
+            profiler.count('events', len(script.events))
 
-fout.write(script_corpus.to_text())
+with profiler.stage('script_corpus_to_text'):
+    fout.write(script_corpus.to_text())
 fout.close()
+
+if args.profile:
+    profiler.write_report(args.profile)
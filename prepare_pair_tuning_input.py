@@ -3,8 +3,9 @@ from bz2 import BZ2File
 from os import listdir
 from os.path import isfile, join, dirname, realpath
 
-from rich_script import RichScript, ScriptCorpus
-from util import Word2VecModel, consts, read_counter, read_vocab_list
+from rich_script import PredicateSubsampler, RichScript, ScriptCorpus
+from util import StageProfiler, Word2VecModel, consts, read_counter
+from util import read_vocab_list
 
 parser = argparse.ArgumentParser()
 parser.add_argument('input_path', help='directory for ScriptCorpus files')
@@ -23,6 +24,12 @@ parser.add_argument('--neg_sample_type', default='neg',
                          'one (one negative event and one left event), '
                          'neg (one left event for every negative event), '
                          'all (every left event for every negative event)')
+parser.add_argument('--profile',
+                    help='path to write a JSON report of the time spent in '
+                         'each stage of the pipeline')
+parser.add_argument('--profile_dir',
+                    help='directory to write cProfile stats of each stage, '
+                         'only used with --profile')
 
 args = parser.parse_args()
 
@@ -43,26 +50,43 @@ else:
     prep_vocab_list = read_vocab_list(
         join(cur_dir_path, consts.PREP_VOCAB_LIST_FILE))
 
-pred_count_dict = None
+pred_subsampler = None
 if args.subsampling:
     with open(join(cur_dir_path, consts.PRED_VOCAB_COUNT_FILE)) as fin:
         pred_count_dict = read_counter(fin)
+    # precompute keep probabilities aligned with word2vec indices once
+    pred_subsampler = PredicateSubsampler.build(
+        pred_count_dict, model, include_type=True)
+
+profiler = StageProfiler(
+    enabled=args.profile is not None, profile_dir=args.profile_dir)
 
 for input_f in input_files:
     with BZ2File(input_f, 'r') as fin:
-        script_corpus = ScriptCorpus.from_text(fin.read())
+        with profiler.stage('script_corpus_from_text'):
+            script_corpus = ScriptCorpus.from_text(fin.read())
         for script in script_corpus.scripts:
-            rich_script = RichScript.build(
-                script,
-                prep_vocab_list=prep_vocab_list,
-                use_lemma=args.use_lemma,
-                filter_stop_events=False
-            )
-            rich_script.get_index(model, include_type=True, use_unk=True,
-                                  pred_count_dict=pred_count_dict)
-            pair_tuning_inputs = rich_script.get_pair_tuning_input_list(
-                neg_sample_type=args.neg_sample_type)
+            profiler.count('docs')
+            with profiler.stage('rich_script_build'):
+                rich_script = RichScript.build(
+                    script,
+                    prep_vocab_list=prep_vocab_list,
+                    use_lemma=args.use_lemma,
+                    filter_stop_events=False
+                )
+            with profiler.stage('get_index'):
+                rich_script.get_index(
+                    model, include_type=True, use_unk=True,
+                    pred_subsampler=pred_subsampler)
+            with profiler.stage('pair_generation'):
+                pair_tuning_inputs = rich_script.get_pair_tuning_input_list(
+                    neg_sample_type=args.neg_sample_type)
+            profiler.count('pairs', len(pair_tuning_inputs))
             if len(pair_tuning_inputs) > 0:
-                fout.write('\n'.join(map(str, pair_tuning_inputs)) + '\n')
+                with profiler.stage('write_output'):
+                    fout.write('\n'.join(map(str, pair_tuning_inputs)) + '\n')
 
 fout.close()
+
+if args.profile:
+    profiler.write_report(args.profile)
@@ -1,10 +1,12 @@
 import argparse
+import timeit
 from bz2 import BZ2File
+from multiprocessing import Pool, cpu_count
 from os import listdir
 from os.path import isfile, join, dirname, realpath
 
 from rich_script import RichScript, ScriptCorpus
-from util import consts, read_vocab_list
+from util import StageProfiler, consts, get_console_logger, read_vocab_list
 
 parser = argparse.ArgumentParser()
 parser.add_argument('input_path', help='directory to read ScriptCorpus files')
@@ -13,10 +15,28 @@ parser.add_argument('--pred_vocab', help='path to predicate vocab file')
 parser.add_argument('--arg_vocab', help='path to argument vocab file')
 parser.add_argument('--ner_vocab', help='path to name entity vocab file')
 parser.add_argument('--prep_vocab', help='path to preposition vocab file')
+parser.add_argument('--workers', type=int, default=cpu_count(),
+                    help='number of worker processes, each processing one '
+                         'ScriptCorpus file at a time (default: number of '
+                         'cpu cores), sequences are always written in the '
+                         'order of the input files')
+parser.add_argument('--log_every', type=int, default=10000,
+                    help='log throughput stats after every N scripts '
+                         '(default: 10000)')
+parser.add_argument('--profile',
+                    help='path to write a JSON report of the time spent in '
+                         'each stage of the pipeline (summed over workers)')
+parser.add_argument('--profile_dir',
+                    help='directory to write cProfile stats of each stage, '
+                         'only used with --profile and --workers 1')
 
 args = parser.parse_args()
 
-fout = BZ2File(args.output_path, 'w')
+assert args.workers > 0, '--workers must be a positive integer'
+if args.profile and args.profile_dir and args.workers > 1:
+    parser.error('--profile_dir can only be used with --workers 1')
+
+log = get_console_logger('prepare_word2vec_training_sequence')
 
 input_files = sorted([join(args.input_path, f) for f in listdir(args.input_path)
                       if isfile(join(args.input_path, f))
@@ -24,6 +44,8 @@ input_files = sorted([join(args.input_path, f) for f in listdir(args.input_path)
 
 cur_dir_path = dirname(realpath(__file__))
 
+# vocab lists are loaded once here, before the worker pool is created, so that
+# the worker processes share them with the parent process through fork
 if args.pred_vocab:
     pred_vocab_list = read_vocab_list(args.pred_vocab)
 else:
@@ -45,25 +67,93 @@ else:
     prep_vocab_list = read_vocab_list(
         join(cur_dir_path, consts.PREP_VOCAB_LIST_FILE))
 
-for input_f in input_files:
+
+profiler = StageProfiler(
+    enabled=args.profile is not None, profile_dir=args.profile_dir)
+
+
+def process_shard(input_f, shard_profiler=None):
+    # in a worker process, the stages are profiled with a new profiler,
+    # whose stats are returned to be added to the profiler of the parent
+    worker_profiler = None
+    if shard_profiler is None:
+        shard_profiler = worker_profiler = \
+            StageProfiler(enabled=args.profile is not None)
+    lines = []
+    num_scripts = 0
     with BZ2File(input_f, 'r') as fin:
-        script_corpus = ScriptCorpus.from_text(fin.read())
+        with shard_profiler.stage('script_corpus_from_text'):
+            script_corpus = ScriptCorpus.from_text(fin.read())
         for script in script_corpus.scripts:
-            print 'Reading script {}'.format(script.doc_name)
-            rich_script = RichScript.build(
-                script,
-                prep_vocab_list=prep_vocab_list,
-                use_lemma=True,
-                filter_stop_events=False
-            )
-            sequence = rich_script.get_word2vec_training_seq(
-                pred_vocab_list=pred_vocab_list,
-                arg_vocab_list=arg_vocab_list,
-                ner_vocab_list=ner_vocab_list,
-                include_type=True,
-                include_all_pobj=True
-            )
+            num_scripts += 1
+            shard_profiler.count('docs')
+            with shard_profiler.stage('rich_script_build'):
+                rich_script = RichScript.build(
+                    script,
+                    prep_vocab_list=prep_vocab_list,
+                    use_lemma=True,
+                    filter_stop_events=False
+                )
+            with shard_profiler.stage('sequence_generation'):
+                sequence = rich_script.get_word2vec_training_seq(
+                    pred_vocab_list=pred_vocab_list,
+                    arg_vocab_list=arg_vocab_list,
+                    ner_vocab_list=ner_vocab_list,
+                    include_type=True,
+                    include_all_pobj=True
+                )
             if sequence:
-                fout.write(' '.join(sequence) + '\n')
+                shard_profiler.count('sequences')
+                shard_profiler.count('tokens', len(sequence))
+                lines.append(' '.join(sequence) + '\n')
+    worker_stats = None
+    if worker_profiler is not None:
+        worker_stats = worker_profiler.get_stats()
+    return num_scripts, ''.join(lines), worker_stats
+
+
+if args.workers > 1:
+    pool = Pool(args.workers)
+    # imap returns the results in the order of input_files
+    results = pool.imap(process_shard, input_files)
+else:
+    pool = None
+    results = (process_shard(input_f, shard_profiler=profiler)
+               for input_f in input_files)
+
+log.info('Processing {} files with {} worker(s)'.format(
+    len(input_files), args.workers))
+
+fout = BZ2File(args.output_path, 'w')
+
+start_time = timeit.default_timer()
+total_scripts = 0
+last_logged = 0
+
+for shard_idx, (num_scripts, text, worker_stats) in enumerate(results):
+    if worker_stats is not None:
+        profiler.add_stats(worker_stats)
+    with profiler.stage('write_output'):
+        fout.write(text)
+    total_scripts += num_scripts
+    if total_scripts - last_logged >= args.log_every:
+        last_logged = total_scripts
+        elapsed = timeit.default_timer() - start_time
+        log.info(
+            'Processed {}/{} files, {} scripts in {:.1f} seconds '
+            '({:.1f} scripts/sec)'.format(
+                shard_idx + 1, len(input_files), total_scripts, elapsed,
+                total_scripts / elapsed))
 
 fout.close()
+
+if pool is not None:
+    pool.close()
+    pool.join()
+
+elapsed = timeit.default_timer() - start_time
+log.info('Done: {} files, {} scripts in {:.1f} seconds'.format(
+    len(input_files), total_scripts, elapsed))
+
+if args.profile:
+    profiler.write_report(args.profile)
@@ -0,0 +1,56 @@
+import argparse
+
+from evaluate import EvalLog, EvalStats
+from evaluate.base_evaluator import BaseEvaluator
+
+parser = argparse.ArgumentParser(
+    description='Print the accuracy tables of an evaluation log saved by '
+                'BaseEvaluator.evaluate (with eval_log_file), optionally '
+                'restricted to some of the decisions, with bootstrap '
+                'confidence intervals, or compared with the log of another '
+                'model, without rerunning the evaluation')
+parser.add_argument('eval_log_file', help='path to the evaluation log')
+parser.add_argument('--select', action='append', default=[],
+                    metavar='COLUMN=VALUE[,VALUE...]',
+                    help='only include decisions where the column has one '
+                         'of the values (columns: {}), can be used multiple '
+                         'times'.format(', '.join(EvalLog.CATEGORY_COLUMNS)))
+parser.add_argument('--bootstrap', type=int, default=0, metavar='NUM_SAMPLES',
+                    help='print bootstrap confidence intervals of the '
+                         'accuracies from NUM_SAMPLES resamples')
+parser.add_argument('--compare', metavar='OTHER_EVAL_LOG_FILE',
+                    help='compare with the evaluation log of another model '
+                         'on the same decisions by a paired bootstrap (with '
+                         '--bootstrap resamples, 1000 by default)')
+parser.add_argument('--confidence', type=float, default=0.95,
+                    help='confidence level of the intervals (default: 0.95)')
+parser.add_argument('--seed', type=int, default=0,
+                    help='random seed of the resamples (default: 0)')
+
+args = parser.parse_args()
+
+eval_log = EvalLog.load(args.eval_log_file)
+
+conditions = {}
+for condition in args.select:
+    column, sep, values = condition.partition('=')
+    if not sep or column not in EvalLog.CATEGORY_COLUMNS:
+        parser.error('invalid --select {}'.format(condition))
+    conditions[column] = values.split(',')
+mask = eval_log.get_mask(**conditions) if conditions else None
+
+eval_stats = EvalStats.from_eval_log(
+    eval_log, BaseEvaluator.get_default_accuracy_groups())
+if args.compare:
+    other_eval_stats = EvalStats.from_eval_log(
+        EvalLog.load(args.compare),
+        BaseEvaluator.get_default_accuracy_groups())
+    eval_stats.print_paired_bootstrap_table(
+        other_eval_stats, mask=mask, num_samples=args.bootstrap or 1000,
+        confidence=args.confidence, seed=args.seed)
+elif args.bootstrap:
+    eval_stats.print_bootstrap_table(
+        mask=mask, num_samples=args.bootstrap, confidence=args.confidence,
+        seed=args.seed)
+else:
+    eval_stats.print_table(mask=mask)
@@ -0,0 +1,87 @@
+import argparse
+import sys
+
+import numpy
+
+from event_index import EventIndex
+from numpy_event_comp_model import NumpyEventCompositionModel
+from rich_script.indexed_event import IndexedEvent
+from util import get_console_logger
+
+parser = argparse.ArgumentParser(
+    description='Find the events closest to some query events in an index '
+                'built by build_event_index.py, with the same model')
+parser.add_argument('index_dir', help='directory of the event index')
+parser.add_argument('model_path',
+                    help='directory of a saved EventCompositionModel, or a '
+                         'model archive')
+parser.add_argument('query_file', nargs='?',
+                    help='file of query events, one per line as '
+                         'pred,subj,obj,pobj indices (default: stdin)')
+parser.add_argument('-k', type=int, default=10,
+                    help='number of neighbors of each query (default: 10)')
+parser.add_argument('--num_probes', type=int, default=8,
+                    help='number of lists scored for each query '
+                         '(default: 8)')
+parser.add_argument('--exact', action='store_true',
+                    help='score all events instead of the probed lists')
+parser.add_argument('--recall', action='store_true',
+                    help='also report the recall of the approximate search '
+                         'against the exact one')
+parser.add_argument('--indices', action='store_true',
+                    help='print neighbors as indices instead of words')
+
+args = parser.parse_args()
+
+log = get_console_logger('query_event_index')
+
+if args.model_path.endswith('.archive'):
+    model = NumpyEventCompositionModel.load_archive(args.model_path)
+else:
+    model = NumpyEventCompositionModel.load_model(args.model_path)
+event_index = EventIndex.load(args.index_dir)
+id2word = model.word2vec.get_id2word()
+
+query_file = open(args.query_file, 'r') if args.query_file else sys.stdin
+query_events = numpy.asarray(
+    [[e.pred_input, e.subj_input, e.obj_input, e.pobj_input]
+     for e in (IndexedEvent.from_text(line)
+               for line in query_file if line.strip())],
+    dtype=numpy.int32).reshape(-1, 4)
+if args.query_file:
+    query_file.close()
+
+query_vectors = model.event_vector_network.project(
+    query_events[:, 0], query_events[:, 1], query_events[:, 2],
+    query_events[:, 3])
+
+if args.exact:
+    scores, ids = event_index.exact_query(query_vectors, k=args.k)
+else:
+    scores, ids = event_index.query(
+        query_vectors, k=args.k, num_probes=args.num_probes)
+
+
+def event_to_str(event):
+    if args.indices:
+        return ','.join(str(idx) for idx in event)
+    return ' '.join(id2word[idx] if idx != -1 else '_' for idx in event)
+
+
+for query_idx, query_event in enumerate(query_events):
+    print '{}'.format(event_to_str(query_event))
+    for score, event_id in zip(scores[query_idx], ids[query_idx]):
+        if event_id == -1:
+            break
+        print '\t{:.4f}\t{}\t(count = {})'.format(
+            score, event_to_str(event_index.events[event_id]),
+            event_index.counts[event_id])
+
+if args.recall and not args.exact:
+    _, exact_ids = event_index.exact_query(query_vectors, k=args.k)
+    recall = numpy.mean([
+        len(set(approx[approx != -1]) & set(exact[exact != -1])) /
+        float(max((exact != -1).sum(), 1))
+        for approx, exact in zip(ids, exact_ids)])
+    log.info('Recall@{} with {} probes: {:.4f}'.format(
+        args.k, args.num_probes, recall))
@@ -1,6 +1,8 @@
 from event import Event
+from indexed_corpus import CachedBatchIterator, LayerInputCacheIterator
 from indexed_corpus import PretrainingCorpusIterator, PairTuningCorpusIterator
 from indexed_event import IndexedEvent, IndexedEventMultiPobj
+from pred_subsampler import PredicateSubsampler
 from rich_argument import RichArgument
 from rich_event import RichEvent
 from rich_script import RichScript
@@ -27,20 +27,124 @@ class IndexedCorpusReader(object):
         self.filenames = sorted(
             [join(corpus_dir, f) for f in listdir(corpus_dir)
              if isfile(join(corpus_dir, f)) and not f.endswith('line_count')])
+        # files to read, which are only those of the shard after set_shard()
+        self.shard_filenames = self.filenames
+        # range (start, end) of the items of the shard, if the corpus has
+        # fewer files than shards, see set_shard()
+        self.shard_item_range = None
+        self.shard_length = self.length
+        # number of items in every file read so far, so that the length of a
+        # shard of files is only counted when needed, from the files not
+        # read yet, see __len__()
+        self.file_item_counts = {}
+        # position (file index, line index) of the next line to read
+        self.position = (0, 0)
+        # position to start the next iteration from, see seek()
+        self.start_position = (0, 0)
 
     def __len__(self):
-        return self.length
+        if self.shard_length is None:
+            self.shard_length = sum(
+                self.get_file_item_count(filename)
+                for filename in self.shard_filenames)
+        return self.shard_length
+
+    def get_file_item_count(self, filename):
+        if filename not in self.file_item_counts:
+            self.file_item_counts[filename] = \
+                self.count_items(self.read_lines(filename))
+        return self.file_item_counts[filename]
+
+    @staticmethod
+    def read_lines(filename):
+        if filename.endswith('bz2'):
+            index_file = BZ2File(filename, 'r')
+        else:
+            index_file = open(filename, 'r')
+        lines = index_file.readlines()
+        index_file.close()
+        return lines
+
+    @staticmethod
+    def count_items(lines):
+        return sum(1 for line in lines if line.strip())
+
+    def set_shard(self, num_shards, shard_idx):
+        """
+        Only iterate over one of num_shards disjoint shards of the corpus.
+        A shard is every num_shards-th file, starting from shard_idx, so that
+        it only reads its own files, unless the corpus has fewer files than
+        shards, in which case the shards are contiguous ranges of items of
+        equal size. The positions of tell() and seek() are relative to the
+        files of the shard. The length of a shard of files is only counted
+        when len() is called.
+
+        """
+        assert 0 <= shard_idx < num_shards, \
+            'shard_idx must be in [0, {})'.format(num_shards)
+        if len(self.filenames) >= num_shards:
+            self.shard_filenames = self.filenames[shard_idx::num_shards]
+            self.shard_item_range = None
+            self.shard_length = None
+        else:
+            self.shard_filenames = self.filenames
+            self.shard_item_range = (
+                self.length * shard_idx // num_shards,
+                self.length * (shard_idx + 1) // num_shards)
+            self.shard_length = \
+                self.shard_item_range[1] - self.shard_item_range[0]
+        self.position = (0, 0)
+        self.start_position = (0, 0)
+
+    def tell(self):
+        """
+        Return the position right after the last item yielded, as a tuple of
+        (file index, line index). Line offsets are used instead of byte
+        offsets, as bz2 files cannot be seeked without decompressing them.
+
+        """
+        return self.position
+
+    def seek(self, position):
+        """
+        Start the next iteration from a position returned by tell(), or from
+        the beginning if position is None. Later iterations start from the
+        beginning of the corpus again.
+
+        """
+        if position is None:
+            position = (0, 0)
+        self.start_position = tuple(position)
 
     def __iter__(self):
-        for filename in self.filenames:
-            if filename.endswith('bz2'):
-                index_file = BZ2File(filename, 'r')
-            else:
-                index_file = open(filename, 'r')
-            for line in index_file.readlines():
-                line = line.strip()
+        start_file_idx, start_line_idx = self.start_position
+        self.start_position = (0, 0)
+        # index of the next item in the corpus, only needed for a shard of a
+        # range of items
+        item_idx = 0
+        if self.shard_item_range is not None:
+            item_idx = sum(
+                self.get_file_item_count(filename)
+                for filename in self.shard_filenames[:start_file_idx])
+        for file_idx in range(start_file_idx, len(self.shard_filenames)):
+            filename = self.shard_filenames[file_idx]
+            lines = self.read_lines(filename)
+            self.file_item_counts[filename] = self.count_items(lines)
+            if file_idx > start_file_idx:
+                start_line_idx = 0
+            elif self.shard_item_range is not None:
+                item_idx += self.count_items(lines[:start_line_idx])
+            for line_idx in range(start_line_idx, len(lines)):
+                if self.shard_item_range is not None \
+                        and item_idx >= self.shard_item_range[1]:
+                    return
+                self.position = (file_idx, line_idx + 1)
+                line = lines[line_idx].strip()
                 if line:
-                    yield self.from_text_fn(line)
+                    if self.shard_item_range is None \
+                            or item_idx >= self.shard_item_range[0]:
+                        yield self.from_text_fn(line)
+                    item_idx += 1
 
 
 class PretrainingCorpusIterator(object):
@@ -50,7 +154,6 @@ class PretrainingCorpusIterator(object):
         self.model = model
         self.layer_input = layer_input
         self.batch_size = batch_size
-        self.num_batch = int(ceil(float(len(self.reader)) / batch_size))
         if layer_input == -1:
             # Compile the expression for the deepest hidden layer
             self.projection_fn = model.project
@@ -64,6 +167,19 @@ class PretrainingCorpusIterator(object):
     def __len__(self):
         return len(self.reader)
 
+    def tell(self):
+        return self.reader.tell()
+
+    def seek(self, position):
+        self.reader.seek(position)
+
+    @property
+    def num_batch(self):
+        return int(ceil(float(len(self.reader)) / self.batch_size))
+
+    def set_shard(self, num_shards, shard_idx):
+        self.reader.set_shard(num_shards, shard_idx)
+
     def __iter__(self):
         pred_inputs = numpy.zeros(self.batch_size, dtype=numpy.int32)
         subj_inputs = numpy.zeros(self.batch_size, dtype=numpy.int32)
@@ -86,9 +202,78 @@ class PretrainingCorpusIterator(object):
                 data_point_index = 0
 
         if data_point_index > 0:
-            # We've partially filled a batch: yield this as the last item
+            # We've partially filled a batch: yield this as the last item,
+            # without the stale rows left from the previous batch
             yield self.projection_fn(
-                pred_inputs, subj_inputs, obj_inputs, pobj_inputs)
+                pred_inputs[:data_point_index],
+                subj_inputs[:data_point_index],
+                obj_inputs[:data_point_index],
+                pobj_inputs[:data_point_index])
+
+
+class LayerInputCacheIterator(object):
+    """
+    Iterate over the inputs to one layer of the event vector network, which
+    are materialized once into a memory-mapped file (see build()), so that
+    pre-training a layer does not need to re-run all layers below it.
+
+    """
+
+    def __init__(self, cache_file, num_rows, input_size, batch_size=1,
+                 dtype='float32', output_dtype='float32'):
+        self.cache_file = cache_file
+        self.num_rows = num_rows
+        self.input_size = input_size
+        self.batch_size = batch_size
+        self.num_batch = int(ceil(float(num_rows) / batch_size))
+        self.dtype = dtype
+        self.output_dtype = output_dtype
+        self.data = numpy.memmap(
+            cache_file, dtype=dtype, mode='r', shape=(num_rows, input_size))
+        # index of the row after the last batch yielded
+        self.position = 0
+        # row to start the next iteration from, see seek()
+        self.start_position = 0
+
+    @classmethod
+    def build(cls, cache_file, batch_iterator, num_rows, input_size,
+              batch_size=1, dtype='float32', output_dtype='float32',
+              transform_fn=None):
+        data = numpy.memmap(
+            cache_file, dtype=dtype, mode='w+', shape=(num_rows, input_size))
+        row_idx = 0
+        for batch in batch_iterator:
+            if transform_fn is not None:
+                batch = transform_fn(batch)
+            data[row_idx:row_idx + len(batch)] = batch
+            row_idx += len(batch)
+        assert row_idx == num_rows, \
+            'expecting {} rows from batch_iterator, found {}'.format(
+                num_rows, row_idx)
+        data.flush()
+        del data
+        return cls(cache_file, num_rows, input_size, batch_size=batch_size,
+                   dtype=dtype, output_dtype=output_dtype)
+
+    def __len__(self):
+        return self.num_rows
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position):
+        self.start_position = position if position is not None else 0
+
+    def __iter__(self):
+        start_position = self.start_position
+        self.start_position = 0
+        for start in range(start_position, self.num_rows, self.batch_size):
+            self.position = min(start + self.batch_size, self.num_rows)
+            # copy (and upcast) each batch from the memory-mapped file,
+            # as the trainer shuffles the rows of the batch in place
+            yield numpy.array(
+                self.data[start:start + self.batch_size],
+                dtype=self.output_dtype)
 
 
 class PairTuningCorpusIterator(object):
@@ -97,7 +282,6 @@ class PairTuningCorpusIterator(object):
         self.corpus_dir = corpus_dir
         self.reader = IndexedCorpusReader('pair_tuning', self.corpus_dir)
         self.batch_size = batch_size
-        self.num_batch = int(ceil(float(len(self.reader)) / batch_size))
         self.use_salience = use_salience
 
         self.num_salience_features = 0
@@ -113,6 +297,19 @@ class PairTuningCorpusIterator(object):
     def __len__(self):
         return len(self.reader)
 
+    def tell(self):
+        return self.reader.tell()
+
+    def seek(self, position):
+        self.reader.seek(position)
+
+    @property
+    def num_batch(self):
+        return int(ceil(float(len(self.reader)) / self.batch_size))
+
+    def set_shard(self, num_shards, shard_idx):
+        self.reader.set_shard(num_shards, shard_idx)
+
     def __iter__(self):
         left_pred_input = numpy.zeros(self.batch_size, dtype=numpy.int32)
         left_subj_input = numpy.zeros(self.batch_size, dtype=numpy.int32)
@@ -199,11 +396,10 @@ class PairTuningCorpusIterator(object):
                           neg_arg_idx_input
                 data_point_index = 0
 
-        # FIXME: Should return this last partial batch,
-        # but having a smaller batch is currently messing up training
-        # If you update this, allow for the triple option as well
-        if False and data_point_index > 0:
-            # We've partially filled a batch: yield this as the last item
+        if data_point_index > 0:
+            # We've partially filled a batch: yield this as the last item.
+            # The trainers scale its updates by its size relative to
+            # batch_size, so that all examples get the same weight
             if self.use_salience:
                 yield left_pred_input[:data_point_index], \
                       left_subj_input[:data_point_index], \
@@ -236,3 +432,67 @@ class PairTuningCorpusIterator(object):
                       neg_pobj_input[:data_point_index], \
                       pos_arg_idx_input[:data_point_index], \
                       neg_arg_idx_input[:data_point_index]
+
+
+class CachedBatchIterator(object):
+    """
+    Iterate over batches of arrays held in memory, e.g., a validation corpus
+    (or a random subsample of it) read once from a batch iterator like
+    PairTuningCorpusIterator, with a batch size independent of that of the
+    source iterator (see from_batch_iterator()).
+
+    """
+
+    def __init__(self, arrays, batch_size=1):
+        assert arrays, 'arrays cannot be empty'
+        self.arrays = arrays
+        self.num_rows = len(arrays[0])
+        for array in arrays:
+            assert len(array) == self.num_rows, \
+                'all arrays must have the same number of rows'
+        self.batch_size = batch_size
+        self.num_batch = int(ceil(float(self.num_rows) / batch_size))
+
+    @classmethod
+    def from_batch_iterator(cls, batch_iterator, batch_size=None,
+                            sample_size=None, seed=None):
+        """
+        Read all batches from batch_iterator, or only sample_size rows chosen
+        uniformly at random (with a numpy RandomState seeded with seed), in
+        which case len(batch_iterator) must be the number of rows.
+
+        """
+        if batch_size is None:
+            batch_size = batch_iterator.batch_size
+
+        sample = None
+        if sample_size is not None and sample_size < len(batch_iterator):
+            sample = numpy.sort(numpy.random.RandomState(seed).choice(
+                len(batch_iterator), size=sample_size, replace=False))
+
+        chunks = []
+        row_idx = 0
+        for batch in batch_iterator:
+            num_rows = len(batch[0])
+            if sample is None:
+                # copy the batch, as the iterator reuses its buffers
+                chunks.append([numpy.array(array) for array in batch])
+            else:
+                start, end = numpy.searchsorted(
+                    sample, [row_idx, row_idx + num_rows])
+                if end > start:
+                    rows = sample[start:end] - row_idx
+                    chunks.append([array[rows] for array in batch])
+            row_idx += num_rows
+
+        arrays = [numpy.concatenate(chunk_arrays)
+                  for chunk_arrays in zip(*chunks)]
+        return cls(arrays, batch_size=batch_size)
+
+    def __len__(self):
+        return self.num_rows
+
+    def __iter__(self):
+        for start in range(0, self.num_rows, self.batch_size):
+            yield tuple(array[start:start + self.batch_size]
+                        for array in self.arrays)
@@ -0,0 +1,34 @@
+import math
+
+import numpy
+
+from util import Word2VecModel, consts, get_class_name
+
+
+class PredicateSubsampler(object):
+    def __init__(self, keep_prob, include_type=True):
+        # keep probability of every word2vec index, with one extra entry of
+        # 1.0 at the end, so that non-indexed predicates (-1) are always kept
+        self.keep_prob = keep_prob
+        self.include_type = include_type
+
+    @classmethod
+    def build(cls, pred_count_dict, model, include_type=True,
+              count_thres=consts.PRED_COUNT_THRES):
+        assert isinstance(model, Word2VecModel), \
+            'model must be a {} instance'.format(get_class_name(Word2VecModel))
+        keep_prob = numpy.ones(model.vocab_size + 1, dtype=numpy.float32)
+        # a predicate is dropped with probability 1 - sqrt(thres / count)
+        # if its count is higher than the threshold
+        for pred, count in pred_count_dict.items():
+            if count > count_thres:
+                index = model.get_word_index(
+                    pred + '-PRED' if include_type else pred)
+                if index != -1:
+                    keep_prob[index] = math.sqrt(float(count_thres) / count)
+        return cls(keep_prob, include_type=include_type)
+
+    def sample(self, wv_list):
+        # return a boolean array indicating whether to keep each predicate
+        wv_array = numpy.asarray(wv_list, dtype=numpy.int64)
+        return numpy.random.random(len(wv_array)) < self.keep_prob[wv_array]
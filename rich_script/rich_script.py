@@ -4,10 +4,11 @@ from copy import deepcopy
 from itertools import permutations
 
 from indexed_event import IndexedEventTriple
+from pred_subsampler import PredicateSubsampler
 from rich_entity import EntitySalience, RichEntity
 from rich_event import RichEvent
 from script import Script
-from util import Word2VecModel, consts, get_class_name
+from util import Vocabulary, Word2VecModel, consts, get_class_name
 
 
 class RichScript(object):
@@ -19,13 +20,27 @@ class RichScript(object):
         self.num_entities = len(self.rich_entities)
 
     def get_index(self, model, include_type=True, use_unk=True,
-                  pred_count_dict=None):
+                  pred_count_dict=None, pred_subsampler=None):
         assert isinstance(model, Word2VecModel), \
             'model must be a {} instance'.format(get_class_name(Word2VecModel))
         for rich_event in self.rich_events:
             rich_event.get_index(
                 model, include_type=include_type, use_unk=use_unk,
                 pred_count_dict=pred_count_dict)
+        # subsample frequent predicates of all events in one vectorized step
+        if pred_subsampler is not None:
+            assert isinstance(pred_subsampler, PredicateSubsampler), \
+                'pred_subsampler must be a {} instance'.format(
+                    get_class_name(PredicateSubsampler))
+            assert pred_subsampler.include_type == include_type, \
+                'pred_subsampler must be built with include_type={}'.format(
+                    include_type)
+            keep_list = pred_subsampler.sample(
+                [rich_event.rich_pred.get_wv()
+                 for rich_event in self.rich_events])
+            for rich_event, keep in zip(self.rich_events, keep_list):
+                if not keep:
+                    rich_event.rich_pred.wv = -1
 
     # return list of events with indexed predicate (rich_pred.wv != -1)
     def get_indexed_events(self):
@@ -35,6 +50,11 @@ class RichScript(object):
     def get_word2vec_training_seq(
             self, pred_vocab_list, arg_vocab_list, ner_vocab_list,
             include_type=True, include_all_pobj=True):
+        # membership tests against the vocab lists happen for every token,
+        # so make sure they are Vocabulary instances rather than plain lists
+        pred_vocab_list = Vocabulary.from_vocab_list(pred_vocab_list)
+        arg_vocab_list = Vocabulary.from_vocab_list(arg_vocab_list)
+        ner_vocab_list = Vocabulary.from_vocab_list(ner_vocab_list)
         sequence = []
         for rich_event in self.rich_events:
             sequence.extend(
@@ -285,6 +305,7 @@ class RichScript(object):
               filter_stop_events=False):
         assert isinstance(script, Script), \
             'script must be a {} instance'.format(get_class_name(Script))
+        prep_vocab_list = Vocabulary.from_vocab_list(prep_vocab_list)
         # FIXME: should use the token count of original document
         token_count_dict = script.get_token_count(use_lemma=use_lemma)
         rich_entity_list = []
@@ -0,0 +1,41 @@
+import argparse
+import os
+import timeit
+
+from event_comp_model import EventCompositionModel, MODEL_ARCHIVE_NAME
+from util import get_console_logger
+
+parser = argparse.ArgumentParser(
+    description='Convert a saved event composition model into a single '
+                'model archive file, which can be loaded (and memory-mapped) '
+                'much faster for evaluation or serving')
+parser.add_argument('model_path',
+                    help='directory of a saved EventCompositionModel')
+parser.add_argument('--archive_path',
+                    help='path to save the archive to (default: {} in '
+                         'model_path, which load_event_comp_model loads '
+                         'instead of the other files)'.format(
+                        MODEL_ARCHIVE_NAME))
+parser.add_argument('--word2vec_dtype', default='float32',
+                    choices=['float16', 'float32', 'float64'],
+                    help='dtype to store the word vectors in '
+                         '(default: float32)')
+
+args = parser.parse_args()
+
+log = get_console_logger('save_model_archive')
+
+archive_path = args.archive_path
+if archive_path is None:
+    archive_path = os.path.join(args.model_path, MODEL_ARCHIVE_NAME)
+
+log.info('Loading event composition model from {}'.format(args.model_path))
+model = EventCompositionModel.load_model(args.model_path)
+
+log.info('Saving model archive to {}'.format(archive_path))
+model.save_archive(archive_path, word2vec_dtype=args.word2vec_dtype)
+
+start_time = timeit.default_timer()
+EventCompositionModel.load_archive(archive_path)
+log.info('Done, the archive is loaded in {:.3f} seconds'.format(
+    timeit.default_timer() - start_time))
@@ -0,0 +1,68 @@
+import argparse
+import timeit
+
+from numpy_event_comp_model import NumpyEventCompositionModel
+from scoring_service import ScoringServer
+from util import get_console_logger
+
+parser = argparse.ArgumentParser(
+    description='Serve event coherence scores of an event composition model '
+                'over HTTP (see ScoringRequestHandler for the queries), so '
+                'that other tools can query it without loading the model, '
+                'concurrent queries are scored in micro-batches')
+parser.add_argument('model_path',
+                    help='directory of a saved EventCompositionModel, or a '
+                         'model archive')
+parser.add_argument('--host', default='localhost',
+                    help='host to listen on (default: localhost)')
+parser.add_argument('--port', type=int, default=8765,
+                    help='port to listen on (default: 8765)')
+parser.add_argument('--theano', action='store_true',
+                    help='score with the Theano model instead of the NumPy '
+                         'inference engine')
+parser.add_argument('--vector_dtype',
+                    help='dtype to hold the word vectors in, e.g., float16')
+parser.add_argument('--max_batch_size', type=int, default=8192,
+                    help='maximum number of event pairs scored in one batch '
+                         '(default: 8192)')
+parser.add_argument('--max_wait', type=float, default=0.002,
+                    help='seconds to wait for more queries to add to a batch '
+                         '(default: 0.002)')
+
+args = parser.parse_args()
+
+log = get_console_logger('scoring_server')
+
+start_time = timeit.default_timer()
+if args.theano:
+    import theano
+    from event_comp_model import EventCompositionModel
+    if args.model_path.endswith('.archive'):
+        model = EventCompositionModel.load_archive(
+            args.model_path, vector_dtype=args.vector_dtype)
+    else:
+        model = EventCompositionModel.load_model(
+            args.model_path, vector_dtype=args.vector_dtype)
+    float_dtype = theano.config.floatX
+else:
+    if args.model_path.endswith('.archive'):
+        model = NumpyEventCompositionModel.load_archive(
+            args.model_path, vector_dtype=args.vector_dtype)
+    else:
+        model = NumpyEventCompositionModel.load_model(
+            args.model_path, vector_dtype=args.vector_dtype)
+    float_dtype = model.event_vector_network.dtype.name
+log.info('Loaded event composition model from {} in {:.3f} seconds'.format(
+    args.model_path, timeit.default_timer() - start_time))
+
+server = ScoringServer(
+    (args.host, args.port), model, float_dtype=float_dtype,
+    max_batch_size=args.max_batch_size, max_wait=args.max_wait)
+log.info('Serving on http://{}:{}'.format(args.host, args.port))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    server.server_close()
+    log.info('Stopped, batching stats: {}'.format(server.batcher.get_stats()))
@@ -0,0 +1,305 @@
+import BaseHTTPServer
+import Queue
+import SocketServer
+import json
+import threading
+import timeit
+
+import numpy
+
+
+def get_pair_inputs(context_events, candidate_events, arg_idx,
+                    salience=None, float_dtype='float32', vocab_size=None,
+                    num_salience_features=None):
+    """
+    Build the inputs of coherence_fn scoring every candidate event against
+    every context event (as in EventCompositionEvaluator.get_most_coherent),
+    where events are (pred, subj, obj, pobj) word indices, arg_idx is the
+    argument type (1 / 2 / 3 for SUBJ / OBJ / PREP) of all candidates or a
+    list of one per candidate, and salience is a list of the salience
+    features of every candidate (or None if the model does not use them).
+    If vocab_size is given, predicates must be in [0, vocab_size) and
+    arguments in [-1, vocab_size) (-1 for missing arguments), and if
+    num_salience_features is given, every candidate must have that many
+    salience features, otherwise a ValueError is raised.
+
+    The pairs are ordered by candidate, so the scores returned by
+    coherence_fn can be reshaped to (num_candidates, num_context).
+
+    """
+    context_events = numpy.asarray(context_events, dtype=numpy.int32)
+    candidate_events = numpy.asarray(candidate_events, dtype=numpy.int32)
+    if context_events.ndim != 2 or context_events.shape[1] != 4 or \
+            candidate_events.ndim != 2 or candidate_events.shape[1] != 4:
+        raise ValueError(
+            'events must be lists of (pred, subj, obj, pobj) indices')
+    if vocab_size is not None:
+        for events in [context_events, candidate_events]:
+            if len(events) == 0:
+                continue
+            if events[:, 0].min() < 0 or events[:, 0].max() >= vocab_size:
+                raise ValueError(
+                    'predicate indices must be in [0, {})'.format(vocab_size))
+            if events[:, 1:].min() < -1 or events[:, 1:].max() >= vocab_size:
+                raise ValueError(
+                    'argument indices must be in [-1, {})'.format(vocab_size))
+    num_context = len(context_events)
+    num_candidates = len(candidate_events)
+
+    arg_idx = numpy.asarray(arg_idx, dtype=float_dtype)
+    if arg_idx.ndim == 0:
+        arg_idx = numpy.repeat(arg_idx, num_candidates)
+    if arg_idx.shape != (num_candidates,):
+        raise ValueError('expecting arg_idx for {} candidates, found {}'.format(
+            num_candidates, len(arg_idx)))
+
+    inputs_a = numpy.tile(context_events, (num_candidates, 1))
+    inputs_b = numpy.repeat(candidate_events, num_context, axis=0)
+    pair_inputs = [inputs_a[:, i] for i in range(4)] + \
+        [inputs_b[:, i] for i in range(4)] + \
+        [numpy.repeat(arg_idx, num_context)]
+
+    if salience is not None:
+        salience = numpy.asarray(salience, dtype=float_dtype)
+        if salience.ndim != 2 or len(salience) != num_candidates:
+            raise ValueError(
+                'expecting salience features for {} candidates'.format(
+                    num_candidates))
+        if num_salience_features is not None \
+                and salience.shape[1] != num_salience_features:
+            raise ValueError(
+                'expecting {} salience features, found {}'.format(
+                    num_salience_features, salience.shape[1]))
+        pair_inputs.append(numpy.repeat(salience, num_context, axis=0))
+
+    return pair_inputs
+
+
+class _ScoringRequest(object):
+    def __init__(self, pair_inputs):
+        self.pair_inputs = pair_inputs
+        self.num_pairs = len(pair_inputs[0])
+        self.scores = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class CoherenceBatcher(object):
+    """
+    Score batches of event pairs with coherence_fn of a pair composition
+    network (Theano or NumPy), from any number of threads. Requests arriving
+    within max_wait seconds of each other are merged (up to max_batch_size
+    pairs) into one call of coherence_fn in a single scoring thread, which
+    amortizes the per-call overhead over many small requests.
+
+    """
+
+    def __init__(self, pair_composition_network, max_batch_size=8192,
+                 max_wait=0.002):
+        self.coherence_fn = pair_composition_network.coherence_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.queue = Queue.Queue()
+        self.thread = None
+
+        self.num_requests = 0
+        self.num_batches = 0
+        self.num_pairs = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def score(self, pair_inputs):
+        """
+        Return the coherence scores (a vector) of a list of coherence_fn
+        inputs, waiting for the batch they are merged into to be scored.
+        """
+        request = _ScoringRequest(pair_inputs)
+        self.queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.scores
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            request = self.queue.get()
+            if request is None:
+                break
+            batch = [request]
+            num_pairs = request.num_pairs
+            deadline = timeit.default_timer() + self.max_wait
+            while num_pairs < self.max_batch_size:
+                timeout = deadline - timeit.default_timer()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=timeout)
+                except Queue.Empty:
+                    break
+                if request is None:
+                    # score what has been collected before stopping
+                    stopping = True
+                    break
+                batch.append(request)
+                num_pairs += request.num_pairs
+            self.score_batch(batch)
+
+    def score_batch(self, batch):
+        try:
+            batch_inputs = [
+                numpy.concatenate([request.pair_inputs[i] for request in batch])
+                for i in range(len(batch[0].pair_inputs))]
+            scores = numpy.asarray(self.coherence_fn(*batch_inputs)).ravel()
+        except Exception as error:
+            if len(batch) > 1:
+                # do not fail every request merged with a bad one, score
+                # them one by one instead
+                for request in batch:
+                    self.score_batch([request])
+            else:
+                batch[0].error = error
+                batch[0].done.set()
+            return
+
+        self.num_requests += len(batch)
+        self.num_batches += 1
+        self.num_pairs += len(scores)
+
+        start = 0
+        for request in batch:
+            request.scores = scores[start:start + request.num_pairs]
+            start += request.num_pairs
+            request.done.set()
+
+    def get_stats(self):
+        return {
+            'num_requests': self.num_requests,
+            'num_batches': self.num_batches,
+            'num_pairs': self.num_pairs,
+            'avg_batch_requests':
+                float(self.num_requests) / max(self.num_batches, 1),
+            'avg_batch_pairs':
+                float(self.num_pairs) / max(self.num_batches, 1)
+        }
+
+
+class ScoringRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    POST /score with a JSON object of:
+        context: list of (pred, subj, obj, pobj) indices of context events
+        candidates: list of (pred, subj, obj, pobj) indices of candidates
+        arg_idx: argument type of all candidates, or a list of one each
+        salience: list of salience features of every candidate (only if
+            the model uses salience)
+    responds with {"scores": [[...]]} of shape (candidates, context).
+
+    GET /info returns the model configuration, GET /stats the batching
+    statistics.
+
+    """
+    # HTTP/1.1, so that clients can keep their connections alive
+    protocol_version = 'HTTP/1.1'
+    # buffer the response and send it at once, without waiting for the
+    # delayed ACK of the headers
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path == '/info':
+            self.send_json(200, self.server.model_info)
+        elif self.path == '/stats':
+            self.send_json(200, self.server.batcher.get_stats())
+        else:
+            self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        # always read the body, the connection is reused for the next query
+        body = self.rfile.read(int(self.headers.getheader('content-length', 0)))
+        if self.path != '/score':
+            self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+            return
+        try:
+            query = json.loads(body)
+            salience = query.get('salience')
+            if self.server.model_info['use_salience']:
+                if salience is None:
+                    raise ValueError('salience is required by the model')
+            else:
+                salience = None
+            pair_inputs = get_pair_inputs(
+                query['context'], query['candidates'], query['arg_idx'],
+                salience=salience, float_dtype=self.server.float_dtype,
+                vocab_size=self.server.model_info['vocab_size'],
+                num_salience_features=len(
+                    self.server.model_info['salience_features']))
+        except (KeyError, TypeError, ValueError) as error:
+            self.send_json(400, {'error': 'bad query: {}'.format(error)})
+            return
+
+        num_context = len(query['context'])
+        num_candidates = len(query['candidates'])
+        if num_context == 0 or num_candidates == 0:
+            scores = numpy.zeros((num_candidates, num_context))
+        else:
+            try:
+                scores = self.server.batcher.score(pair_inputs)
+            except Exception as error:
+                self.send_json(500, {'error': str(error)})
+                return
+        self.send_json(200, {
+            'scores': scores.reshape(num_candidates, num_context).tolist()})
+
+    def send_json(self, code, obj):
+        body = json.dumps(obj)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # do not log every request
+        pass
+
+
+class ScoringServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Threaded HTTP server scoring event coherence queries with the pair
+    composition network of model (an EventCompositionModel, or a
+    NumpyEventCompositionModel), through a CoherenceBatcher.
+
+    """
+    daemon_threads = True
+    # the default of 5 drops connections of concurrent clients
+    request_queue_size = 128
+
+    def __init__(self, server_address, model, float_dtype='float32',
+                 max_batch_size=8192, max_wait=0.002):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, server_address, ScoringRequestHandler)
+        pair_composition_network = model.pair_composition_network
+        assert pair_composition_network is not None, \
+            'model must have a pair composition network'
+        self.float_dtype = float_dtype
+        self.model_info = {
+            'vocab_size': model.word2vec.vocab_size,
+            'use_salience': pair_composition_network.use_salience,
+            'salience_features': pair_composition_network.salience_features
+        }
+        self.batcher = CoherenceBatcher(
+            pair_composition_network, max_batch_size=max_batch_size,
+            max_wait=max_wait)
+        self.batcher.start()
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        self.batcher.close()
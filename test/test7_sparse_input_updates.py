@@ -0,0 +1,78 @@
+import numpy as np
+import theano
+
+from event_comp_model import EventCompositionModel
+from event_comp_model.pair_composition_trainer import PairCompositionTrainer
+from util import Word2VecModel, consts
+
+# check that full fine tuning with sparse updates of the input vectors (only
+# the rows looked up in a batch) matches the dense updates of the whole matrix
+
+vocab_size = 50
+vector_size = 10
+batch_size = 32
+num_batches = 20
+
+rng = np.random.RandomState(0)
+vectors = rng.randn(vocab_size, vector_size).astype(np.float32)
+vectors /= np.sqrt((vectors ** 2).sum(-1))[..., np.newaxis]
+words = ['w{}'.format(word_id) for word_id in range(vocab_size)]
+
+
+def get_batch():
+    batch = []
+    for _ in range(3):
+        # predicates, then subj / obj / pobj (-1 for missing arguments),
+        # with many duplicate indices in every batch
+        batch.append(rng.randint(0, vocab_size, batch_size).astype(np.int32))
+        for _ in range(3):
+            batch.append(
+                rng.randint(-1, vocab_size, batch_size).astype(np.int32))
+    # arg_idx and salience features of the positive and negative pairs
+    for _ in range(2):
+        batch.append(np.asarray(
+            rng.randint(1, 4, batch_size), dtype=theano.config.floatX))
+    for _ in range(2):
+        batch.append(np.asarray(
+            rng.rand(batch_size, len(consts.SALIENCE_FEATURES)),
+            dtype=theano.config.floatX))
+    return batch
+
+
+batches = [get_batch() for _ in range(num_batches)]
+
+initial_weights = None
+word_vectors = {}
+for sparse_input_updates in [False, True]:
+    word2vec = Word2VecModel.from_vectors('word2vec', words, vectors.copy())
+    model = EventCompositionModel(
+        word2vec, event_vector_layer_sizes=[8, 4],
+        pair_composition_layer_sizes=[5], use_salience=True,
+        salience_features=consts.SALIENCE_FEATURES)
+    if initial_weights is None:
+        initial_weights = (model.event_vector_network.get_weights(),
+                           model.pair_composition_network.get_weights())
+    else:
+        model.event_vector_network.set_weights(initial_weights[0])
+        model.pair_composition_network.set_weights(initial_weights[1])
+
+    trainer = PairCompositionTrainer(
+        model.pair_composition_network, update_event_vectors=True,
+        update_input_vectors=True, sparse_input_updates=sparse_input_updates)
+    cost, updates = trainer.get_triple_cost_updates()
+    train_fn = theano.function(
+        model.pair_composition_network.triple_inputs +
+        [theano.In(trainer.learning_rate_var, value=0.1),
+         theano.In(trainer.batch_weight_var, value=1.0)],
+        cost, updates=updates)
+    for batch in batches:
+        train_fn(*batch)
+    word_vectors[sparse_input_updates] = \
+        model.event_vector_network.get_word_vectors()
+
+max_diff = np.abs(word_vectors[True] - word_vectors[False]).max()
+max_update = np.abs(word_vectors[True] - vectors).max()
+print 'max difference of sparse and dense updates: {}'.format(max_diff)
+print 'max update of the input vectors: {}'.format(max_update)
+assert max_update > 0, 'input vectors are not updated'
+assert max_diff < 1e-5 * max_update, 'sparse updates do not match dense ones'
@@ -0,0 +1,84 @@
+import numpy as np
+import theano
+
+from event_comp_model import EventCompositionModel
+from numpy_event_comp_model import NumpyEventCompositionModel
+from util import Word2VecModel, consts
+
+# check that the numpy forward pass (used by scoring_server.py and
+# build_event_index.py) matches the theano networks it reimplements, with
+# and without salience features, and with empty (-1) arguments
+
+vocab_size = 50
+vector_size = 10
+num_events = 64
+
+rng = np.random.RandomState(0)
+vectors = rng.randn(vocab_size, vector_size).astype(np.float32)
+vectors /= np.sqrt((vectors ** 2).sum(-1))[..., np.newaxis]
+words = ['w{}'.format(word_id) for word_id in range(vocab_size)]
+
+
+def randomize(weights):
+    # random weights of the same structure, so that the empty argument
+    # vectors (initialized to 0) and all biases are actually tested
+    if isinstance(weights, (list, tuple)):
+        return type(weights)(randomize(w) for w in weights)
+    return np.asarray(
+        rng.randn(*np.shape(weights)), dtype=np.asarray(weights).dtype)
+
+
+def get_events():
+    # predicates, then subj / obj / pobj (-1 for missing arguments)
+    events = [rng.randint(0, vocab_size, num_events).astype(np.int32)]
+    for _ in range(3):
+        events.append(rng.randint(-1, vocab_size, num_events).astype(np.int32))
+    return events
+
+
+for use_salience in [False, True]:
+    word2vec = Word2VecModel.from_vectors('word2vec', words, vectors.copy())
+    model = EventCompositionModel(
+        word2vec, event_vector_layer_sizes=[8, 6],
+        pair_composition_layer_sizes=[7, 5], use_salience=use_salience,
+        salience_features=consts.SALIENCE_FEATURES)
+    model.event_vector_network.set_weights(
+        randomize(model.event_vector_network.get_weights()))
+    model.pair_composition_network.set_weights(
+        randomize(model.pair_composition_network.get_weights()))
+
+    numpy_model = NumpyEventCompositionModel.from_weights(
+        word2vec, model.event_vector_network.get_weights(),
+        model.pair_composition_network.get_weights(),
+        use_salience=use_salience, salience_features=consts.SALIENCE_FEATURES)
+
+    events_a = get_events()
+    events_b = get_events()
+    # an event with all arguments missing
+    for events in [events_a, events_b]:
+        for arg_input in events[1:]:
+            arg_input[0] = -1
+
+    projection = model.event_vector_network.project(*events_a)
+    numpy_projection = numpy_model.event_vector_network.project(*events_a)
+
+    pair_inputs = events_a + events_b + [np.asarray(
+        rng.randint(1, 4, num_events), dtype=theano.config.floatX)]
+    if use_salience:
+        pair_inputs.append(np.asarray(
+            rng.rand(num_events, len(consts.SALIENCE_FEATURES)),
+            dtype=theano.config.floatX))
+    coherence = model.pair_composition_network.coherence_fn(*pair_inputs)
+    numpy_coherence = \
+        numpy_model.pair_composition_network.coherence_fn(*pair_inputs)
+
+    print 'use_salience = {}: max difference of projections: {}, ' \
+        'of coherence scores: {}'.format(
+            use_salience, np.abs(projection - numpy_projection).max(),
+            np.abs(coherence - numpy_coherence).max())
+    assert projection.shape == numpy_projection.shape
+    assert np.allclose(projection, numpy_projection, rtol=1e-4, atol=1e-5), \
+        'numpy projections do not match theano ones'
+    assert coherence.shape == numpy_coherence.shape
+    assert np.allclose(coherence, numpy_coherence, rtol=1e-4, atol=1e-5), \
+        'numpy coherence scores do not match theano ones'
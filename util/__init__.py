@@ -3,5 +3,8 @@ from files import prune_counter, read_counter, write_counter
 from files import read_vocab_list
 from files import split_sections
 from logger import get_console_logger
+from profiler import StageProfiler
+from shared_memory import to_shared_memory
 from utils import escape, unescape, get_class_name, cos_sim
+from vocabulary import Vocabulary
 from word2vec import Word2VecModel
@@ -1,6 +1,8 @@
 from collections import Counter
 from itertools import dropwhile
 
+from vocabulary import Vocabulary
+
 
 def split_sections(input_iter, section_heads):
     """
@@ -158,10 +160,6 @@ def prune_counter(counter, thres=1):
 
 
 def read_vocab_list(vocab_list_file):
-    vocab_list = []
-    with open(vocab_list_file, 'r') as fin:
-        for line in fin.readlines():
-            line = line.strip()
-            if line:
-                vocab_list.append(line)
-    return vocab_list
+    # return a Vocabulary (with O(1) membership test) instead of a list,
+    # each file is only read once and the result is shared by all callers
+    return Vocabulary.load(vocab_list_file)
@@ -0,0 +1,154 @@
+import json
+import struct
+from collections import OrderedDict
+from os import rename
+from os.path import exists, getmtime, join
+
+import numpy
+
+# name of the model archive (see EventCompositionModel.save_archive) in a
+# model directory, which is loaded instead of the other files if it exists
+MODEL_ARCHIVE_NAME = 'model.archive'
+
+# files saved by EventCompositionModel.save_model whose contents are stored
+# in the model archive
+MODEL_WEIGHT_FILES = ['word2vec.bin', 'word2vec.vocab', 'ev_weights',
+                      'ev_layer_sizes', 'pc_weights', 'pc_layer_sizes',
+                      'use_salience', 'salience_features']
+
+# first bytes of every model archive
+MODEL_ARCHIVE_MAGIC = b'EVCMODEL'
+# increased on every incompatible change of the format
+MODEL_ARCHIVE_VERSION = 1
+# arrays are aligned, so that they can be memory-mapped efficiently
+MODEL_ARCHIVE_ALIGNMENT = 64
+
+# magic, format version, header length
+_PREFIX_FORMAT = '<8sIQ'
+
+
+def _align(offset):
+    return -(-offset // MODEL_ARCHIVE_ALIGNMENT) * MODEL_ARCHIVE_ALIGNMENT
+
+
+def get_model_archive(directory):
+    """
+    Return the path of the model archive in directory, or None if there is
+    none, or it is older than any of the files saved by save_model in
+    directory (e.g., after the model is retrained), which are then to be
+    loaded instead of the stale archive.
+
+    """
+    archive_path = join(directory, MODEL_ARCHIVE_NAME)
+    if not exists(archive_path):
+        return None
+    archive_mtime = getmtime(archive_path)
+    for fname in MODEL_WEIGHT_FILES:
+        path = join(directory, fname)
+        if exists(path) and getmtime(path) > archive_mtime:
+            return None
+    return archive_path
+
+
+def write_model_archive(path, header, arrays):
+    """
+    Write a model archive to path, which is a single file of a JSON header
+    followed by the raw data of all arrays (an OrderedDict of name to
+    array). The header dict is saved with the format version and the dtype,
+    shape and offset of every array added.
+
+    The archive is written to a temporary file first, and moved to path when
+    complete, so that a reader never sees a partially written archive.
+
+    """
+    header = dict(header)
+    header['format_version'] = MODEL_ARCHIVE_VERSION
+    header['arrays'] = OrderedDict()
+    offset = 0
+    for name, array in arrays.items():
+        array = numpy.asarray(array)
+        header['arrays'][name] = {
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            # relative to the start of the data section
+            'offset': offset
+        }
+        offset = _align(offset + array.nbytes)
+    header_bytes = json.dumps(header).encode('utf-8')
+
+    prefix = struct.pack(
+        _PREFIX_FORMAT, MODEL_ARCHIVE_MAGIC, MODEL_ARCHIVE_VERSION,
+        len(header_bytes))
+    data_start = _align(len(prefix) + len(header_bytes))
+
+    with open(path + '.tmp', 'wb') as f:
+        f.write(prefix)
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header['arrays'][name]['offset'])
+            f.write(numpy.ascontiguousarray(array).tostring())
+        f.truncate(data_start + offset)
+    rename(path + '.tmp', path)
+
+
+def read_model_archive(path, mmap_mode='r'):
+    """
+    Read a model archive written by write_model_archive, and return its
+    header and an OrderedDict of name to array. With mmap_mode (as in
+    numpy.memmap), the arrays are memory-mapped from the file instead of
+    being read into memory, so only the parts accessed are ever read.
+
+    """
+    with open(path, 'rb') as f:
+        prefix = f.read(struct.calcsize(_PREFIX_FORMAT))
+        if len(prefix) < struct.calcsize(_PREFIX_FORMAT):
+            raise IOError('{} is not a model archive'.format(path))
+        magic, version, header_len = struct.unpack(_PREFIX_FORMAT, prefix)
+        if magic != MODEL_ARCHIVE_MAGIC:
+            raise IOError('{} is not a model archive'.format(path))
+        if version != MODEL_ARCHIVE_VERSION:
+            raise IOError(
+                '{} is a model archive of format version {}, '
+                'only version {} is supported'.format(
+                    path, version, MODEL_ARCHIVE_VERSION))
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    data_start = _align(len(prefix) + header_len)
+
+    arrays = OrderedDict()
+    for name, array_info in header['arrays'].items():
+        shape = tuple(array_info['shape'])
+        if 0 in shape:
+            # numpy cannot memory-map empty arrays
+            arrays[name] = numpy.zeros(shape, dtype=array_info['dtype'])
+            continue
+        array = numpy.memmap(
+            path, dtype=array_info['dtype'], shape=shape,
+            offset=data_start + array_info['offset'],
+            mode=mmap_mode or 'r')
+        if mmap_mode is None:
+            array = numpy.array(array)
+        arrays[name] = array
+    return header, arrays
+
+
+def flatten_weights(weights, prefix, arrays):
+    """
+    Add all arrays in weights, nested lists or tuples like those returned by
+    EventVectorNetwork.get_weights(), to the arrays dict, named by prefix
+    and their position, and return the same structure with the names.
+
+    """
+    if isinstance(weights, (list, tuple)):
+        return [flatten_weights(w, '{}/{}'.format(prefix, idx), arrays)
+                for idx, w in enumerate(weights)]
+    arrays[prefix] = weights
+    return prefix
+
+
+def unflatten_weights(structure, arrays):
+    """
+    Inverse of flatten_weights, with nested lists in place of tuples.
+    """
+    if isinstance(structure, list):
+        return [unflatten_weights(s, arrays) for s in structure]
+    return arrays[structure]
@@ -0,0 +1,125 @@
+import cProfile
+import json
+import resource
+import timeit
+from collections import OrderedDict
+from contextlib import contextmanager
+from os import makedirs
+from os.path import exists, join
+
+
+class StageProfiler(object):
+    """
+    Collect wall-clock time (and optionally cProfile stats) for each named
+    stage of a pipeline, together with arbitrary counters, and write them to
+    a JSON report.
+
+    When enabled is False, stage() and count() do nothing, so that scripts
+    can be instrumented unconditionally. Stages should not be nested when
+    profile_dir is set, as only one cProfile profiler can be active at a time.
+
+    """
+
+    def __init__(self, enabled=True, profile_dir=None):
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.stage_times = OrderedDict()
+        self.stage_calls = OrderedDict()
+        self.stage_profiles = OrderedDict()
+        self.counters = OrderedDict()
+        self.start_time = timeit.default_timer()
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        profile = None
+        if self.profile_dir is not None:
+            if name not in self.stage_profiles:
+                self.stage_profiles[name] = cProfile.Profile()
+            profile = self.stage_profiles[name]
+            profile.enable()
+
+        start_time = timeit.default_timer()
+        try:
+            yield
+        finally:
+            elapsed = timeit.default_timer() - start_time
+            if profile is not None:
+                profile.disable()
+            self.stage_times[name] = self.stage_times.get(name, 0.0) + elapsed
+            self.stage_calls[name] = self.stage_calls.get(name, 0) + 1
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def get_stats(self):
+        """
+        Return the stage times, stage calls and counters, e.g., to be sent
+        from a worker process to the parent, which adds them to its own
+        profiler with add_stats().
+        """
+        return OrderedDict([
+            ('stage_times', self.stage_times),
+            ('stage_calls', self.stage_calls),
+            ('counters', self.counters)
+        ])
+
+    def add_stats(self, stats):
+        """
+        Add the stats returned by get_stats() of another profiler. Stage
+        times of parallel workers are summed, so their fractions of the
+        (wall-clock) total time can add up to more than 1.
+        """
+        if not self.enabled:
+            return
+        for name, stage_time in stats['stage_times'].items():
+            self.stage_times[name] = self.stage_times.get(name, 0.0) + \
+                stage_time
+            self.stage_calls[name] = self.stage_calls.get(name, 0) + \
+                stats['stage_calls'][name]
+        for name, value in stats['counters'].items():
+            self.count(name, value)
+
+    def get_report(self):
+        total_time = timeit.default_timer() - self.start_time
+
+        stages = OrderedDict()
+        for name, stage_time in self.stage_times.items():
+            num_calls = self.stage_calls[name]
+            stages[name] = OrderedDict([
+                ('time', stage_time),
+                ('calls', num_calls),
+                ('avg_time', stage_time / num_calls),
+                ('fraction', stage_time / total_time if total_time else 0.0)
+            ])
+
+        throughput = OrderedDict()
+        for name, value in self.counters.items():
+            throughput['{}_per_sec'.format(name)] = \
+                value / total_time if total_time else 0.0
+
+        return OrderedDict([
+            ('total_time', total_time),
+            # ru_maxrss is in kilobytes on Linux (and in bytes on OS X)
+            ('max_rss', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+            ('stages', stages),
+            ('counters', self.counters),
+            ('throughput', throughput)
+        ])
+
+    def write_report(self, report_path):
+        if not self.enabled:
+            return
+        with open(report_path, 'w') as fout:
+            json.dump(self.get_report(), fout, indent=2)
+
+        if self.profile_dir is not None:
+            if not exists(self.profile_dir):
+                makedirs(self.profile_dir)
+            for name, profile in self.stage_profiles.items():
+                profile.dump_stats(
+                    join(self.profile_dir, '{}.prof'.format(name)))
@@ -0,0 +1,19 @@
+import ctypes
+from multiprocessing.sharedctypes import RawArray
+
+import numpy
+
+
+def to_shared_memory(array):
+    """
+    Copy a numpy array into a new array backed by shared memory, which is
+    not copied but shared with all processes forked after it is created.
+    Access to it is not synchronized.
+
+    """
+    array = numpy.ascontiguousarray(array)
+    raw_array = RawArray(ctypes.c_byte, max(array.nbytes, 1))
+    shared_array = numpy.frombuffer(
+        raw_array, dtype=array.dtype, count=array.size).reshape(array.shape)
+    shared_array[...] = array
+    return shared_array
@@ -0,0 +1,52 @@
+from os.path import realpath
+
+
+class Vocabulary(object):
+    # cache of vocabularies loaded from files, keyed by the real path of the
+    # file, so that every caller loading the same file shares one instance
+    _loaded = {}
+
+    def __init__(self, words):
+        self.id2word = []
+        self.word2id = {}
+        for word in words:
+            if word not in self.word2id:
+                self.word2id[word] = len(self.id2word)
+                self.id2word.append(word)
+        self.word_set = frozenset(self.id2word)
+
+    def __contains__(self, word):
+        return word in self.word_set
+
+    def __len__(self):
+        return len(self.id2word)
+
+    def __iter__(self):
+        return iter(self.id2word)
+
+    def get_id(self, word):
+        return self.word2id.get(word, -1)
+
+    def get_word(self, word_id):
+        if word_id < 0 or word_id >= len(self.id2word):
+            return None
+        return self.id2word[word_id]
+
+    @classmethod
+    def from_vocab_list(cls, vocab_list):
+        if vocab_list is None or isinstance(vocab_list, cls):
+            return vocab_list
+        return cls(vocab_list)
+
+    @classmethod
+    def load(cls, vocab_list_file):
+        path = realpath(vocab_list_file)
+        if path not in cls._loaded:
+            words = []
+            with open(vocab_list_file, 'r') as fin:
+                for line in fin.readlines():
+                    line = line.strip()
+                    if line:
+                        words.append(line)
+            cls._loaded[path] = cls(words)
+        return cls._loaded[path]
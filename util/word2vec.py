@@ -3,9 +3,14 @@ from copy import deepcopy
 
 import numpy as np
 from gensim.models import KeyedVectors
+from gensim.models.keyedvectors import Vocab
 
 from utils import get_class_name
 
+# dtypes that vectors can be stored in with reduced precision, both in memory
+# and in word2vec binary files (see Word2VecModel.save_model)
+REDUCED_PRECISION_DTYPES = ['float16']
+
 
 class Word2VecModel(object):
     def __init__(self, name, word2vec):
@@ -14,16 +19,75 @@ class Word2VecModel(object):
         self.vocab_size, self.vector_size = word2vec.syn0.shape
 
     @classmethod
-    def load_model(cls, fname, fvocab=None, binary=True, name=None):
+    def load_model(cls, fname, fvocab=None, binary=True, name=None,
+                   dtype=None):
+        """
+        Load vectors from a word2vec file, and hold them in memory as dtype
+        (default: float32), which can be one of REDUCED_PRECISION_DTYPES to
+        save memory. Vectors returned by get_word_vec and get_index_vec are
+        always upcast to float32.
+
+        """
         if name is None:
             name = os.path.splitext(os.path.basename(fname))[0]
-        word2vec = KeyedVectors.load_word2vec_format(
-            fname, fvocab=fvocab, binary=binary)
+        file_dtype = None
+        if binary:
+            file_dtype = Word2VecModel.get_file_dtype(fname)
+        if file_dtype is None:
+            word2vec = KeyedVectors.load_word2vec_format(
+                fname, fvocab=fvocab, binary=binary,
+                datatype=np.dtype(dtype or np.float32).type)
+        else:
+            word2vec = Word2VecModel.load_reduced_precision_word2vec(
+                fname, fvocab=fvocab, dtype=dtype or file_dtype)
         # normalize word2vec vectors
-        word2vec.init_sims(replace=True)
+        if word2vec.syn0.dtype.name in REDUCED_PRECISION_DTYPES:
+            Word2VecModel.normalize_reduced_precision_vectors(word2vec)
+        else:
+            word2vec.init_sims(replace=True)
         return cls(name=name, word2vec=word2vec)
 
-    def save_model(self, directory, prefix='', save_vocab=True, binary=True):
+    @classmethod
+    def from_vectors(cls, name, words, vectors, counts=None):
+        """
+        Build a model from a list of words and their (already normalized)
+        vectors, e.g., memory-mapped from a file, which are used as is.
+        """
+        assert len(words) == len(vectors), \
+            'expecting {} vectors, found {}'.format(len(words), len(vectors))
+        word2vec = Word2VecModel.new_keyed_vectors(vectors.shape[1])
+        for word_id, word in enumerate(words):
+            count = len(words) - word_id if counts is None else counts[word_id]
+            word2vec.vocab[word] = Vocab(index=word_id, count=count)
+        word2vec.index2word = list(words)
+        word2vec.syn0 = vectors
+        word2vec.syn0norm = vectors
+        return cls(name=name, word2vec=word2vec)
+
+    @staticmethod
+    def new_keyed_vectors(vector_size):
+        """
+        Return an empty KeyedVectors of vector_size, whose vectors are set
+        through the syn0 / syn0norm attributes like in the rest of the class,
+        which are aliases of vectors / vectors_norm since gensim 3.3.
+        """
+        try:
+            # gensim >= 3.3
+            word2vec = KeyedVectors(vector_size)
+        except TypeError:
+            word2vec = KeyedVectors()
+        word2vec.vector_size = vector_size
+        return word2vec
+
+    def save_model(self, directory, prefix='', save_vocab=True, binary=True,
+                   dtype=None):
+        """
+        Save vectors in the word2vec format. If dtype is one of
+        REDUCED_PRECISION_DTYPES, the vectors in the binary file are stored
+        in that dtype, which is marked by a third field in the header line,
+        and can only be read by load_model (not by gensim).
+
+        """
         if not os.path.exists(directory):
             os.makedirs(directory)
         if prefix == '':
@@ -32,7 +96,112 @@ class Word2VecModel(object):
         fvocab = None
         if save_vocab:
             fvocab = os.path.join(directory, '{}.vocab'.format(prefix))
-        self.word2vec.save_word2vec_format(fname, fvocab=fvocab, binary=binary)
+        if dtype is not None \
+                and np.dtype(dtype).name in REDUCED_PRECISION_DTYPES:
+            assert binary, \
+                'vectors can only be saved in {} in binary format'.format(dtype)
+            self.save_reduced_precision_word2vec(fname, fvocab, dtype)
+        else:
+            self.word2vec.save_word2vec_format(
+                fname, fvocab=fvocab, binary=binary)
+
+    @staticmethod
+    def get_file_dtype(fname):
+        """
+        Return the dtype of the vectors in a word2vec binary file saved with
+        reduced precision, or None for a standard (float32) file.
+        """
+        with open(fname, 'rb') as fin:
+            header = fin.readline().split()
+        if len(header) > 2:
+            return header[2]
+        return None
+
+    def save_reduced_precision_word2vec(self, fname, fvocab, dtype):
+        vocab = self.word2vec.vocab
+        vectors = self.word2vec.syn0
+        dtype = np.dtype(dtype).name
+        # store in sorted order, the same as gensim does
+        sorted_vocab = sorted(vocab.items(), key=lambda item: -item[1].count)
+        if fvocab is not None:
+            with open(fvocab, 'wb') as vout:
+                for word, word_vocab in sorted_vocab:
+                    vout.write('{} {}\n'.format(
+                        word.encode('utf-8'), word_vocab.count))
+        with open(fname, 'wb') as fout:
+            fout.write('{} {} {}\n'.format(len(vocab), self.vector_size, dtype))
+            for word, word_vocab in sorted_vocab:
+                fout.write(word.encode('utf-8') + b' ' +
+                           vectors[word_vocab.index].astype(dtype).tostring())
+
+    @staticmethod
+    def load_reduced_precision_word2vec(fname, fvocab=None, dtype=None,
+                                        chunk_size=100 * 1024):
+        """
+        Load a word2vec binary file saved by save_model with a reduced
+        precision dtype, in the same way as gensim loads a standard one.
+        """
+        counts = None
+        if fvocab is not None:
+            counts = {}
+            with open(fvocab, 'rb') as fin:
+                for line in fin:
+                    word, count = line.decode('utf-8').strip().split()
+                    counts[word] = int(count)
+
+        with open(fname, 'rb') as fin:
+            vocab_size, vector_size, file_dtype = fin.readline().split()
+            vocab_size, vector_size = int(vocab_size), int(vector_size)
+            word2vec = Word2VecModel.new_keyed_vectors(vector_size)
+            word2vec.syn0 = np.zeros(
+                (vocab_size, vector_size), dtype=dtype or file_dtype)
+            bytes_per_vector = vector_size * np.dtype(file_dtype).itemsize
+
+            chunk = b''
+            while len(word2vec.index2word) < vocab_size:
+                new_chunk = fin.read(chunk_size)
+                chunk += new_chunk
+                start = 0
+                while len(word2vec.index2word) < vocab_size:
+                    i_space = chunk.find(b' ', start)
+                    if i_space == -1 or \
+                            len(chunk) - i_space - 1 < bytes_per_vector:
+                        break
+                    word = chunk[start:i_space].decode('utf-8').lstrip('\n')
+                    word_id = len(word2vec.index2word)
+                    word2vec.syn0[word_id] = np.frombuffer(
+                        chunk, offset=i_space + 1, count=vector_size,
+                        dtype=file_dtype)
+                    if counts is None:
+                        count = vocab_size - word_id
+                    else:
+                        count = counts.get(word)
+                    word2vec.vocab[word] = Vocab(index=word_id, count=count)
+                    word2vec.index2word.append(word)
+                    start = i_space + 1 + bytes_per_vector
+                chunk = chunk[start:]
+                if len(new_chunk) < chunk_size:
+                    break
+            if len(word2vec.index2word) != vocab_size:
+                raise EOFError(
+                    'unexpected end of input in {}, found {} of {} '
+                    'vectors'.format(
+                        fname, len(word2vec.index2word), vocab_size))
+        return word2vec
+
+    @staticmethod
+    def normalize_reduced_precision_vectors(word2vec, chunk_size=10000):
+        """
+        Normalize the vectors in place like KeyedVectors.init_sims(replace=
+        True), computing the norms in float32 (chunk by chunk, to not upcast
+        the whole matrix at once), as float16 could overflow.
+        """
+        vectors = word2vec.syn0
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start:start + chunk_size].astype(np.float32)
+            chunk /= np.sqrt((chunk ** 2).sum(-1))[..., np.newaxis]
+            vectors[start:start + chunk_size] = chunk
+        word2vec.syn0norm = vectors
 
     def get_vocab(self):
         return self.word2vec.vocab
@@ -66,11 +235,18 @@ class Word2VecModel(object):
         if word == '':
             return None
         try:
-            return self.word2vec.word_vec(word)
+            return self.upcast(self.word2vec.word_vec(word))
         except KeyError:
             return None
 
     def get_index_vec(self, index):
         if index < 0 or index >= self.vocab_size:
             return None
-        return self.word2vec.syn0[index]
+        return self.upcast(self.word2vec.syn0[index])
+
+    @staticmethod
+    def upcast(vector):
+        # vectors stored with reduced precision are computed with in float32
+        if vector.dtype.name in REDUCED_PRECISION_DTYPES:
+            return vector.astype(np.float32)
+        return vector
@@ -0,0 +1,61 @@
+import argparse
+import timeit
+
+from event_comp_model import EventCompositionModel
+from event_comp_model import FUNCTION_CACHE_DIR_ENV
+from event_comp_model import event_comp_dir_dict, get_event_comp_dir
+from event_comp_model.function_cache import FunctionCache
+from util import get_console_logger
+
+parser = argparse.ArgumentParser(
+    description='Compile the Theano functions of event composition models '
+                'and store them in a cache directory, so that later runs '
+                'loading models of the same architectures (with '
+                'function_cache_dir, or the {} environment variable) skip '
+                'the compilation'.format(FUNCTION_CACHE_DIR_ENV))
+parser.add_argument('cache_dir', help='directory of the compiled function cache')
+parser.add_argument('model_paths', nargs='*',
+                    help='directories of saved EventCompositionModels')
+parser.add_argument('--model_key', action='append', default=[],
+                    choices=sorted(event_comp_dir_dict.keys()),
+                    help='key of a model in event_comp_dir_dict, '
+                         'can be used multiple times')
+parser.add_argument('--vector_dtype',
+                    help='dtype to hold the word vectors in, e.g., float16 '
+                         '(default: theano floatX)')
+
+args = parser.parse_args()
+
+log = get_console_logger('warm_up_function_cache')
+
+model_paths = list(args.model_paths)
+for model_key in args.model_key:
+    model_paths.append(get_event_comp_dir(model_key))
+
+if not model_paths:
+    parser.error('no model to warm up, give model_paths or --model_key')
+
+function_cache = FunctionCache(args.cache_dir)
+
+for model_path in model_paths:
+    log.info('Loading event composition model from {}'.format(model_path))
+    start_time = timeit.default_timer()
+    # compiles and saves the functions on a cache miss
+    model = EventCompositionModel.load_model(
+        model_path, function_cache_dir=args.cache_dir,
+        vector_dtype=args.vector_dtype)
+    elapsed = timeit.default_timer() - start_time
+
+    pair_composition_network = model.pair_composition_network
+    cache_key = FunctionCache.get_key(
+        vector_size=model.word2vec.vector_size,
+        event_vector_layer_sizes=model.event_vector_network.layer_sizes,
+        pair_composition_layer_sizes=pair_composition_network.layer_sizes
+        if pair_composition_network else None,
+        use_salience=pair_composition_network.use_salience
+        if pair_composition_network else False,
+        num_salience_features=pair_composition_network.num_salience_features
+        if pair_composition_network else 0,
+        vector_dtype=args.vector_dtype)
+    log.info('Done in {:.3f} seconds, cached as {}'.format(
+        elapsed, function_cache.get_path(cache_key)))
@@ -1,8 +1,10 @@
 import gensim
 import bz2
+import json
 import logging
 import os
 import argparse
+from itertools import islice
 
 logging.basicConfig(
     format='%(asctime)s : %(levelname) s : : %(message)s', level=logging.INFO)
@@ -58,6 +60,23 @@ parser.add_argument(
 parser.add_argument(
     '--binary', type=int, default=0, choices=[0, 1],
     help='Save the resulting vectors in binary mode; default is 0 (off)')
+parser.add_argument(
+    '--save_model',
+    help='File path to save the full model (including training state), '
+         'which can be continued later with --incremental')
+parser.add_argument(
+    '--incremental',
+    help='File path of a full model saved with --save_model; if given, '
+         'extend its vocabulary with the data in --train and continue '
+         'training on that data only (other model parameters are ignored)')
+parser.add_argument(
+    '--checkpoint_dir',
+    help='Directory to save training checkpoints; if it already contains a '
+         'checkpoint, training is resumed from there')
+parser.add_argument(
+    '--checkpoint_every', type=int, default=1000000,
+    help='Number of sentences between two checkpoints; default is 1000000, '
+         'only used with --checkpoint_dir')
 
 opts = parser.parse_args()
 
@@ -72,6 +91,8 @@ assert opts.min_count >= 0, '--min_count must be a non-negative integer'
 assert opts.max_vocab_size is None or opts.max_vocab_size > 0, \
     '--max_vocab_size must be None or a positive integer'
 assert opts.alpha > 0, '--alpha must be a positive number'
+assert opts.checkpoint_every > 0, \
+    '--checkpoint_every must be a positive integer'
 
 logger = logging.getLogger('word2vec-trainer')
 logger.info('Training word2vec model with parameters {}'.format(opts))
@@ -82,27 +103,146 @@ class MySentences(object):
         self.dirname = dirname
 
     def __iter__(self):
-        for fname in os.listdir(self.dirname):
+        # sort the file names so that the sentence order is deterministic,
+        # which is required to resume training from a sentence offset
+        for fname in sorted(os.listdir(self.dirname)):
             for line in bz2.BZ2File(os.path.join(self.dirname, fname)):
                 yield line.split()
 
+
+def load_checkpoint_state(checkpoint_dir):
+    state_file = os.path.join(checkpoint_dir, 'state')
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, 'r') as fin:
+        return json.load(fin)
+
+
+def save_checkpoint(model, checkpoint_dir, epoch, offset, schedule):
+    # save the model under a new name, and only switch the state file to it
+    # after the model is completely written, so that a crash while saving
+    # never leaves us without a valid checkpoint
+    model_file = os.path.join(
+        checkpoint_dir, 'model_epoch_{}_offset_{}'.format(epoch, offset))
+    model.save(model_file)
+
+    prev_state = load_checkpoint_state(checkpoint_dir)
+    state_file = os.path.join(checkpoint_dir, 'state')
+    with open(state_file + '.tmp', 'w') as fout:
+        state = {'model': model_file, 'epoch': epoch, 'offset': offset}
+        state.update(schedule)
+        json.dump(state, fout)
+    os.rename(state_file + '.tmp', state_file)
+    logger.info('Saved checkpoint at epoch {}, sentence {} to {}'.format(
+        epoch, offset, model_file))
+
+    # remove files of the previous checkpoint (including the numpy arrays
+    # that gensim stores separately for large models)
+    if prev_state is not None and prev_state['model'] != model_file:
+        prev_model_name = os.path.basename(prev_state['model'])
+        for fname in os.listdir(checkpoint_dir):
+            if fname == prev_model_name or \
+                    fname.startswith(prev_model_name + '.'):
+                os.remove(os.path.join(checkpoint_dir, fname))
+
+
+def get_schedule(model):
+    # the number of epochs and the initial and final learning rates of the
+    # whole training process, which are saved with every checkpoint, as
+    # every call of model.train() on a chunk overwrites them in the model
+    return {'iter': model.iter, 'alpha': model.alpha,
+            'min_alpha': model.min_alpha}
+
+
+def train_with_checkpoints(model, sentences, checkpoint_dir, checkpoint_every,
+                           schedule, start_epoch=0, start_offset=0):
+    corpus_count = model.corpus_count
+    iterations = schedule['iter']
+    alpha = schedule['alpha']
+    min_alpha = schedule['min_alpha']
+    total_sentences = float(iterations * corpus_count)
+
+    def _alpha_at(epoch, offset):
+        # linearly decay the learning rate from alpha to min_alpha over the
+        # whole training process, the same way as a single call of
+        # model.train() would do
+        progress = (epoch * corpus_count + offset) / total_sentences
+        return alpha - (alpha - min_alpha) * progress
+
+    for epoch in range(start_epoch, iterations):
+        offset = start_offset if epoch == start_epoch else 0
+        logger.info('Training epoch {} from sentence {}'.format(epoch, offset))
+        sentence_it = islice(iter(sentences), offset, None)
+        while True:
+            chunk = list(islice(sentence_it, checkpoint_every))
+            if not chunk:
+                break
+            start_alpha = _alpha_at(epoch, offset)
+            offset += len(chunk)
+            end_alpha = _alpha_at(epoch, offset)
+            model.train(chunk, total_examples=len(chunk), epochs=1,
+                        start_alpha=start_alpha, end_alpha=end_alpha)
+            if offset >= corpus_count:
+                save_checkpoint(model, checkpoint_dir, epoch + 1, 0, schedule)
+            else:
+                save_checkpoint(model, checkpoint_dir, epoch, offset, schedule)
+
+
 logger.info('Reading training data from {}'.format(opts.train))
 sentences = MySentences(opts.train)
 
-model = gensim.models.Word2Vec(
-    sentences,
-    sg=opts.sg,
-    size=opts.size,
-    window=opts.window,
-    sample=opts.sample,
-    hs=opts.hs,
-    negative=opts.negative,
-    workers=opts.workers,
-    iter=opts.iter,
-    min_count=opts.min_count,
-    max_vocab_size=opts.max_vocab_size,
-    alpha=opts.alpha
-)
+checkpoint_state = None
+if opts.checkpoint_dir is not None:
+    if not os.path.exists(opts.checkpoint_dir):
+        os.makedirs(opts.checkpoint_dir)
+    checkpoint_state = load_checkpoint_state(opts.checkpoint_dir)
+
+if checkpoint_state is not None:
+    # the vocabulary of the checkpoint is already built (or updated)
+    logger.info('Resuming from checkpoint {} at epoch {}, sentence {}'.format(
+        checkpoint_state['model'], checkpoint_state['epoch'],
+        checkpoint_state['offset']))
+    model = gensim.models.Word2Vec.load(checkpoint_state['model'])
+elif opts.incremental is not None:
+    logger.info('Loading previous model from {}'.format(opts.incremental))
+    model = gensim.models.Word2Vec.load(opts.incremental)
+    logger.info('Updating vocabulary with new data')
+    model.build_vocab(sentences, update=True)
+else:
+    model = gensim.models.Word2Vec(
+        sg=opts.sg,
+        size=opts.size,
+        window=opts.window,
+        sample=opts.sample,
+        hs=opts.hs,
+        negative=opts.negative,
+        workers=opts.workers,
+        iter=opts.iter,
+        min_count=opts.min_count,
+        max_vocab_size=opts.max_vocab_size,
+        alpha=opts.alpha
+    )
+    model.build_vocab(sentences)
+
+if opts.checkpoint_dir is not None:
+    if checkpoint_state is None:
+        start_epoch, start_offset = 0, 0
+        schedule = get_schedule(model)
+    else:
+        start_epoch = checkpoint_state['epoch']
+        start_offset = checkpoint_state['offset']
+        schedule = dict((key, checkpoint_state[key])
+                        for key in ['iter', 'alpha', 'min_alpha'])
+    train_with_checkpoints(
+        model, sentences, opts.checkpoint_dir, opts.checkpoint_every,
+        schedule, start_epoch=start_epoch, start_offset=start_offset)
+else:
+    model.train(sentences, total_examples=model.corpus_count,
+                epochs=model.iter)
+
+if opts.save_model is not None:
+    logger.info('Outputting full model to {}'.format(opts.save_model))
+    model.save(opts.save_model)
 
 logger.info('Outputting resulting word vectors to {}'.format(opts.output))
 if opts.save_vocab is not None: